@@ -0,0 +1,146 @@
+"""
+按内容寻址的上传文件存储：<root>/<sha256 前两位>/<sha256>。
+
+客户端先 HEAD /blobs/{sha256} 询问是否已有该内容，已有时直接按哈希提交处理请求，不再重复上传。
+
+blob 的 mtime 记录最近一次使用（上传、HEAD 命中、链接到作业目录），sweep 按它做 LRU 清理。
+作业目录中的输入是硬链接或副本，删除 blob 不影响已入队的作业；之后按哈希提交会得到 404，客户端重新上传即可。
+"""
+import os
+import re
+import time
+import shutil
+import hashlib
+import tempfile
+from typing import BinaryIO, Optional, Tuple
+
+_SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+_CHUNK = 1024 * 1024
+# 崩溃遗留的 .upload_* 临时文件超过该时间(秒)即删除
+_STALE_UPLOAD_SECONDS = 24 * 3600
+
+
+def is_sha256(value: str) -> bool:
+    return bool(value) and bool(_SHA256_RE.match(value))
+
+
+class BlobStore:
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, sha256: str) -> str:
+        if not is_sha256(sha256):
+            raise ValueError(f"非法 sha256: {sha256}")
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    def exists(self, sha256: str) -> bool:
+        return is_sha256(sha256) and os.path.isfile(self.path(sha256))
+
+    def size(self, sha256: str) -> int:
+        return os.path.getsize(self.path(sha256))
+
+    def touch(self, sha256: str) -> None:
+        """记录一次使用，推迟该 blob 被 sweep 清理。"""
+        try:
+            os.utime(self.path(sha256))
+        except (OSError, ValueError):
+            pass
+
+    def sweep(self, max_age: float, max_bytes: int = 0, min_age: float = 600) -> Tuple[int, int]:
+        """
+        LRU 清理：删除超过 max_age 秒（0 表示不限）未使用的 blob；总量仍超过 max_bytes（0 表示不限）时，
+        再从最久未使用的开始删，但不删 min_age 秒内用过的（它们可能正被按哈希提交）。
+
+        :return: (删除个数, 释放字节数)；仍被作业目录硬链接的 blob 删除后不释放空间，不计入字节数
+        """
+        now = time.time()
+        blobs = []
+        for dirpath, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if name.startswith(".upload_"):
+                    if now - st.st_mtime > _STALE_UPLOAD_SECONDS:
+                        _remove(path)
+                    continue
+                if is_sha256(name):
+                    blobs.append((st.st_mtime, st.st_size, st.st_nlink, path))
+        blobs.sort()
+        total = sum(size for _, size, _, _ in blobs)
+        removed = freed = 0
+        for mtime, size, nlink, path in blobs:
+            idle = now - mtime
+            expired = max_age > 0 and idle > max_age
+            over_budget = max_bytes > 0 and total > max_bytes and idle > min_age
+            if not expired and not over_budget:
+                continue
+            if _remove(path):
+                removed += 1
+                total -= size
+                freed += size if nlink <= 1 else 0
+        return removed, freed
+
+    def put_stream(self, src: BinaryIO, expected_sha256: Optional[str] = None) -> Tuple[str, int, bool]:
+        """
+        边读边算哈希写入临时文件，校验后原子改名入库。
+
+        :param src: 可读的二进制流（UploadFile.file）
+        :param expected_sha256: 期望的哈希，不一致时抛 ValueError 且不入库
+        :return: (sha256, 字节数, 是否已存在)
+        """
+        if expected_sha256 is not None and not is_sha256(expected_sha256):
+            raise ValueError(f"非法 sha256: {expected_sha256}")
+        h = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(prefix=".upload_", dir=self.root)
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while True:
+                    chunk = src.read(_CHUNK)
+                    if not chunk:
+                        break
+                    h.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+            sha = h.hexdigest()
+            if expected_sha256 is not None and sha != expected_sha256:
+                raise ValueError(f"内容哈希不匹配：期望 {expected_sha256}，实际 {sha}")
+            dst = self.path(sha)
+            if os.path.isfile(dst):
+                self.touch(sha)
+                return sha, size, True
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            os.replace(tmp, dst)
+            tmp = None
+            return sha, size, False
+        finally:
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
+
+    def link_to(self, sha256: str, dst: str) -> str:
+        """把 blob 放到作业目录：优先硬链接（不占额外空间），跨文件系统时复制。"""
+        src = self.path(sha256)
+        if not os.path.isfile(src):
+            raise FileNotFoundError(f"blob 不存在: {sha256}")
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        try:
+            os.link(src, dst)
+        except FileNotFoundError:
+            # 检查之后恰好被 sweep 删除
+            raise FileNotFoundError(f"blob 不存在: {sha256}")
+        except OSError:
+            shutil.copyfile(src, dst)
+        self.touch(sha256)
+        return dst
+
+
+def _remove(path: str) -> bool:
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
@@ -0,0 +1,120 @@
+"""
+客户端识别与配额：多个团队共用同一处理服务时，按 API key / 请求头区分客户端，队列按权重公平调度。
+
+识别顺序：
+    1. X-API-Key 或 Authorization: Bearer <key>，在 FASTAPI_CLIENTS_FILE 中查找对应客户端
+    2. X-Client-Id 请求头（未配置 key 的内部调用方），记为 hdr:<id>
+    3. 请求来源 IP，记为 ip:<host>
+
+未登记的客户端标识都带前缀，不会与配置文件中的客户端名相同；只有登记的客户端能设置权重与并发上限，
+未登记客户端按默认值登记一次，之后的请求不能改写。
+
+FASTAPI_CLIENTS_FILE 为 JSON：
+
+    {"<api key>": {"name": "team-a", "weight": 2, "max_running": 2}, ...}
+
+环境变量：
+    FASTAPI_CLIENTS_FILE         API key 配置文件，缺省时所有客户端权重相同
+    FASTAPI_REQUIRE_API_KEY      为 1 时拒绝未登记的 key 与无 key 请求
+    FASTAPI_CLIENT_WEIGHT        未登记客户端的权重，默认 1
+    FASTAPI_CLIENT_MAX_RUNNING   未登记客户端同时运行的作业上限，默认 0（不限）
+"""
+import os
+import re
+import json
+import hashlib
+import logging
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WEIGHT = float(os.environ.get("FASTAPI_CLIENT_WEIGHT", "1"))
+DEFAULT_MAX_RUNNING = int(os.environ.get("FASTAPI_CLIENT_MAX_RUNNING", "0"))
+REQUIRE_API_KEY = os.environ.get("FASTAPI_REQUIRE_API_KEY", "0") == "1"
+
+_CLIENT_ID_RE = re.compile(r"[^0-9A-Za-z._:@-]+")
+# 未登记客户端标识的前缀，配置文件中的客户端名不能使用
+_RESERVED_PREFIXES = ("key:", "hdr:", "ip:")
+
+
+class ClientPolicy:
+    """
+    一个客户端的调度参数。
+
+    :param client_id: 客户端标识（队列按它分组）
+    :param weight: 公平份额权重，权重 2 的客户端在竞争时获得两倍的处理时间
+    :param max_running: 同时运行的作业上限，0 表示不限
+    :param registered: 是否为 FASTAPI_CLIENTS_FILE 中登记的客户端（只有它们的调度参数会写入队列）
+    """
+
+    def __init__(self, client_id: str, weight: float = DEFAULT_WEIGHT, max_running: int = DEFAULT_MAX_RUNNING,
+                 registered: bool = False):
+        self.client_id = client_id
+        self.weight = max(0.01, float(weight))
+        self.max_running = max(0, int(max_running))
+        self.registered = registered
+
+    def to_dict(self) -> dict:
+        return {"client": self.client_id, "weight": self.weight, "max_running": self.max_running}
+
+
+class UnknownClient(Exception):
+    """要求 API key 时，请求未携带或携带了未登记的 key。"""
+
+
+def _load_keys(path: Optional[str]) -> Dict[str, ClientPolicy]:
+    if not path:
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"读取客户端配置失败 {path}: {e}")
+        return {}
+    keys = {}
+    for key, conf in raw.items():
+        conf = conf or {}
+        name = conf.get("name") or key[:8]
+        if name.startswith(_RESERVED_PREFIXES):
+            logger.error(f"客户端名 {name} 使用了保留前缀 {'/'.join(_RESERVED_PREFIXES)}，已忽略")
+            continue
+        keys[key] = ClientPolicy(
+            name,
+            conf.get("weight", DEFAULT_WEIGHT),
+            conf.get("max_running", DEFAULT_MAX_RUNNING),
+            registered=True,
+        )
+    return keys
+
+
+class ClientRegistry:
+    """根据请求头确定客户端及其调度参数。"""
+
+    def __init__(self, clients_file: Optional[str] = None, require_key: bool = REQUIRE_API_KEY):
+        self.require_key = require_key
+        self._keys = _load_keys(clients_file)
+
+    def identify(self, headers, remote_host: Optional[str] = None) -> ClientPolicy:
+        """
+        :param headers: 请求头（大小写不敏感的映射）
+        :param remote_host: 请求来源地址
+        :raises UnknownClient: require_key 开启且 key 缺失或未登记
+        """
+        key = headers.get("x-api-key") or ""
+        auth = headers.get("authorization") or ""
+        if not key and auth.lower().startswith("bearer "):
+            key = auth[7:].strip()
+        if key:
+            policy = self._keys.get(key)
+            if policy is not None:
+                return policy
+            if self.require_key:
+                raise UnknownClient("未登记的 API key")
+            # 未登记的 key 也按 key 分组，但不在日志/接口中暴露原文
+            return ClientPolicy("key:" + hashlib.sha256(key.encode("utf-8")).hexdigest()[:12])
+        if self.require_key:
+            raise UnknownClient("缺少 API key")
+        client_id = _CLIENT_ID_RE.sub("", headers.get("x-client-id") or "")[:64]
+        if client_id:
+            return ClientPolicy("hdr:" + client_id)
+        return ClientPolicy(f"ip:{remote_host or 'unknown'}")
@@ -0,0 +1,292 @@
+"""
+hybrid 处理器：按页路由。
+
+Confluence 导出的 PDF 大多数页面带有真实文本层，这些页面直接用 PyMuPDF 在进程内抽取为 Markdown；
+只有扫描页、大图页、表格密集页等“复杂页”才交给 mineru。连续的复杂页合并成一个子 PDF，
+所有子 PDF 放在同一目录下由 mineru 一次处理，最后按页序合并为一个 Markdown。
+
+输出目录结构与 mineru 保持一致，客户端无需改动：
+
+    <out_dir>/<base>/hybrid/<base>.md
+    <out_dir>/<base>/hybrid/images/<sha256>.<ext>
+    <out_dir>/<base>/hybrid/<base>_pages.json   每页的路由结果与特征
+"""
+import os
+import re
+import glob
+import json
+import shutil
+import hashlib
+import logging
+from collections import Counter
+from typing import Callable, List, Optional
+
+try:
+    import pymupdf as fitz
+except ImportError:
+    try:
+        import fitz  # 旧版 PyMuPDF
+    except ImportError:  # 可选依赖，缺失时 main 回退到整份 mineru
+        fitz = None
+
+logger = logging.getLogger(__name__)
+
+HYBRID_AVAILABLE = fitz is not None
+
+# 页面分类阈值
+MIN_TEXT_CHARS = 40          # 文本层字符数低于该值视为扫描页/无文本层
+MAX_IMAGE_AREA = 0.25        # 图片面积占页面比例超过该值交给 mineru
+MAX_RULING_LINES = 12        # 水平/垂直线段数量超过该值视为表格页
+MAX_BAD_CHAR_RATIO = 0.05    # 乱码（U+FFFD/私有区）比例超过该值说明文本层不可用
+MIN_TEXT_COVERAGE = 0.02     # 文本块面积占页面比例过低且有图片时视为扫描页
+
+_BAD_CHAR = re.compile("[\ufffd\ue000-\uf8ff]")
+_BULLET = re.compile(r"^[•●▪◦‣·]\s*")
+
+
+class PageInfo:
+    """单页特征与路由结果。"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.chars = 0
+        self.text_coverage = 0.0
+        self.image_area = 0.0
+        self.ruling_lines = 0
+        self.bad_char_ratio = 0.0
+        self.route = "text"
+        self.reason = ""
+
+    def to_dict(self) -> dict:
+        return {
+            "page": self.index + 1,
+            "route": self.route,
+            "reason": self.reason,
+            "chars": self.chars,
+            "text_coverage": round(self.text_coverage, 4),
+            "image_area": round(self.image_area, 4),
+            "ruling_lines": self.ruling_lines,
+            "bad_char_ratio": round(self.bad_char_ratio, 4),
+        }
+
+
+def _rect_area(r) -> float:
+    return max(0.0, (r[2] - r[0])) * max(0.0, (r[3] - r[1]))
+
+
+def classify_page(page) -> PageInfo:
+    """
+    根据文本层覆盖率、图片面积与表格线密度判断页面是否需要 mineru。
+
+    :param page: fitz.Page
+    :return: PageInfo，route 为 "text" 或 "mineru"
+    """
+    info = PageInfo(page.number)
+    page_area = _rect_area(page.rect) or 1.0
+
+    text = page.get_text("text")
+    stripped = "".join(text.split())
+    info.chars = len(stripped)
+    info.bad_char_ratio = len(_BAD_CHAR.findall(stripped)) / info.chars if info.chars else 0.0
+
+    text_area = sum(_rect_area(b[:4]) for b in page.get_text("blocks") if b[6] == 0)
+    info.text_coverage = min(1.0, text_area / page_area)
+
+    image_area = sum(_rect_area(tuple(img["bbox"])) for img in page.get_image_info())
+    info.image_area = min(1.0, image_area / page_area)
+
+    rulings = 0
+    for d in page.get_drawings():
+        for item in d.get("items", ()):
+            if item[0] == "l":
+                p1, p2 = item[1], item[2]
+                if abs(p1.x - p2.x) < 1 or abs(p1.y - p2.y) < 1:
+                    rulings += 1
+            elif item[0] == "re":
+                rulings += 4
+    info.ruling_lines = rulings
+
+    if info.chars < MIN_TEXT_CHARS and (info.image_area > 0 or rulings):
+        info.route, info.reason = "mineru", "no_text_layer"
+    elif info.bad_char_ratio > MAX_BAD_CHAR_RATIO:
+        info.route, info.reason = "mineru", "broken_text_layer"
+    elif info.image_area > MAX_IMAGE_AREA:
+        info.route, info.reason = "mineru", "image_heavy"
+    elif info.image_area > 0 and info.text_coverage < MIN_TEXT_COVERAGE:
+        info.route, info.reason = "mineru", "scanned"
+    elif rulings > MAX_RULING_LINES:
+        info.route, info.reason = "mineru", "table_dense"
+    return info
+
+
+def _body_font_size(doc, pages: List[int]) -> float:
+    sizes = Counter()
+    for i in pages:
+        for block in doc[i].get_text("dict")["blocks"]:
+            for line in block.get("lines", ()):
+                for sp in line["spans"]:
+                    sizes[round(sp["size"], 1)] += len(sp["text"].strip())
+    return sizes.most_common(1)[0][0] if sizes else 10.0
+
+
+def _heading_prefix(size: float, bold: bool, text: str, body: float) -> str:
+    if size >= body * 1.6:
+        return "# "
+    if size >= body * 1.3:
+        return "## "
+    if size >= body * 1.12 or (bold and len(text) <= 60 and not text.endswith(("。", ".", "，", ","))):
+        return "### "
+    return ""
+
+
+def _save_image(data: bytes, ext: str, img_dir: str) -> str:
+    name = f"{hashlib.sha256(data).hexdigest()}.{ext or 'png'}"
+    path = os.path.join(img_dir, name)
+    if not os.path.exists(path):
+        with open(path, "wb") as f:
+            f.write(data)
+    return name
+
+
+def page_to_markdown(page, body_size: float, img_dir: str) -> str:
+    """
+    把一个文本层页面按阅读顺序转成 Markdown：字号/粗体推断标题，项目符号转列表，内嵌小图片落盘并引用。
+
+    :param page: fitz.Page
+    :param body_size: 正文字号（用于标题判断）
+    :param img_dir: 图片输出目录（与 md 同级的 images/）
+    """
+    parts = []
+    for block in page.get_text("dict", sort=True)["blocks"]:
+        if block.get("type") == 1:
+            data = block.get("image")
+            if data:
+                name = _save_image(data, block.get("ext", "png"), img_dir)
+                parts.append(f"![](images/{name})")
+            continue
+        paragraph = []
+        for line in block.get("lines", ()):
+            spans = [sp for sp in line["spans"] if sp["text"].strip()]
+            if not spans:
+                continue
+            text = "".join(sp["text"] for sp in line["spans"]).strip()
+            size = max(sp["size"] for sp in spans)
+            bold = all(sp["flags"] & 16 for sp in spans)
+            prefix = _heading_prefix(size, bold, text, body_size)
+            if prefix:
+                if paragraph:
+                    parts.append(" ".join(paragraph))
+                    paragraph = []
+                parts.append(prefix + text)
+            elif _BULLET.match(text):
+                if paragraph:
+                    parts.append(" ".join(paragraph))
+                    paragraph = []
+                parts.append("- " + _BULLET.sub("", text))
+            else:
+                paragraph.append(text)
+        if paragraph:
+            parts.append(" ".join(paragraph))
+    return "\n\n".join(parts)
+
+
+def _page_runs(infos: List[PageInfo]):
+    """把连续同路由的页面合并为 (route, start, end) 区间（含 end）。"""
+    runs = []
+    for info in infos:
+        if runs and runs[-1][0] == info.route and runs[-1][2] == info.index - 1:
+            runs[-1][2] = info.index
+        else:
+            runs.append([info.route, info.index, info.index])
+    return [tuple(r) for r in runs]
+
+
+def _find_run_md(runs_out: str, run_name: str) -> Optional[str]:
+    for md in glob.glob(os.path.join(runs_out, run_name, "**", f"{run_name}.md"), recursive=True):
+        return md
+    return None
+
+
+def process_pdf_hybrid(
+    pdf_path: str,
+    out_dir: str,
+    work_dir: str,
+    run_mineru: Callable[[str, str], None],
+    base: Optional[str] = None,
+) -> str:
+    """
+    按页路由处理 PDF，返回 mineru 风格的文档目录 <out_dir>/<base>。
+
+    :param pdf_path: 输入 PDF
+    :param out_dir: 输出目录（/process/zip 打包其中的 <base> 目录）
+    :param work_dir: 存放复杂页子 PDF 与 mineru 中间产物的目录（不会被打包）
+    :param run_mineru: run_mineru(输入文件或目录, 输出目录)，失败时抛异常
+    :param base: 文档名，默认取 PDF 文件名
+    """
+    if fitz is None:
+        raise RuntimeError("hybrid 处理器需要 PyMuPDF：pip install pymupdf")
+    base = base or os.path.splitext(os.path.basename(pdf_path))[0]
+    md_dir = os.path.join(out_dir, base, "hybrid")
+    img_dir = os.path.join(md_dir, "images")
+    os.makedirs(img_dir, exist_ok=True)
+
+    doc = fitz.open(pdf_path)
+    try:
+        infos = [classify_page(page) for page in doc]
+        runs = _page_runs(infos)
+        text_pages = [i.index for i in infos if i.route == "text"]
+        body_size = _body_font_size(doc, text_pages)
+        mineru_runs = [r for r in runs if r[0] == "mineru"]
+        logger.info(
+            f"hybrid: {base} 共 {len(infos)} 页，文本层 {len(text_pages)} 页，"
+            f"mineru {len(infos) - len(text_pages)} 页（{len(mineru_runs)} 段）"
+        )
+
+        # 复杂页区间写成子 PDF，放在同一目录由 mineru 一次处理，固定开销只付一次
+        run_md = {}
+        if mineru_runs:
+            runs_in = os.path.join(work_dir, "hybrid_runs_in")
+            runs_out = os.path.join(work_dir, "hybrid_runs_out")
+            os.makedirs(runs_in, exist_ok=True)
+            os.makedirs(runs_out, exist_ok=True)
+            names = {}
+            for _, start, end in mineru_runs:
+                name = f"{base}_p{start + 1:04d}-{end + 1:04d}"
+                sub = fitz.open()
+                sub.insert_pdf(doc, from_page=start, to_page=end)
+                sub.save(os.path.join(runs_in, f"{name}.pdf"))
+                sub.close()
+                names[start] = name
+            run_mineru(runs_in, runs_out)
+            for start, name in names.items():
+                md = _find_run_md(runs_out, name)
+                if not md:
+                    raise RuntimeError(f"未找到 mineru 生成的 Markdown: {name}")
+                src_images = os.path.join(os.path.dirname(md), "images")
+                if os.path.isdir(src_images):
+                    # mineru 图片以内容哈希命名，直接并入同一个 images/ 目录
+                    for fn in os.listdir(src_images):
+                        dst = os.path.join(img_dir, fn)
+                        if not os.path.exists(dst):
+                            shutil.move(os.path.join(src_images, fn), dst)
+                with open(md, "r", encoding="utf-8") as f:
+                    run_md[start] = f.read().strip()
+
+        parts = []
+        for route, start, end in runs:
+            if route == "mineru":
+                parts.append(run_md[start])
+            else:
+                for i in range(start, end + 1):
+                    text = page_to_markdown(doc[i], body_size, img_dir)
+                    if text:
+                        parts.append(text)
+    finally:
+        doc.close()
+
+    md_path = os.path.join(md_dir, f"{base}.md")
+    with open(md_path, "w", encoding="utf-8") as f:
+        f.write("\n\n".join(p for p in parts if p) + "\n")
+    with open(os.path.join(md_dir, f"{base}_pages.json"), "w", encoding="utf-8") as f:
+        json.dump([i.to_dict() for i in infos], f, ensure_ascii=False, indent=1)
+    return os.path.join(out_dir, base)
@@ -0,0 +1,194 @@
+"""
+mineru 输出图片的后处理：把整页截图/示意图的全分辨率裁剪重新编码为指定格式与质量，限制最长边，
+并同步改写 Markdown（及 content_list 等 JSON）中的图片引用。
+
+结果 ZIP、客户端 extracted/ 目录和图床流量的大头都是这些图片，压缩后三者同时下降。
+依赖 Pillow（可选），缺失时跳过优化、原样打包。
+"""
+import os
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from PIL import Image
+except ImportError:  # 可选依赖
+    Image = None
+
+IMAGE_OPT_AVAILABLE = Image is not None
+
+# 动图（gif）重编码会丢帧，不处理
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+FORMAT_EXT = {"webp": ".webp", "jpeg": ".jpg", "png": ".png"}
+# 需要改写图片引用的文本文件
+REF_EXTS = (".md", ".json")
+
+DEFAULT_FORMAT = os.environ.get("FASTAPI_IMAGE_FORMAT", "webp").lower()
+DEFAULT_QUALITY = int(os.environ.get("FASTAPI_IMAGE_QUALITY", "80"))
+DEFAULT_MAX_DIM = int(os.environ.get("FASTAPI_IMAGE_MAX_DIM", "1600"))
+# 小于该字节数的图片（图标、公式片段）压缩收益很小，直接跳过
+DEFAULT_MIN_BYTES = int(os.environ.get("FASTAPI_IMAGE_MIN_BYTES", str(32 * 1024)))
+DEFAULT_WORKERS = int(os.environ.get("FASTAPI_IMAGE_WORKERS", "0")) or max(1, (os.cpu_count() or 2) // 2)
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    """进程池在 worker 进程内复用；用 spawn 避免在多线程进程里 fork。"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def _optimize_one(src: str, fmt: str, quality: int, max_dim: int) -> Optional[Tuple[str, str, int, int]]:
+    """
+    在子进程中重新编码一张图片。
+
+    :return: (原路径, 新路径, 原字节数, 新字节数)；结果不比原图小时返回 None（保留原图）
+    """
+    ext = FORMAT_EXT[fmt]
+    stem = os.path.splitext(src)[0]
+    dst = stem + ext
+    tmp = stem + ".opt" + ext
+    old_size = os.path.getsize(src)
+    with Image.open(src) as im:
+        im.load()
+        if max_dim and max(im.size) > max_dim:
+            im.thumbnail((max_dim, max_dim), Image.LANCZOS)
+        if fmt == "jpeg" and im.mode not in ("RGB", "L"):
+            # JPEG 不支持透明通道：铺白底
+            bg = Image.new("RGB", im.size, (255, 255, 255))
+            rgba = im.convert("RGBA")
+            bg.paste(rgba, mask=rgba.split()[-1])
+            im = bg
+        elif fmt == "webp" and im.mode not in ("RGB", "RGBA", "L"):
+            im = im.convert("RGBA")
+        params = {"optimize": True}
+        if fmt in ("webp", "jpeg"):
+            params["quality"] = quality
+        if fmt == "webp":
+            params["method"] = 4
+        try:
+            im.save(tmp, format=fmt.upper(), **params)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+    new_size = os.path.getsize(tmp)
+    if new_size >= old_size:
+        os.remove(tmp)
+        return None
+    os.replace(tmp, dst)
+    if dst != src:
+        os.remove(src)
+    return src, dst, old_size, new_size
+
+
+def _rewrite_refs(doc_dir: str, renames: Dict[str, str]) -> int:
+    """把文本文件中的旧图片文件名替换为新文件名，返回改写的文件数。"""
+    if not renames:
+        return 0
+    changed = 0
+    for root, _, files in os.walk(doc_dir):
+        for fn in files:
+            if not fn.lower().endswith(REF_EXTS):
+                continue
+            path = os.path.join(root, fn)
+            with open(path, "r", encoding="utf-8", errors="surrogateescape") as f:
+                text = f.read()
+            new_text = text
+            for old, new in renames.items():
+                if old in new_text:
+                    new_text = new_text.replace(old, new)
+            if new_text != text:
+                tmp = path + ".tmp"
+                with open(tmp, "w", encoding="utf-8", errors="surrogateescape") as f:
+                    f.write(new_text)
+                os.replace(tmp, path)
+                changed += 1
+    return changed
+
+
+def _find_images(doc_dir: str, min_bytes: int) -> List[str]:
+    out = []
+    for root, _, files in os.walk(doc_dir):
+        for fn in files:
+            if fn.lower().endswith(IMAGE_EXTS):
+                path = os.path.join(root, fn)
+                if os.path.getsize(path) >= min_bytes:
+                    out.append(path)
+    return out
+
+
+def optimize_images(
+    doc_dir: str,
+    fmt: str = DEFAULT_FORMAT,
+    quality: int = DEFAULT_QUALITY,
+    max_dim: int = DEFAULT_MAX_DIM,
+    min_bytes: int = DEFAULT_MIN_BYTES,
+    workers: int = DEFAULT_WORKERS,
+) -> dict:
+    """
+    重新编码 doc_dir 下的图片并改写引用。单张图片失败时保留原图，不影响整个作业。
+
+    :param doc_dir: mineru 输出的文档目录（out_dir/<base>）
+    :param fmt: 目标格式 webp | jpeg | png
+    :param quality: webp/jpeg 质量 1~100
+    :param max_dim: 最长边像素上限，0 表示不缩放
+    :param min_bytes: 小于该字节数的图片跳过
+    :param workers: 进程池大小（首次调用时生效）
+    :return: {"images", "optimized", "bytes_before", "bytes_after", "refs_rewritten"}
+    """
+    fmt = "jpeg" if fmt == "jpg" else fmt
+    if fmt not in FORMAT_EXT:
+        raise ValueError(f"不支持的图片格式: {fmt}")
+    stats = {"images": 0, "optimized": 0, "bytes_before": 0, "bytes_after": 0, "refs_rewritten": 0}
+    if not IMAGE_OPT_AVAILABLE:
+        return stats
+    images = _find_images(doc_dir, min_bytes)
+    stats["images"] = len(images)
+    if not images:
+        return stats
+    pool = _get_pool(workers)
+    futures = [(src, pool.submit(_optimize_one, src, fmt, quality, max_dim)) for src in images]
+    renames = {}
+    broken = False
+    for src, fut in futures:
+        try:
+            res = fut.result()
+        except BrokenProcessPool as e:
+            # 子进程异常退出（如解码器崩溃）后进程池不可再用，下次调用重建
+            broken = True
+            logger.warning(f"图片优化进程池异常，保留原图 {src}: {e}")
+            continue
+        except Exception as e:
+            logger.warning(f"图片优化失败，保留原图 {src}: {e}")
+            continue
+        if res is None:
+            continue
+        old, new, old_size, new_size = res
+        stats["optimized"] += 1
+        stats["bytes_before"] += old_size
+        stats["bytes_after"] += new_size
+        if old != new:
+            renames[os.path.basename(old)] = os.path.basename(new)
+    if broken:
+        shutdown_pool()
+    stats["refs_rewritten"] = _rewrite_refs(doc_dir, renames)
+    return stats
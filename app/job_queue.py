@@ -0,0 +1,779 @@
+"""
+作业队列：API 进程只负责入队，任意节点上的 worker 进程按自身空闲容量拉取作业，结果写入共享存储。
+
+默认实现 SqliteJobQueue 基于本机磁盘上的 sqlite 文件，只支持单机（多个 uvicorn worker 与本机 worker 进程）：
+WAL 依赖同一主机上的共享内存，NFS/SMB 等网络文件系统上的文件锁也不可靠，多个节点共用同一个库文件
+可能损坏数据库或重复领取作业，因此数据库位于网络文件系统时直接拒绝打开。
+多节点部署需要网络化的队列实现（Redis 等）：继承 JobQueue 并通过 register_queue_backend 注册 URL scheme，
+再用 JOB_QUEUE_URL 指向它；作业输入/输出仍可放在挂载到各节点的 FASTAPI_SHARED_ROOT 上。
+
+相同内容、相同处理参数的请求共用一个作业（single-flight）：入队时按 dedup_key 找到排队中/运行中的作业
+就挂到它上面（waiters+1）。等待者断开只减少 waiters，最后一个等待者离开后再等一段宽限期，
+期间没有人重新挂上（例如客户端超时后的重试）才取消，因此重试不会重复占用 GPU。
+
+调度分两层：先在客户端之间做加权公平排队（虚拟时间最小者优先，并受各自并发上限约束），
+再在选中客户端内部按短作业优先 + 老化挑作业。只有一个客户端有作业时它可以用满全部空闲容量。
+
+环境变量：
+    FASTAPI_SHARED_ROOT  共享存储根目录（作业输入/输出），默认 PROJECT_ROOT
+    JOB_QUEUE_URL        队列地址，默认 sqlite:///<FASTAPI_SHARED_ROOT>/jobs.sqlite3
+                         （共享目录在网络存储上时需指向本机路径，或改用网络化队列）
+"""
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import heapq
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Tuple
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINAL_STATES = (DONE, FAILED, CANCELLED)
+
+# worker 租约：超过该时间未续约的 running 作业视为 worker 已失联，重新入队
+DEFAULT_LEASE_SECONDS = 60
+DEFAULT_MAX_ATTEMPTS = 3
+# 短作业优先的老化速率：每排队 1 秒，作业的排序成本减少该秒数，保证大文档最终会被调度
+DEFAULT_AGING = float(os.environ.get("FASTAPI_SJF_AGING", "1.0"))
+# 旧作业/未识别调用方归入的客户端
+DEFAULT_CLIENT = "anonymous"
+# 计入客户端虚拟时间的最小成本(秒)，避免零成本作业不消耗份额
+MIN_CHARGE_SECONDS = 1.0
+# 最后一个等待者离开后保留作业的宽限期(秒)；同一内容在宽限期内重新提交会挂到原作业/直接复用结果
+DEFAULT_COALESCE_GRACE = float(os.environ.get("FASTAPI_COALESCE_GRACE", "120"))
+# sqlite 不能可靠运行在这些文件系统上（WAL 需要本机共享内存，网络文件锁不可靠）
+NETWORK_FILESYSTEMS = {
+    "nfs", "nfs4", "cifs", "smb3", "smbfs", "ncpfs", "afs", "9p", "ceph", "glusterfs", "lustre", "gpfs",
+    "beegfs", "fuse.sshfs", "fuse.glusterfs", "fuse.cephfs", "fuse.s3fs", "fuse.gcsfuse",
+}
+
+
+class Job:
+    """队列中的一个作业。"""
+
+    FIELDS = (
+        "job_id", "status", "processor", "mineru_backend", "input_path", "filename", "result_path",
+        "error", "attempts", "worker_id", "created_at", "started_at", "finished_at", "lease_until", "meta",
+        "deadline", "cancel_requested", "pages", "images", "size_bytes", "work_units", "est_cost", "client",
+        "workspace", "dedup_key", "waiters", "orphaned_at", "timings", "run_seconds",
+    )
+
+    def __init__(self, **kwargs):
+        for name in self.FIELDS:
+            setattr(self, name, kwargs.get(name))
+        if isinstance(self.meta, str):
+            self.meta = json.loads(self.meta or "{}")
+        self.meta = self.meta or {}
+        if isinstance(self.timings, str):
+            self.timings = json.loads(self.timings or "{}")
+        self.timings = self.timings or {}
+
+    @classmethod
+    def from_row(cls, row) -> "Job":
+        return cls(**dict(zip(cls.FIELDS, row)))
+
+    @property
+    def job_dir(self) -> str:
+        return os.path.dirname(os.path.dirname(self.input_path))
+
+    def to_dict(self) -> dict:
+        d = {name: getattr(self, name) for name in self.FIELDS}
+        if d["finished_at"] and d["created_at"]:
+            d["elapsed"] = round(d["finished_at"] - d["created_at"], 3)
+        return d
+
+
+class JobQueue(ABC):
+    """作业队列接口。实现需保证 claim 的原子性：同一作业只会被一个 worker 领取。"""
+
+    @abstractmethod
+    def enqueue(self, input_path: str, filename: str, processor: str, mineru_backend: str,
+                meta: Optional[dict] = None, job_id: Optional[str] = None,
+                deadline: Optional[float] = None, preflight: Optional[dict] = None,
+                est_cost: Optional[float] = None, client: Optional[str] = None,
+                dedup_key: Optional[str] = None) -> Job:
+        """
+        登记一个已写入共享存储的输入文件，返回排队中的作业。
+
+        :param deadline: 绝对截止时间戳
+        :param preflight: 预检结果（pages/images/size_bytes/work_units）
+        :param est_cost: 预计处理时间(秒)，用于短作业优先排序
+        :param client: 提交作业的客户端，公平调度按它分组
+        :param dedup_key: 内容哈希 + 处理参数；已有相同 key 的进行中作业（或宽限期内完成的作业）时
+            不新建作业，返回那个作业（job_id 与传入的不同）
+        """
+
+    @abstractmethod
+    def set_client_policy(self, client: str, weight: float, max_running: int, overwrite: bool = True) -> None:
+        """登记/更新客户端的公平份额权重与并发上限（0 表示不限）；overwrite=False 时只登记尚不存在的客户端。"""
+
+    @abstractmethod
+    def claim(self, worker_id: str, lease_seconds: int = DEFAULT_LEASE_SECONDS,
+              batch_of: Optional[Job] = None, max_pages: int = 0,
+              exclude_filenames: Tuple[str, ...] = ()) -> Optional[Job]:
+        """
+        领取一个排队作业并标记 running；无可领取作业时返回 None。
+
+        先选虚拟完成时间最小且未达并发上限的客户端，再在其作业中按“预计耗时 - 老化量”从小到大选取。
+
+        :param batch_of: 给出时只领取能与该作业合并为一次 mineru 调用的作业（同一处理器与后端）
+        :param max_pages: 与 batch_of 一起使用，只领取页数不超过该值的作业，0 表示不限
+        :param exclude_filenames: 与 batch_of 一起使用，不领取这些文件名（不区分大小写）的作业
+        """
+
+    @abstractmethod
+    def heartbeat(self, worker_id: str, job_ids: List[str], capacity: int,
+                  lease_seconds: int = DEFAULT_LEASE_SECONDS) -> Tuple[Dict[str, str], Dict[str, Optional[float]]]:
+        """
+        续约 worker 正在处理的作业并登记 worker 容量。
+
+        返回 (被请求取消的 {job_id: 原因}, 当前截止时间 {job_id: deadline})；截止时间可能因相同请求挂上而被延后，
+        worker 据此更新运行中作业的 CancelToken。
+        """
+
+    @abstractmethod
+    def set_workspace(self, job_id: str, workspace: str) -> None:
+        """记录作业实际使用的工作区后端（ram | disk）。"""
+
+    @abstractmethod
+    def complete(self, job_id: str, result_path: str, timings: Optional[dict] = None,
+                 worker_id: Optional[str] = None, run_seconds: Optional[float] = None) -> bool:
+        """
+        标记完成；timings 为各处理阶段耗时（毫秒），随结果以 Server-Timing 返回。
+
+        run_seconds 为计入耗时模型的处理秒数，缺省为 finished_at - started_at；合并批次的成员传入按
+        work_units 分摊的批次耗时，不把整批时间（含攒批等待）算到每个成员头上。
+
+        只更新仍处于 running 的作业；给出 worker_id 时还要求作业仍归该 worker（租约被回收后旧 worker
+        的结果不能覆盖新领取者）。返回是否实际更新。
+        """
+
+    @abstractmethod
+    def fail(self, job_id: str, error: str, retry: bool = False, worker_id: Optional[str] = None) -> bool:
+        """标记失败；retry=True 且未超过最大次数时重新入队。worker_id 与返回值同 complete。"""
+
+    @abstractmethod
+    def request_cancel(self, job_id: str, reason: str) -> Optional[Job]:
+        """请求取消：排队中的作业直接标记 cancelled，运行中的作业由其 worker 在下次心跳时终止。"""
+
+    @abstractmethod
+    def detach(self, job_id: str, reason: str, immediate: bool = False) -> Optional[Job]:
+        """
+        一个等待者放弃作业。仍有其他等待者时作业继续；最后一个等待者离开时，immediate=True 立即取消，
+        否则在宽限期后取消（期间可被相同请求重新挂上）。
+        """
+
+    @abstractmethod
+    def mark_cancelled(self, job_id: str, reason: str, worker_id: Optional[str] = None) -> bool:
+        """worker 终止作业后调用。worker_id 与返回值同 complete。"""
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Job]:
+        ...
+
+    @abstractmethod
+    def history(self, processor: str, limit: int = 200) -> List[Tuple[float, float]]:
+        """最近完成作业的 (等效页数, 实际运行秒数)，用于拟合耗时模型。"""
+
+    @abstractmethod
+    def eta(self, job_id: str) -> Optional[dict]:
+        """估计作业排队位置与预计完成时间。"""
+
+    @abstractmethod
+    def client_summary(self, client: str) -> dict:
+        """客户端自己的运行中/排队作业及各自的排队位置。"""
+
+    @abstractmethod
+    def requeue_expired(self) -> int:
+        """把租约过期的 running 作业重新入队，返回数量。"""
+
+    @abstractmethod
+    def stats(self) -> dict:
+        ...
+
+    def close(self) -> None:
+        pass
+
+
+def _filesystem_type(path: str) -> Optional[str]:
+    """按 /proc/mounts 找出 path 所在挂载点的文件系统类型；非 Linux 或读取失败时返回 None。"""
+    try:
+        with open("/proc/mounts", "r", encoding="utf-8") as f:
+            mounts = [line.split()[1:3] for line in f if len(line.split()) >= 3]
+    except OSError:
+        return None
+    path = os.path.realpath(path)
+    best, fstype = "", None
+    for mount_point, fs in mounts:
+        mount_point = mount_point.replace("\\040", " ")
+        if (path == mount_point or path.startswith(mount_point.rstrip("/") + "/")) and len(mount_point) >= len(best):
+            best, fstype = mount_point, fs
+    return fstype
+
+
+class SqliteJobQueue(JobQueue):
+    """基于 sqlite 的作业队列；数据库必须在本机磁盘上，同一主机的多个进程可共用，不支持跨节点。"""
+
+    # 后续版本新增的列：(列名, 类型与默认值)
+    _MIGRATIONS = (
+        ("deadline", "REAL"),
+        ("cancel_requested", "INTEGER NOT NULL DEFAULT 0"),
+        ("pages", "INTEGER"),
+        ("images", "INTEGER"),
+        ("size_bytes", "INTEGER"),
+        ("work_units", "REAL"),
+        ("est_cost", "REAL"),
+        ("client", "TEXT"),
+        ("workspace", "TEXT"),
+        ("dedup_key", "TEXT"),
+        ("waiters", "INTEGER NOT NULL DEFAULT 1"),
+        ("orphaned_at", "REAL"),
+        ("timings", "TEXT"),
+        ("run_seconds", "REAL"),
+    )
+
+    def __init__(self, db_path: str, max_attempts: int = DEFAULT_MAX_ATTEMPTS, aging: float = DEFAULT_AGING,
+                 coalesce_grace: float = DEFAULT_COALESCE_GRACE):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.aging = aging
+        self.coalesce_grace = coalesce_grace
+        d = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(d, exist_ok=True)
+        fstype = _filesystem_type(d)
+        if fstype in NETWORK_FILESYSTEMS:
+            raise ValueError(
+                f"作业队列数据库 {db_path} 位于网络文件系统（{fstype}）上，sqlite 在其上不能安全地被多进程/多节点共用；"
+                f"请用 JOB_QUEUE_URL 指向本机磁盘（单机部署），或注册网络化的队列实现（多节点部署）"
+            )
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=30000")
+        self._init_schema()
+
+    def _init_schema(self) -> None:
+        with self._lock:
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    processor TEXT,
+                    mineru_backend TEXT,
+                    input_path TEXT,
+                    filename TEXT,
+                    result_path TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker_id TEXT,
+                    created_at REAL,
+                    started_at REAL,
+                    finished_at REAL,
+                    lease_until REAL,
+                    meta TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at);
+                CREATE TABLE IF NOT EXISTS clients (
+                    client_id TEXT PRIMARY KEY,
+                    weight REAL NOT NULL DEFAULT 1,
+                    max_running INTEGER NOT NULL DEFAULT 0,
+                    vtime REAL NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS workers (
+                    worker_id TEXT PRIMARY KEY,
+                    host TEXT,
+                    capacity INTEGER,
+                    running INTEGER,
+                    heartbeat_at REAL
+                );
+                """
+            )
+            # 旧库补列
+            existing = {r[1] for r in self._conn.execute("PRAGMA table_info(jobs)")}
+            for name, decl in self._MIGRATIONS:
+                if name not in existing:
+                    self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {decl}")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_client ON jobs(client, status)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_dedup ON jobs(dedup_key, status)")
+
+    def _select(self, where: str, params=()) -> List[Job]:
+        cols = ", ".join(Job.FIELDS)
+        rows = self._conn.execute(f"SELECT {cols} FROM jobs {where}", params).fetchall()
+        return [Job.from_row(r) for r in rows]
+
+    def _activate_client(self, client: str) -> None:
+        """
+        客户端从空闲变为有作业时，把它的虚拟时间拉到当前活跃客户端的最小值：
+        空闲期间既不积攒可透支的份额，过去的用量也不会让它排在后面。调用方需持有写事务。
+        """
+        active = self._conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE COALESCE(client, ?)=? AND status IN (?, ?)",
+            (DEFAULT_CLIENT, client, QUEUED, RUNNING),
+        ).fetchone()[0]
+        self._conn.execute("INSERT OR IGNORE INTO clients(client_id) VALUES (?)", (client,))
+        if active:
+            return
+        floor = self._conn.execute(
+            "SELECT MIN(c.vtime) FROM clients c WHERE c.client_id<>? AND EXISTS (SELECT 1 FROM jobs j "
+            "WHERE COALESCE(j.client, ?)=c.client_id AND j.status IN (?, ?))",
+            (client, DEFAULT_CLIENT, QUEUED, RUNNING),
+        ).fetchone()[0]
+        if floor is not None:
+            self._conn.execute("UPDATE clients SET vtime=? WHERE client_id=?", (floor, client))
+
+    def _attach(self, dedup_key: str, deadline: Optional[float], now: float) -> Optional[str]:
+        """
+        在写事务内查找可复用的作业：进行中且未被取消的，或宽限期内完成且结果仍在的。找到时 waiters+1、
+        截止时间取两者中较晚者并返回 job_id。
+        """
+        rows = self._conn.execute(
+            "SELECT job_id, deadline, status, result_path FROM jobs WHERE dedup_key=? "
+            "AND ((status IN (?, ?) AND cancel_requested=0) OR (status=? AND finished_at > ?)) "
+            "ORDER BY status=? DESC, created_at DESC",
+            (dedup_key, QUEUED, RUNNING, DONE, now - self.coalesce_grace, DONE),
+        ).fetchall()
+        row = next((r for r in rows if r[2] != DONE or (r[3] and os.path.isfile(r[3]))), None)
+        if row is None:
+            return None
+        job_id, old_deadline = row[:2]
+        if old_deadline is None or deadline is None:
+            new_deadline = None
+        else:
+            new_deadline = max(old_deadline, deadline)
+        self._conn.execute(
+            "UPDATE jobs SET waiters=waiters+1, orphaned_at=NULL, deadline=? WHERE job_id=?",
+            (new_deadline, job_id),
+        )
+        return job_id
+
+    def enqueue(self, input_path, filename, processor, mineru_backend, meta=None, job_id=None, deadline=None,
+                preflight=None, est_cost=None, client=None, dedup_key=None) -> Job:
+        job_id = job_id or uuid.uuid4().hex
+        client = client or DEFAULT_CLIENT
+        now = time.time()
+        pf = preflight or {}
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                attached = self._attach(dedup_key, deadline, now) if dedup_key else None
+                if attached:
+                    self._conn.execute("COMMIT")
+                    job_id = attached
+                else:
+                    self._activate_client(client)
+                    self._conn.execute(
+                        "INSERT INTO jobs(job_id, status, processor, mineru_backend, input_path, filename, "
+                        "created_at, meta, deadline, pages, images, size_bytes, work_units, est_cost, client, "
+                        "dedup_key) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (job_id, QUEUED, processor, mineru_backend, input_path, filename, now,
+                         json.dumps(meta or {}, ensure_ascii=False), deadline, pf.get("pages"), pf.get("images"),
+                         pf.get("size_bytes"), pf.get("work_units"), est_cost, client, dedup_key),
+                    )
+                    self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self.get(job_id)
+
+    def set_client_policy(self, client, weight, max_running, overwrite=True) -> None:
+        on_conflict = (
+            "DO UPDATE SET weight=excluded.weight, max_running=excluded.max_running" if overwrite else "DO NOTHING"
+        )
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO clients(client_id, weight, max_running) VALUES (?, ?, ?) ON CONFLICT(client_id) {on_conflict}",
+                (client, weight, max_running),
+            )
+
+    def _pick_job(self, now: float, where: str = "", params: tuple = ()) -> Optional[Tuple[str, str, float]]:
+        """
+        在写事务内选出下一个作业，返回 (job_id, client, 计入虚拟时间的成本)。
+
+        :param where: 追加到候选作业查询的条件（如合并批次只要同一后端的小作业），params 为其参数
+        """
+        counts = {}
+        for client, status, n in self._conn.execute(
+            "SELECT COALESCE(client, ?), status, COUNT(*) FROM jobs WHERE status IN (?, ?) GROUP BY 1, 2",
+            (DEFAULT_CLIENT, QUEUED, RUNNING),
+        ):
+            counts.setdefault(client, {})[status] = n
+        policies = {
+            r[0]: r[1:] for r in self._conn.execute("SELECT client_id, weight, max_running, vtime FROM clients")
+        }
+        best = None
+        for client, c in counts.items():
+            if not c.get(QUEUED):
+                continue
+            weight, max_running, vtime = policies.get(client, (1.0, 0, 0.0))
+            if max_running and c.get(RUNNING, 0) >= max_running:
+                continue
+            # 客户端内部：短作业优先 + 老化
+            row = self._conn.execute(
+                "SELECT job_id, COALESCE(est_cost, 0), COALESCE(est_cost, 0) - ? * (? - created_at) AS rank "
+                f"FROM jobs WHERE status=? AND COALESCE(client, ?)=? {where} ORDER BY rank, created_at LIMIT 1",
+                (self.aging, now, QUEUED, DEFAULT_CLIENT, client, *params),
+            ).fetchone()
+            if row is None:
+                continue
+            charge = max(MIN_CHARGE_SECONDS, row[1]) / max(0.01, weight or 1.0)
+            # 客户端之间：虚拟完成时间最小者优先，单页交互请求因此能插到批量作业之前
+            key = (vtime + charge, row[2])
+            if best is None or key < best[0]:
+                best = (key, row[0], client, charge)
+        return None if best is None else best[1:]
+
+    def claim(self, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS, batch_of=None, max_pages=0,
+              exclude_filenames=()) -> Optional[Job]:
+        now = time.time()
+        where, params = "", ()
+        if batch_of is not None:
+            where, params = "AND processor=? AND mineru_backend=?", (batch_of.processor, batch_of.mineru_backend)
+            if max_pages:
+                where += " AND pages IS NOT NULL AND pages<=?"
+                params += (max_pages,)
+            if exclude_filenames:
+                where += f" AND lower(filename) NOT IN ({','.join('?' * len(exclude_filenames))})"
+                params += tuple(n.lower() for n in exclude_filenames)
+        with self._lock:
+            # BEGIN IMMEDIATE 取得写锁，跨进程保证同一作业只被领取一次
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # 排队期间已过截止时间的作业不再领取
+                self._conn.execute(
+                    "UPDATE jobs SET status=?, error=?, finished_at=? WHERE status=? AND deadline IS NOT NULL "
+                    "AND deadline < ?",
+                    (CANCELLED, "排队超过作业截止时间", now, QUEUED, now),
+                )
+                # 所有等待者都已离开且超过宽限期的排队作业
+                self._conn.execute(
+                    "UPDATE jobs SET status=?, finished_at=? WHERE status=? AND waiters<=0 AND orphaned_at < ?",
+                    (CANCELLED, now, QUEUED, now - self.coalesce_grace),
+                )
+                picked = self._pick_job(now, where, params)
+                if picked is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                job_id, client, charge = picked
+                self._conn.execute(
+                    "UPDATE jobs SET status=?, worker_id=?, started_at=?, lease_until=?, attempts=attempts+1 "
+                    "WHERE job_id=?",
+                    (RUNNING, worker_id, now, now + lease_seconds, job_id),
+                )
+                self._conn.execute("INSERT OR IGNORE INTO clients(client_id) VALUES (?)", (client,))
+                self._conn.execute("UPDATE clients SET vtime=vtime+? WHERE client_id=?", (charge, client))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self.get(job_id)
+
+    def heartbeat(self, worker_id, job_ids, capacity, lease_seconds=DEFAULT_LEASE_SECONDS):
+        now = time.time()
+        cancels, deadlines = {}, {}
+        with self._lock:
+            if job_ids:
+                marks = ",".join("?" * len(job_ids))
+                self._conn.execute(
+                    f"UPDATE jobs SET lease_until=? WHERE status=? AND worker_id=? AND job_id IN ({marks})",
+                    (now + lease_seconds, RUNNING, worker_id, *job_ids),
+                )
+                # 运行中但所有等待者都已离开且超过宽限期：请求取消
+                self._conn.execute(
+                    f"UPDATE jobs SET cancel_requested=1 WHERE status=? AND waiters<=0 AND orphaned_at < ? "
+                    f"AND job_id IN ({marks})",
+                    (RUNNING, now - self.coalesce_grace, *job_ids),
+                )
+                cancels = dict(self._conn.execute(
+                    f"SELECT job_id, COALESCE(error, '已取消') FROM jobs WHERE cancel_requested=1 "
+                    f"AND job_id IN ({marks})",
+                    tuple(job_ids),
+                ).fetchall())
+                deadlines = dict(self._conn.execute(
+                    f"SELECT job_id, deadline FROM jobs WHERE job_id IN ({marks})", tuple(job_ids)
+                ).fetchall())
+            self._conn.execute(
+                "INSERT INTO workers(worker_id, host, capacity, running, heartbeat_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(worker_id) DO UPDATE SET capacity=excluded.capacity, running=excluded.running, "
+                "heartbeat_at=excluded.heartbeat_at",
+                (worker_id, socket.gethostname(), capacity, len(job_ids), now),
+            )
+        return cancels, deadlines
+
+    def set_workspace(self, job_id, workspace) -> None:
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET workspace=? WHERE job_id=?", (workspace, job_id))
+
+    @staticmethod
+    def _owned(job_id: str, worker_id: Optional[str]) -> Tuple[str, tuple]:
+        """仍在运行（且归 worker_id 所有）的作业的 WHERE 条件。"""
+        if worker_id is None:
+            return "job_id=? AND status=?", (job_id, RUNNING)
+        return "job_id=? AND status=? AND worker_id=?", (job_id, RUNNING, worker_id)
+
+    def complete(self, job_id, result_path, timings=None, worker_id=None, run_seconds=None) -> bool:
+        where, params = self._owned(job_id, worker_id)
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET status=?, result_path=?, error=NULL, finished_at=?, lease_until=NULL, timings=?, "
+                f"run_seconds=COALESCE(?, ? - started_at) WHERE {where}",
+                (DONE, result_path, now, json.dumps(timings or {}), run_seconds, now, *params),
+            )
+        return cur.rowcount > 0
+
+    def fail(self, job_id, error, retry=False, worker_id=None) -> bool:
+        where, params = self._owned(job_id, worker_id)
+        with self._lock:
+            if retry:
+                cur = self._conn.execute(
+                    f"UPDATE jobs SET status=?, error=?, worker_id=NULL, lease_until=NULL WHERE {where} AND attempts < ?",
+                    (QUEUED, error, *params, self.max_attempts),
+                )
+                if cur.rowcount:
+                    return True
+            cur = self._conn.execute(
+                f"UPDATE jobs SET status=?, error=?, finished_at=?, lease_until=NULL WHERE {where}",
+                (FAILED, error, time.time(), *params),
+            )
+        return cur.rowcount > 0
+
+    def request_cancel(self, job_id, reason) -> Optional[Job]:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status=?, error=?, finished_at=? WHERE job_id=? AND status=?",
+                (CANCELLED, reason, now, job_id, QUEUED),
+            )
+            self._conn.execute(
+                "UPDATE jobs SET cancel_requested=1, error=? WHERE job_id=? AND status=?",
+                (reason, job_id, RUNNING),
+            )
+        return self.get(job_id)
+
+    def detach(self, job_id, reason, immediate=False) -> Optional[Job]:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET waiters=MAX(0, waiters-1) WHERE job_id=? AND status IN (?, ?)",
+                (job_id, QUEUED, RUNNING),
+            )
+            row = self._conn.execute("SELECT waiters FROM jobs WHERE job_id=? AND status IN (?, ?)",
+                                     (job_id, QUEUED, RUNNING)).fetchone()
+            last = row is not None and row[0] <= 0
+            if last and not immediate and self.coalesce_grace > 0:
+                self._conn.execute("UPDATE jobs SET orphaned_at=?, error=? WHERE job_id=?", (now, reason, job_id))
+        if last and (immediate or self.coalesce_grace <= 0):
+            return self.request_cancel(job_id, reason)
+        return self.get(job_id)
+
+    def mark_cancelled(self, job_id, reason, worker_id=None) -> bool:
+        where, params = self._owned(job_id, worker_id)
+        with self._lock:
+            cur = self._conn.execute(
+                f"UPDATE jobs SET status=?, error=?, finished_at=?, lease_until=NULL WHERE {where}",
+                (CANCELLED, reason, time.time(), *params),
+            )
+        return cur.rowcount > 0
+
+    def get(self, job_id) -> Optional[Job]:
+        with self._lock:
+            jobs = self._select("WHERE job_id=?", (job_id,))
+        return jobs[0] if jobs else None
+
+    def history(self, processor, limit=200) -> List[Tuple[float, float]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT work_units, COALESCE(run_seconds, finished_at - started_at) FROM jobs WHERE status=? "
+                "AND processor=? AND work_units IS NOT NULL AND started_at IS NOT NULL ORDER BY finished_at DESC LIMIT ?",
+                (DONE, processor, limit),
+            ).fetchall()
+        return [(float(x), float(y)) for x, y in rows if y is not None and y >= 0]
+
+    def _dispatch_order(self, now: float) -> List[Tuple[str, str, float]]:
+        """
+        按 claim 的规则模拟全部排队作业的领取顺序（不考虑并发上限），返回 [(job_id, client, est_cost)]。
+        """
+        queued = {}
+        for job_id, client, cost in self._conn.execute(
+            "SELECT job_id, COALESCE(client, ?), COALESCE(est_cost, 0) FROM jobs WHERE status=? "
+            "ORDER BY COALESCE(est_cost, 0) - ? * (? - created_at), created_at",
+            (DEFAULT_CLIENT, QUEUED, self.aging, now),
+        ):
+            queued.setdefault(client, []).append((job_id, cost))
+        policies = {r[0]: (r[1], r[2]) for r in self._conn.execute("SELECT client_id, weight, vtime FROM clients")}
+        heap = []
+        for client, jobs in queued.items():
+            weight, vtime = policies.get(client, (1.0, 0.0))
+            weight = max(0.01, weight or 1.0)
+            heap.append((vtime + max(MIN_CHARGE_SECONDS, jobs[0][1]) / weight, client, 0, weight))
+        heapq.heapify(heap)
+        order = []
+        while heap:
+            finish, client, i, weight = heapq.heappop(heap)
+            job_id, cost = queued[client][i]
+            order.append((job_id, client, cost))
+            if i + 1 < len(queued[client]):
+                nxt = queued[client][i + 1][1]
+                heapq.heappush(heap, (finish + max(MIN_CHARGE_SECONDS, nxt) / weight, client, i + 1, weight))
+        return order
+
+    def _eta_from(self, job: Job, order: list, running: list, capacity: int, now: float) -> Optional[dict]:
+        own = job.est_cost or 0.0
+        if job.status == RUNNING:
+            remaining = max(0.0, own - (now - (job.started_at or now)))
+            return {"position": 0, "client_position": 0, "est_cost": own, "eta_seconds": round(remaining, 1)}
+        if job.status != QUEUED:
+            return None
+        idx = next((i for i, o in enumerate(order) if o[0] == job.job_id), len(order))
+        ahead = order[:idx]
+        client = job.client or DEFAULT_CLIENT
+        running_left = sum(max(0.0, est - (now - (started or now))) for est, started in running)
+        eta = (running_left + sum(o[2] for o in ahead)) / max(1, capacity or 0) + own
+        return {
+            "position": idx + 1,
+            "client_position": sum(1 for o in ahead if o[1] == client) + 1,
+            "est_cost": own,
+            "eta_seconds": round(eta, 1),
+        }
+
+    def _eta_context(self, now: float):
+        order = self._dispatch_order(now)
+        running = self._conn.execute(
+            "SELECT COALESCE(est_cost, 0), started_at FROM jobs WHERE status=?", (RUNNING,)
+        ).fetchall()
+        capacity = self._conn.execute(
+            "SELECT COALESCE(SUM(capacity), 0) FROM workers WHERE heartbeat_at > ?",
+            (now - 3 * DEFAULT_LEASE_SECONDS,),
+        ).fetchone()[0]
+        return order, running, capacity
+
+    def eta(self, job_id) -> Optional[dict]:
+        job = self.get(job_id)
+        if job is None:
+            return None
+        now = time.time()
+        with self._lock:
+            ctx = self._eta_context(now) if job.status == QUEUED else ([], [], 0)
+        return self._eta_from(job, *ctx, now)
+
+    def client_summary(self, client) -> dict:
+        now = time.time()
+        with self._lock:
+            jobs = self._select(
+                "WHERE COALESCE(client, ?)=? AND status IN (?, ?) ORDER BY created_at",
+                (DEFAULT_CLIENT, client, QUEUED, RUNNING),
+            )
+            policy = self._conn.execute(
+                "SELECT weight, max_running, vtime FROM clients WHERE client_id=?", (client,)
+            ).fetchone() or (1.0, 0, 0.0)
+            ctx = self._eta_context(now)
+        entries = []
+        for job in jobs:
+            d = {k: getattr(job, k) for k in ("job_id", "status", "filename", "processor", "created_at")}
+            d.update(self._eta_from(job, *ctx, now) or {})
+            entries.append(d)
+        entries.sort(key=lambda d: d.get("position", 0))
+        return {
+            "client": client,
+            "weight": policy[0],
+            "max_running": policy[1],
+            "running": sum(1 for j in jobs if j.status == RUNNING),
+            "queued": sum(1 for j in jobs if j.status == QUEUED),
+            "jobs": entries,
+        }
+
+    def requeue_expired(self) -> int:
+        now = time.time()
+        expired = "status=? AND lease_until < ?"
+        with self._lock:
+            # 条件更新在同一个写事务内完成：期间完成/续约的作业不再满足条件，不会被重置
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                n = self._conn.execute(
+                    f"UPDATE jobs SET status=?, error=COALESCE(error, '已取消'), finished_at=?, lease_until=NULL "
+                    f"WHERE {expired} AND cancel_requested=1",
+                    (CANCELLED, now, RUNNING, now),
+                ).rowcount
+                n += self._conn.execute(
+                    f"UPDATE jobs SET status=?, error=?, worker_id=NULL, lease_until=NULL "
+                    f"WHERE {expired} AND attempts < ?",
+                    (QUEUED, "worker 租约过期", RUNNING, now, self.max_attempts),
+                ).rowcount
+                n += self._conn.execute(
+                    f"UPDATE jobs SET status=?, error=?, finished_at=?, lease_until=NULL WHERE {expired}",
+                    (FAILED, "worker 租约过期", now, RUNNING, now),
+                ).rowcount
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return n
+
+    def stats(self) -> dict:
+        now = time.time()
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            per_client = self._conn.execute(
+                "SELECT COALESCE(client, ?), SUM(status=?), SUM(status=?) FROM jobs WHERE status IN (?, ?) "
+                "GROUP BY 1 ORDER BY 1",
+                (DEFAULT_CLIENT, QUEUED, RUNNING, QUEUED, RUNNING),
+            ).fetchall()
+            workspaces = dict(self._conn.execute(
+                "SELECT workspace, COUNT(*) FROM jobs WHERE workspace IS NOT NULL GROUP BY workspace"
+            ).fetchall())
+            workers = self._conn.execute(
+                "SELECT worker_id, host, capacity, running, heartbeat_at FROM workers WHERE heartbeat_at > ? "
+                "ORDER BY worker_id",
+                (now - 3 * DEFAULT_LEASE_SECONDS,),
+            ).fetchall()
+        return {
+            "jobs": {s: counts.get(s, 0) for s in (QUEUED, RUNNING, DONE, FAILED, CANCELLED)},
+            "workers": [
+                {"worker_id": w[0], "host": w[1], "capacity": w[2], "running": w[3],
+                 "last_seen": round(now - w[4], 1)}
+                for w in workers
+            ],
+            "capacity": sum(w[2] or 0 for w in workers),
+            "clients": {c: {"queued": q, "running": r} for c, q, r in per_client},
+            "workspaces": workspaces,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_QUEUE_BACKENDS: Dict[str, Callable[[str], JobQueue]] = {
+    "sqlite": lambda url: SqliteJobQueue(url[len("sqlite://"):]),
+}
+
+
+def register_queue_backend(scheme: str, factory: Callable[[str], JobQueue]) -> None:
+    """注册其他队列实现，factory(url) -> JobQueue。"""
+    _QUEUE_BACKENDS[scheme] = factory
+
+
+def shared_root(default: str) -> str:
+    return os.path.abspath(os.environ.get("FASTAPI_SHARED_ROOT") or default)
+
+
+def open_job_queue(url: Optional[str] = None, root: Optional[str] = None) -> JobQueue:
+    """
+    按 URL 打开作业队列。
+
+    :param url: 如 sqlite:////var/lib/mineru/jobs.sqlite3；为空时读 JOB_QUEUE_URL，再退回共享目录下的 jobs.sqlite3
+    :param root: 共享存储根目录（用于默认 URL）
+    """
+    url = url or os.environ.get("JOB_QUEUE_URL") or f"sqlite://{os.path.join(root or '.', 'jobs.sqlite3')}"
+    scheme = url.split("://", 1)[0]
+    if scheme not in _QUEUE_BACKENDS:
+        raise ValueError(f"不支持的作业队列: {url}")
+    return _QUEUE_BACKENDS[scheme](url)
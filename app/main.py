@@ -1,5 +1,5 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks, Request
+from fastapi.responses import FileResponse, JSONResponse, Response
 import os
 import sys
 import shutil
@@ -8,16 +8,34 @@ import subprocess
 import pathlib
 import glob
 import zipfile
+import uuid
+import time
+from typing import Optional
 import logging
+import asyncio
+import threading
 from datetime import datetime
 
+from .hybrid import HYBRID_AVAILABLE, process_pdf_hybrid
+from .job_queue import CANCELLED, DONE, FAILED, FINAL_STATES, QUEUED, open_job_queue, shared_root
+from .procs import run_cancellable
+from .preflight import analyze_upload, estimate_cost
+from .blob_store import BlobStore, is_sha256
+from .clients import ClientPolicy, ClientRegistry, UnknownClient
+from .image_opt import IMAGE_OPT_AVAILABLE, optimize_images, shutdown_pool
+from .workspace import ram_workspaces
+from .timing import (
+    REQUEST_ID_HEADER, clean_request_id, current_request_id, install_log_filter, server_timing, timed,
+    use_request_id,
+)
+
 app = FastAPI(title="FastAPI 文件处理服务", version="0.1.0")
 
 # 模块顶部
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s %(levelname)s %(name)s: %(message)s',
-    filename='/home/nan.li/work/fastapi_zip_service/app/fastapi_log.log',
+    format='%(asctime)s %(levelname)s %(name)s [%(request_id)s]: %(message)s',
+    filename=os.environ.get('FASTAPI_LOG_FILE', '/home/nan.li/work/fastapi_zip_service/app/fastapi_log.log'),
     filemode='a',
 )
 
@@ -25,8 +43,26 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 if not logger.handlers:
     _handler = logging.StreamHandler()
-    _handler.setFormatter(logging.Formatter("[%(asctime)s] %(levelname)s - %(message)s"))
+    _handler.setFormatter(logging.Formatter("[%(asctime)s] %(levelname)s [%(request_id)s] - %(message)s"))
     logger.addHandler(_handler)
+# 每行日志带上请求关联 ID（X-Request-ID），worker 线程中为作业所属请求的 ID
+install_log_filter()
+install_log_filter(logger)
+
+
+@app.middleware("http")
+async def _request_context(request: Request, call_next):
+    """读取或生成关联 ID，写入日志上下文并在响应头中回传；记录请求开始时间供 Server-Timing 计算上传耗时。"""
+    request_id = clean_request_id(request.headers.get(REQUEST_ID_HEADER))
+    request.state.started = time.perf_counter()
+    with use_request_id(request_id):
+        response = await call_next(request)
+        # 状态轮询（GET/HEAD 成功）不记，避免刷屏
+        if request.method not in ("GET", "HEAD") or response.status_code >= 400:
+            elapsed = (time.perf_counter() - request.state.started) * 1000
+            logger.info(f"{request.method} {request.url.path} -> {response.status_code} ({elapsed:.1f} ms)")
+    response.headers[REQUEST_ID_HEADER] = request_id
+    return response
 
 
 def _ensure_dir(path: str) -> None:
@@ -52,8 +88,37 @@ def _save_upload(upload: UploadFile, dst_path: str) -> None:
 
 
 # 将临时工作目录放在项目根目录：/home/nan.li/work/fastapi_zip_service
-PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+PROJECT_ROOT = os.path.abspath(os.environ.get("FASTAPI_WORK_ROOT") or os.path.join(os.path.dirname(__file__), ".."))
 RUN_PREFIX = "fastapi_zip_service_"
+# 共享存储：作业输入与结果 ZIP 放在这里，所有 API 进程与 worker 节点需挂载同一路径
+SHARED_ROOT = shared_root(PROJECT_ROOT)
+# API 进程内嵌 worker 的容量；专职 API 节点设为 0，由 GPU 节点运行 python -m app.worker
+EMBEDDED_WORKERS = int(os.environ.get("FASTAPI_EMBEDDED_WORKERS", "1"))
+JOB_POLL_SECONDS = 0.5
+# 请求未指定 timeout 时的作业截止时间(秒)，与客户端默认超时一致；0 表示不限
+DEFAULT_JOB_TIMEOUT = float(os.environ.get("FASTAPI_JOB_TIMEOUT", "6000"))
+# 打包前是否重新编码 mineru 输出图片（格式/质量/尺寸见 app/image_opt.py 的 FASTAPI_IMAGE_*）；请求可单独覆盖
+IMAGE_OPTIMIZE = os.environ.get("FASTAPI_IMAGE_OPTIMIZE", "0") == "1"
+# blob 存储清理：超过 FASTAPI_BLOB_MAX_AGE 秒未使用的内容删除；总量超过 FASTAPI_BLOB_MAX_BYTES 时按最久未使用淘汰
+# （0 表示不限）；每 FASTAPI_BLOB_SWEEP_INTERVAL 秒检查一次，0 表示不清理
+BLOB_MAX_AGE = float(os.environ.get("FASTAPI_BLOB_MAX_AGE", str(7 * 24 * 3600)))
+BLOB_MAX_BYTES = int(os.environ.get("FASTAPI_BLOB_MAX_BYTES", "0"))
+BLOB_SWEEP_INTERVAL = float(os.environ.get("FASTAPI_BLOB_SWEEP_INTERVAL", "3600"))
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+# 按内容寻址的上传存储，作业输入从这里硬链接到作业目录
+BLOB_STORE = BlobStore(os.path.join(SHARED_ROOT, "blobs"))
+# 按 API key / 请求头识别客户端，队列据此做加权公平调度
+CLIENTS = ClientRegistry(os.environ.get("FASTAPI_CLIENTS_FILE"))
+
+
+def _get_job_queue():
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = open_job_queue(root=SHARED_ROOT)
+        return _job_queue
 
 
 def _make_tmp_root() -> str:
@@ -63,6 +128,118 @@ def _make_tmp_root() -> str:
     return tempfile.mkdtemp(prefix=prefix, dir=PROJECT_ROOT)
 
 
+def _run_mineru(input_path: str, out_dir: str, mineru_backend: str) -> None:
+    """调用 mineru CLI；input_path 可以是单个 PDF 或包含多个 PDF 的目录。失败时抛出 HTTPException。"""
+    mineru_cmd = [
+        "mineru",
+        "-p",
+        input_path,
+        "-o",
+        out_dir,
+        "-b",
+        mineru_backend,
+    ]
+    logger.info(f"mineru 命令: {' '.join(mineru_cmd)}")
+    # 在独立进程组中运行，作业取消/超时时整组终止
+    proc = run_cancellable(mineru_cmd)
+    if proc.returncode != 0:
+        err_msg = (proc.stderr or proc.stdout or "未知错误").strip()
+        raise HTTPException(status_code=500, detail=f"mineru 处理失败: {err_msg}")
+
+
+def _resolve_processor(processor: str) -> str:
+    """规范化处理器名称；hybrid 依赖 PyMuPDF，缺失时回退为 mineru。"""
+    processor = (processor or "mineru").strip().lower()
+    if processor == "hybrid" and not HYBRID_AVAILABLE:
+        logger.warning("未安装 PyMuPDF，processor=hybrid 回退为 mineru")
+        return "mineru"
+    return processor
+
+
+def _run_processor(processor: str, pdf_path: str, out_dir: str, tmp_root: str, mineru_backend: str) -> None:
+    """按处理器生成 mineru 风格输出目录 out_dir/<pdf名>/...。"""
+    if processor == "hybrid":
+        process_pdf_hybrid(
+            pdf_path,
+            out_dir,
+            work_dir=tmp_root,
+            run_mineru=lambda src, dst: _run_mineru(src, dst, mineru_backend),
+            base=pathlib.Path(pdf_path).stem,
+        )
+    else:
+        _run_mineru(pdf_path, out_dir, mineru_backend)
+
+
+def _prepare_input(in_path: str, out_dir: str, timings: Optional[dict] = None) -> str:
+    """返回交给 mineru 的 PDF 路径：PDF 原样使用，doc/docx 先用 LibreOffice 转换到 out_dir。"""
+    in_lower = in_path.lower()
+    if in_lower.endswith(".pdf"):
+        return in_path
+    if in_lower.endswith(".docx") or in_lower.endswith(".doc"):
+        with timed(timings, "convert"):
+            pdf_path = _convert_to_pdf(in_path, out_dir)
+        logger.info(f"doc/docx 转 PDF 完成: {pdf_path}")
+        return pdf_path
+    raise HTTPException(status_code=400, detail="仅支持 PDF 或 doc/docx（将自动转为 PDF）")
+
+
+def _find_doc_dir(out_dir: str, base: str) -> str:
+    """定位 mineru 为 <base> 生成的输出目录（期望 out_dir/<base>）。"""
+    doc_dir = os.path.join(out_dir, base)
+    if not os.path.isdir(doc_dir):
+        # 如果结构不同，兜底尝试查找包含 base 的目录
+        candidates = [d for d in glob.glob(os.path.join(out_dir, "**"), recursive=True) if os.path.isdir(d)]
+        doc_dir = next((d for d in candidates if os.path.basename(d) == base), None)
+    if not doc_dir or not os.path.isdir(doc_dir):
+        raise HTTPException(status_code=500, detail="未找到 mineru 输出目录")
+    return doc_dir
+
+
+def _package_output(
+    doc_dir: str, zip_out: str, optimize: Optional[bool] = None, timings: Optional[dict] = None
+) -> str:
+    """按需重新编码图片，把文档输出目录打包为 zip_out，返回 ZIP 路径。"""
+    base = os.path.basename(doc_dir)
+    if IMAGE_OPTIMIZE if optimize is None else optimize:
+        if IMAGE_OPT_AVAILABLE:
+            with timed(timings, "images"):
+                stats = optimize_images(doc_dir)
+            logger.info(
+                f"图片优化 {base}: {stats['optimized']}/{stats['images']} 张，"
+                f"{stats['bytes_before']} -> {stats['bytes_after']} 字节"
+            )
+        else:
+            logger.warning("未安装 Pillow，跳过图片优化")
+    with timed(timings, "zip"):
+        return _zip_directory(doc_dir, zip_out)
+
+
+def _process_to_zip(
+    in_path: str,
+    work_dir: str,
+    processor: str,
+    mineru_backend: str,
+    optimize: Optional[bool] = None,
+    timings: Optional[dict] = None,
+) -> str:
+    """
+    处理一个输入文件并打包结果目录，返回 ZIP 路径。供作业 worker 调用。
+
+    :param in_path: 输入文件（PDF 或 doc/docx）
+    :param work_dir: 作业工作目录，输出写入 work_dir/output
+    :param optimize: 打包前重新编码图片，None 表示按 FASTAPI_IMAGE_OPTIMIZE
+    :param timings: 传入时把 convert / mineru / images / zip 各阶段耗时（毫秒）写入其中
+    """
+    out_dir = os.path.join(work_dir, "output")
+    _ensure_dir(out_dir)
+    base = pathlib.Path(in_path).stem
+    mineru_input = _prepare_input(in_path, out_dir, timings)
+    with timed(timings, "mineru"):
+        _run_processor(processor, mineru_input, out_dir, work_dir, mineru_backend)
+    doc_dir = _find_doc_dir(out_dir, base)
+    return _package_output(doc_dir, os.path.join(out_dir, f"{base}.zip"), optimize, timings)
+
+
 def _zip_directory(src_dir: str, zip_out_path: str) -> str:
     """将整个目录 src_dir 打包为 zip 文件 zip_out_path。
     保留顶层目录名称为 zip 内的根目录。
@@ -79,8 +256,8 @@ async def process_file(
     background_tasks: BackgroundTasks,
     file: UploadFile = File(..., description="待处理的文件"),
     output_ext: str = Form(default="md", description="输出文件扩展名，默认 md"),
-    processor: str = Form(default="basic", description="处理方式：basic|mineru，默认 basic"),
-    mineru_backend: str = Form(default="vlm-transformers", description="当 processor=mineru 时指定后端，如 vlm-transformers"),
+    processor: str = Form(default="basic", description="处理方式：basic|mineru|hybrid，默认 basic"),
+    mineru_backend: str = Form(default="vlm-transformers", description="当 processor=mineru/hybrid 时指定后端，如 vlm-transformers"),
 ):
     if not file or not file.filename:
         raise HTTPException(status_code=400, detail="未提供文件或文件名为空")
@@ -104,26 +281,14 @@ async def process_file(
 
     base = pathlib.Path(in_path).stem
 
-    # 如果指定使用 MinerU，则调用 mineru CLI 生成 Markdown
-    if processor.strip().lower() == "mineru":
+    # 如果指定使用 MinerU（或按页路由的 hybrid），生成 Markdown
+    processor = _resolve_processor(processor)
+    if processor in ("mineru", "hybrid"):
         if not in_path.lower().endswith(".pdf"):
-            raise HTTPException(status_code=400, detail="当 processor=mineru 时仅支持 PDF 文件")
-
-        # 指定 mineru 输出目录为 out_dir
-        mineru_cmd = [
-            "mineru",
-            "-p",
-            in_path,
-            "-o",
-            out_dir,
-            "-b",
-            mineru_backend,
-        ]
+            raise HTTPException(status_code=400, detail=f"当 processor={processor} 时仅支持 PDF 文件")
 
-        proc = subprocess.run(mineru_cmd, capture_output=True, text=True)
-        if proc.returncode != 0:
-            err_msg = (proc.stderr or proc.stdout or "未知错误").strip()
-            raise HTTPException(status_code=500, detail=f"mineru 处理失败: {err_msg}")
+        # 指定输出目录为 out_dir
+        _run_processor(processor, in_path, out_dir, tmp_root, mineru_backend)
 
         # 查找 mineru 生成的 .md 文件（通常位于 out_dir/<pdf名>/vlm/<pdf名>.md）
         md_candidates = glob.glob(os.path.join(out_dir, "**", "*.md"), recursive=True)
@@ -172,69 +337,324 @@ async def process_file(
     return FileResponse(out_path, media_type=media_type, filename=out_filename)
 
 
-@app.post("/process/zip")
-async def process_zip(
-    file: UploadFile = File(..., description="待处理的 PDF 文件"),
-    processor: str = Form(default="mineru", description="处理方式，仅支持 mineru"),
-    mineru_backend: str = Form(default="vlm-transformers", description="mineru 后端，如 vlm-transformers"),
-):
-    """上传 PDF，调用 mineru 处理，并将整个输出目录打包为 ZIP 返回。"""
-    if processor.strip().lower() != "mineru":
-        raise HTTPException(status_code=400, detail="/process/zip 仅支持 processor=mineru")
-    if not file or not file.filename:
-        raise HTTPException(status_code=400, detail="未提供文件或文件名为空")
+def _store_upload(upload: UploadFile, expected_sha256: Optional[str] = None) -> str:
+    """把上传内容写入 blob 存储，返回 sha256；哈希与声明不一致时返回 400。"""
+    try:
+        sha, size, existed = BLOB_STORE.put_stream(upload.file, expected_sha256)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.info(f"blob {'已存在' if existed else '已保存'}: {sha} ({size} 字节)")
+    return sha
 
-    tmp_root = _make_tmp_root()
-    in_dir = os.path.join(tmp_root, "input")
-    out_dir = os.path.join(tmp_root, "output")
-    _ensure_dir(in_dir)
-    _ensure_dir(out_dir)
-    logger.info(f"in_dir: {in_dir}")
-    logger.info(f"out_dir: {out_dir}")
-    in_path = os.path.join(in_dir, pathlib.Path(file.filename).name)
-    _save_upload(file, in_path)
 
-    base = pathlib.Path(in_path).stem
+def _client_of(request: Request) -> ClientPolicy:
+    """识别请求所属客户端；要求 API key 而未提供或未登记时返回 401。"""
+    try:
+        return CLIENTS.identify(request.headers, request.client.host if request.client else None)
+    except UnknownClient as e:
+        raise HTTPException(status_code=401, detail=str(e))
+
+
+def _enqueue_upload(
+    file: Optional[UploadFile],
+    processor: str,
+    mineru_backend: str,
+    timeout: Optional[float] = None,
+    sha256: Optional[str] = None,
+    filename: Optional[str] = None,
+    client: Optional[ClientPolicy] = None,
+    optimize: Optional[bool] = None,
+):
+    """
+    把输入放入共享存储的作业目录并入队，返回 Job。
 
-    # 调用 mineru 生成输出目录
-    in_lower = in_path.lower()
-    if in_lower.endswith(".pdf"):
-        mineru_input = in_path
-    elif in_lower.endswith(".docx") or in_lower.endswith(".doc"):
-        mineru_input = _convert_to_pdf(in_path, out_dir)
-        logger.info(f"doc/docx 转 PDF 完成: {mineru_input}")
-    else:
+    :param file: 上传文件；为空时按 sha256 引用服务端已有的 blob（需同时给出 filename）
+    :param timeout: 作业截止时间（秒，从入队起算）
+    :param client: 提交作业的客户端，决定公平调度的分组、权重与并发上限
+    :param optimize: 是否重新编码输出图片，None 表示按服务端默认
+    """
+    processor = _resolve_processor(processor)
+    if processor not in ("mineru", "hybrid"):
+        raise HTTPException(status_code=400, detail="仅支持 processor=mineru|hybrid")
+    if file is not None and file.filename:
+        filename = file.filename
+    if not filename:
+        raise HTTPException(status_code=400, detail="未提供文件或文件名为空")
+    filename = pathlib.Path(filename).name
+    if not filename.lower().endswith((".pdf", ".docx", ".doc")):
         raise HTTPException(status_code=400, detail="仅支持 PDF 或 doc/docx（将自动转为 PDF）")
+    sha256 = (sha256 or "").strip().lower() or None
+    if file is not None and file.filename:
+        sha256 = _store_upload(file, sha256)
+    elif not sha256 or not is_sha256(sha256):
+        raise HTTPException(status_code=400, detail="未提供文件，也未提供合法的 sha256")
+    elif not BLOB_STORE.exists(sha256):
+        raise HTTPException(status_code=404, detail=f"服务端没有该内容，请先 POST /blobs/{sha256}")
+
+    job_id = uuid.uuid4().hex
+    in_dir = os.path.join(SHARED_ROOT, "jobs", job_id, "input")
+    _ensure_dir(in_dir)
+    in_path = os.path.join(in_dir, filename)
+    try:
+        BLOB_STORE.link_to(sha256, in_path)
+    except FileNotFoundError:
+        _cleanup_dir(os.path.dirname(in_dir))
+        raise HTTPException(status_code=404, detail=f"服务端没有该内容，请先 POST /blobs/{sha256}")
+    timeout = DEFAULT_JOB_TIMEOUT if timeout is None else timeout
+    deadline = time.time() + timeout if timeout and timeout > 0 else None
+    # 预检页数/图片数，用历史耗时估计成本，队列据此短作业优先
+    queue = _get_job_queue()
+    preflight = analyze_upload(in_path, os.path.getsize(in_path))
+    est_cost = estimate_cost(preflight, queue.history(processor))
+    client = client or ClientPolicy("anonymous")
+    # 只有登记的客户端能更新调度参数；未登记客户端按默认值登记一次，请求头无法改写他人的权重与上限
+    queue.set_client_policy(client.client_id, client.weight, client.max_running, overwrite=client.registered)
+    optimize = IMAGE_OPTIMIZE if optimize is None else optimize
+    # 相同内容 + 相同处理参数的进行中请求合并为一个作业
+    dedup_key = f"{sha256}:{processor}:{mineru_backend}:{int(optimize)}"
+    job = queue.enqueue(
+        in_path, filename, processor, mineru_backend, meta={"sha256": sha256, "optimize_images": optimize, "request_id": current_request_id()},
+        job_id=job_id, deadline=deadline, preflight=preflight.to_dict(), est_cost=est_cost,
+        client=client.client_id, dedup_key=dedup_key,
+    )
+    if job.job_id != job_id:
+        _cleanup_dir(os.path.dirname(in_dir))
+        logger.info(f"合并到已有作业 {job.job_id}（{job.status}，等待者 {job.waiters}）: {filename}")
+        return job
+    logger.info(
+        f"作业入队 {job_id}: {filename} ({processor}) {preflight.pages} 页 {preflight.images} 图，"
+        f"预计 {est_cost}s，客户端 {client.client_id}"
+    )
+    return job
+
+
+async def _wait_for_job(job_id: str, request: Optional[Request] = None):
+    """等待作业结束；客户端断开或排队超过截止时间时请求取消，避免 GPU 为无人领取的结果工作。"""
+    queue = _get_job_queue()
+    while True:
+        job = await asyncio.to_thread(queue.get, job_id)
+        if job is None or job.status in FINAL_STATES:
+            return job
+        if request is not None and await request.is_disconnected():
+            logger.warning(f"客户端已断开，退出作业 {job_id}")
+            # 其他请求也在等待同一作业时作业继续；最后一个等待者离开后宽限期内无人重新提交才取消
+            return await asyncio.to_thread(queue.detach, job_id, "客户端已断开")
+        if job.status == QUEUED and job.deadline and time.time() > job.deadline:
+            await asyncio.to_thread(queue.request_cancel, job_id, "排队超过作业截止时间")
+            continue
+        await asyncio.sleep(JOB_POLL_SECONDS)
+
+
+def _result_headers(job, upload_ms: Optional[float] = None) -> dict:
+    """结果响应头：Server-Timing 给出上传、排队与作业各阶段耗时（毫秒）。"""
+    timings = dict(job.timings)
+    if upload_ms is not None:
+        timings["upload"] = round(upload_ms, 1)
+    if job.started_at and job.created_at:
+        timings["queue"] = round((job.started_at - job.created_at) * 1000, 1)
+    if job.finished_at and job.started_at:
+        timings["total"] = round((job.finished_at - job.started_at) * 1000, 1)
+    return {"Server-Timing": server_timing(timings)} if timings else {}
+
+
+def _upload_ms(request: Request) -> float:
+    """从收到请求到输入落盘入队的耗时（含请求体接收与解析）。"""
+    return (time.perf_counter() - request.state.started) * 1000
+
+
+def _job_response(job, eta: Optional[dict] = None) -> dict:
+    d = job.to_dict()
+    if eta:
+        d.update(eta)
+    d["status_url"] = f"/jobs/{job.job_id}"
+    d["result_url"] = f"/jobs/{job.job_id}/result"
+    return d
 
-    mineru_cmd = [
-        "mineru",
-        "-p",
-        mineru_input,
-        "-o",
-        out_dir,
-        "-b",
-        mineru_backend,
-    ]
-    logger.info(f"mineru 命令: {' '.join(mineru_cmd)}")
-    print(f"print mineru 命令: {' '.join(mineru_cmd)}")
-    proc = subprocess.run(mineru_cmd, capture_output=True, text=True)
-    if proc.returncode != 0:
-        err_msg = (proc.stderr or proc.stdout or "未知错误").strip()
-        raise HTTPException(status_code=500, detail=f"mineru 处理失败: {err_msg}")
-
-    # 期望输出目录：out_dir/<base>
-    doc_dir = os.path.join(out_dir, base)
-    if not os.path.isdir(doc_dir):
-        # 如果结构不同，兜底尝试查找包含 base 的目录
-        candidates = [d for d in glob.glob(os.path.join(out_dir, "**"), recursive=True) if os.path.isdir(d)]
-        doc_dir = next((d for d in candidates if os.path.basename(d) == base), None)
-    if not doc_dir or not os.path.isdir(doc_dir):
-        raise HTTPException(status_code=500, detail="未找到 mineru 输出目录")
-
-    zip_out = os.path.join(out_dir, f"{base}.zip")
-    zip_path = _zip_directory(doc_dir, zip_out)
 
-    return FileResponse(zip_path, media_type="application/zip", filename=os.path.basename(zip_path))
+@app.post("/process/zip")
+async def process_zip(
+    request: Request,
+    file: Optional[UploadFile] = File(default=None, description="待处理的 PDF 文件；已通过 /blobs 上传时可省略"),
+    processor: str = Form(default="mineru", description="处理方式：mineru|hybrid（文本层页面直接抽取，仅复杂页走 mineru）"),
+    mineru_backend: str = Form(default="vlm-transformers", description="mineru 后端，如 vlm-transformers"),
+    timeout: Optional[float] = Form(default=None, description="作业截止时间（秒），默认 FASTAPI_JOB_TIMEOUT"),
+    sha256: Optional[str] = Form(default=None, description="按内容哈希引用已上传的 blob（不带 file 时必填）"),
+    filename: Optional[str] = Form(default=None, description="按哈希提交时的文件名（决定输出目录名与类型）"),
+    optimize_images: Optional[bool] = Form(default=None, description="打包前重新编码图片，默认按 FASTAPI_IMAGE_OPTIMIZE"),
+):
+    """上传 PDF（或按哈希引用），入队等待任意 worker 处理完成，并将整个输出目录打包为 ZIP 返回。客户端断开时取消作业。"""
+    # 哈希、预检（逐页扫描图片）与 sqlite 写事务都是阻塞操作，放到线程里，避免卡住事件循环上的其他请求
+    job = await asyncio.to_thread(
+        _enqueue_upload,
+        file, processor, mineru_backend, timeout, sha256, filename, _client_of(request), optimize_images,
+    )
+    upload_ms = _upload_ms(request)
+    job = await _wait_for_job(job.job_id, request)
+    if job is None:
+        raise HTTPException(status_code=500, detail="作业丢失")
+    if job.status == CANCELLED:
+        raise HTTPException(status_code=504, detail=job.error or "作业已取消")
+    if job.status == FAILED:
+        raise HTTPException(status_code=500, detail=job.error or "处理失败")
+    if job.status != DONE:
+        # 客户端已断开而作业仍在为其他等待者运行，响应不会被读取
+        raise HTTPException(status_code=409, detail=f"作业尚未完成: {job.status}")
+    return FileResponse(
+        job.result_path, media_type="application/zip", filename=os.path.basename(job.result_path),
+        headers=_result_headers(job, upload_ms),
+    )
+
+
+@app.post("/jobs")
+async def submit_job(
+    request: Request,
+    file: Optional[UploadFile] = File(default=None, description="待处理的 PDF 或 doc/docx 文件；已通过 /blobs 上传时可省略"),
+    processor: str = Form(default="mineru", description="处理方式：mineru|hybrid"),
+    mineru_backend: str = Form(default="vlm-transformers", description="mineru 后端，如 vlm-transformers"),
+    timeout: Optional[float] = Form(default=None, description="作业截止时间（秒），默认 FASTAPI_JOB_TIMEOUT"),
+    sha256: Optional[str] = Form(default=None, description="按内容哈希引用已上传的 blob（不带 file 时必填）"),
+    filename: Optional[str] = Form(default=None, description="按哈希提交时的文件名"),
+    optimize_images: Optional[bool] = Form(default=None, description="打包前重新编码图片，默认按 FASTAPI_IMAGE_OPTIMIZE"),
+):
+    """异步提交：立即返回作业 id，之后轮询 /jobs/{job_id} 并从 /jobs/{job_id}/result 下载 ZIP。"""
+    # 哈希、预检（逐页扫描图片）与 sqlite 写事务都是阻塞操作，放到线程里，避免卡住事件循环上的其他请求
+    job = await asyncio.to_thread(
+        _enqueue_upload,
+        file, processor, mineru_backend, timeout, sha256, filename, _client_of(request), optimize_images,
+    )
+    upload_ms = _upload_ms(request)
+    eta = await asyncio.to_thread(_get_job_queue().eta, job.job_id)
+    return JSONResponse(
+        _job_response(job, eta), status_code=202, headers={"Server-Timing": server_timing({"upload": upload_ms})}
+    )
+
+
+@app.head("/blobs/{sha256}")
+async def blob_exists(request: Request, sha256: str):
+    """询问服务端是否已有该内容：200 表示已有（可直接按哈希提交），404 表示需要先上传。"""
+    _client_of(request)
+    sha256 = sha256.lower()
+    if not is_sha256(sha256):
+        raise HTTPException(status_code=400, detail="非法 sha256")
+    if not BLOB_STORE.exists(sha256):
+        raise HTTPException(status_code=404, detail="blob 不存在")
+    # 客户端接下来会按哈希提交，刷新使用时间避免恰好被清理
+    BLOB_STORE.touch(sha256)
+    return Response(status_code=200, headers={"Content-Length": str(BLOB_STORE.size(sha256))})
+
+
+@app.post("/blobs/{sha256}")
+async def blob_upload(request: Request, sha256: str, file: UploadFile = File(..., description="内容哈希为 sha256 的文件")):
+    """上传一次内容，之后的处理请求都按哈希引用；已存在时直接返回。"""
+    _client_of(request)
+    sha256 = sha256.lower()
+    if not is_sha256(sha256):
+        raise HTTPException(status_code=400, detail="非法 sha256")
+    existed = BLOB_STORE.exists(sha256)
+    if not existed:
+        await asyncio.to_thread(_store_upload, file, sha256)
+    return JSONResponse({"sha256": sha256, "size": BLOB_STORE.size(sha256), "existed": existed})
+
+
+@app.get("/jobs")
+async def job_stats():
+    stats = await asyncio.to_thread(_get_job_queue().stats)
+    # 本机（API 节点）RAM 工作区的预算占用；各 worker 节点各自计算
+    stats["ram_workspace"] = await asyncio.to_thread(ram_workspaces().usage)
+    return JSONResponse(stats)
+
+
+@app.get("/clients/me")
+async def client_status(request: Request):
+    """当前客户端（按 API key / X-Client-Id / 来源 IP 识别）的运行中与排队作业及各自的排队位置。"""
+    client = _client_of(request)
+    summary = await asyncio.to_thread(_get_job_queue().client_summary, client.client_id)
+    return JSONResponse(summary)
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = await asyncio.to_thread(_get_job_queue().get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="作业不存在")
+    eta = await asyncio.to_thread(_get_job_queue().eta, job_id)
+    return JSONResponse(_job_response(job, eta))
+
+
+@app.get("/jobs/{job_id}/result")
+async def job_result(job_id: str):
+    job = await asyncio.to_thread(_get_job_queue().get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="作业不存在")
+    if job.status == FAILED:
+        raise HTTPException(status_code=500, detail=job.error or "处理失败")
+    if job.status == CANCELLED:
+        raise HTTPException(status_code=410, detail=job.error or "作业已取消")
+    if job.status != DONE:
+        raise HTTPException(status_code=409, detail=f"作业尚未完成: {job.status}")
+    return FileResponse(
+        job.result_path, media_type="application/zip", filename=os.path.basename(job.result_path),
+        headers=_result_headers(job),
+    )
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """
+    取消作业：排队中的立即取消；运行中的由所在 worker 在下次心跳时杀掉 mineru 进程组并清理工作目录。
+    作业被多个相同请求共用时只退出调用方，其余等待者仍会拿到结果。
+    """
+    job = await asyncio.to_thread(_get_job_queue().detach, job_id, "用户取消", True)
+    if job is None:
+        raise HTTPException(status_code=404, detail="作业不存在")
+    if job.status not in FINAL_STATES and not job.cancel_requested:
+        return JSONResponse(_job_response(job))
+    # 作业恰好在本进程内嵌 worker 上运行时立即终止，不等心跳
+    worker = getattr(app.state, "worker", None)
+    if worker is not None:
+        worker.cancel(job_id, "用户取消")
+    return JSONResponse(_job_response(job))
+
+
+@app.on_event("startup")
+def _start_embedded_worker():
+    if EMBEDDED_WORKERS <= 0:
+        return
+    # 延迟导入，避免与 worker 模块循环导入
+    from .worker import Worker
+
+    app.state.worker = Worker(_get_job_queue(), capacity=EMBEDDED_WORKERS).start()
+
+
+def _sweep_blobs(stop: threading.Event) -> None:
+    while not stop.wait(BLOB_SWEEP_INTERVAL):
+        try:
+            removed, freed = BLOB_STORE.sweep(BLOB_MAX_AGE, BLOB_MAX_BYTES)
+            if removed:
+                logger.info(f"blob 清理: 删除 {removed} 个，释放 {freed} 字节")
+        except Exception as e:
+            logger.warning(f"blob 清理失败: {e}")
+
+
+@app.on_event("startup")
+def _start_blob_sweeper():
+    if BLOB_SWEEP_INTERVAL <= 0 or (BLOB_MAX_AGE <= 0 and BLOB_MAX_BYTES <= 0):
+        return
+    app.state.blob_sweeper_stop = threading.Event()
+    threading.Thread(
+        target=_sweep_blobs, args=(app.state.blob_sweeper_stop,), name="blob-sweeper", daemon=True
+    ).start()
+
+
+@app.on_event("shutdown")
+def _stop_embedded_worker():
+    worker = getattr(app.state, "worker", None)
+    if worker is not None:
+        worker.stop(timeout=5)
+    stop = getattr(app.state, "blob_sweeper_stop", None)
+    if stop is not None:
+        stop.set()
+    shutdown_pool()
 
 
 @app.post("/zip_dir")
@@ -279,7 +699,7 @@ def _convert_to_pdf(src_path: str, out_dir: str) -> str:
         src_path,
     ]
     logger.info(f"convert cmd: {' '.join(cmd)}")
-    proc = subprocess.run(cmd, capture_output=True, text=True)
+    proc = run_cancellable(cmd)
     if proc.returncode != 0 or not os.path.exists(pdf_path):
         err_msg = (proc.stderr or proc.stdout or "未知错误").strip()
         raise HTTPException(status_code=500, detail=f"文档转 PDF 失败: {err_msg}")
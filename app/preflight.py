@@ -0,0 +1,128 @@
+"""
+上传预检与耗时估计：入队前读取页数、字节数与图片数量，并用历史作业的实际耗时拟合出预计处理时间，
+作业队列按预计耗时排序（短作业优先，带老化防止大文档饿死）。
+"""
+import re
+import zipfile
+from typing import List, Optional, Tuple
+
+try:
+    import pymupdf as fitz
+except ImportError:
+    try:
+        import fitz
+    except ImportError:  # 可选依赖，缺失时用字节扫描估计
+        fitz = None
+
+# 图片相对一页文字的权重：mineru 的版面/OCR 成本主要随页数和图片数增长
+IMAGE_WEIGHT = 0.5
+# 历史样本不足时的默认模型：固定开销 + 每等效页耗时(秒)
+DEFAULT_BASE_SECONDS = 20.0
+DEFAULT_SECONDS_PER_PAGE = 4.0
+MIN_HISTORY = 5
+# docx 没有分页信息，按 document.xml 文本量粗略折算页数
+DOCX_BYTES_PER_PAGE = 12000
+
+_PAGE_RE = re.compile(rb"/Type\s*/Page(?!s)")
+_IMAGE_RE = re.compile(rb"/Subtype\s*/Image")
+
+
+class Preflight:
+    """一次上传的预检结果。"""
+
+    def __init__(self, size_bytes: int, pages: int, images: int):
+        self.size_bytes = size_bytes
+        self.pages = max(1, pages)
+        self.images = images
+
+    @property
+    def work_units(self) -> float:
+        return self.pages + IMAGE_WEIGHT * self.images
+
+    @property
+    def image_density(self) -> float:
+        return self.images / self.pages
+
+    def to_dict(self) -> dict:
+        return {
+            "size_bytes": self.size_bytes,
+            "pages": self.pages,
+            "images": self.images,
+            "image_density": round(self.image_density, 3),
+            "work_units": self.work_units,
+        }
+
+
+def _scan_pdf_bytes(path: str) -> Tuple[int, int]:
+    with open(path, "rb") as f:
+        data = f.read()
+    return len(_PAGE_RE.findall(data)), len(_IMAGE_RE.findall(data))
+
+
+def _analyze_pdf(path: str) -> Tuple[int, int]:
+    if fitz is None:
+        return _scan_pdf_bytes(path)
+    try:
+        doc = fitz.open(path)
+    except Exception:
+        return _scan_pdf_bytes(path)
+    try:
+        images = sum(len(page.get_images(full=False)) for page in doc)
+        return doc.page_count, images
+    finally:
+        doc.close()
+
+
+def _analyze_docx(path: str) -> Tuple[int, int]:
+    try:
+        with zipfile.ZipFile(path) as zf:
+            text_bytes = zf.getinfo("word/document.xml").file_size
+            images = sum(1 for n in zf.namelist() if n.startswith("word/media/"))
+    except (zipfile.BadZipFile, KeyError):
+        return 1, 0
+    return max(1, text_bytes // DOCX_BYTES_PER_PAGE), images
+
+
+def analyze_upload(path: str, size_bytes: int) -> Preflight:
+    """
+    读取上传文件的页数与图片数量；解析失败时按 1 页处理，不影响入队。
+
+    :param path: 上传文件路径（PDF / docx / doc）
+    :param size_bytes: 文件字节数
+    """
+    lower = path.lower()
+    try:
+        if lower.endswith(".pdf"):
+            pages, images = _analyze_pdf(path)
+        elif lower.endswith(".docx"):
+            pages, images = _analyze_docx(path)
+        else:
+            pages, images = max(1, size_bytes // (DOCX_BYTES_PER_PAGE * 4)), 0
+    except OSError:
+        pages, images = 1, 0
+    return Preflight(size_bytes, pages, images)
+
+
+def fit_cost_model(history: List[Tuple[float, float]]) -> Tuple[float, float]:
+    """
+    对历史 (等效页数, 实际耗时秒) 做一元最小二乘，返回 (固定开销, 每等效页耗时)。样本不足时返回默认值。
+    """
+    if len(history) < MIN_HISTORY:
+        return DEFAULT_BASE_SECONDS, DEFAULT_SECONDS_PER_PAGE
+    n = len(history)
+    mean_x = sum(x for x, _ in history) / n
+    mean_y = sum(y for _, y in history) / n
+    var = sum((x - mean_x) ** 2 for x, _ in history)
+    if var <= 0:
+        # 所有样本页数相同，无法区分固定开销与每页耗时：按比例折算
+        return 0.0, mean_y / mean_x if mean_x else DEFAULT_SECONDS_PER_PAGE
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in history) / var
+    slope = max(0.0, slope)
+    base = max(0.0, mean_y - slope * mean_x)
+    return base, slope
+
+
+def estimate_cost(preflight: Preflight, history: Optional[List[Tuple[float, float]]] = None) -> float:
+    """按历史耗时模型估计作业处理时间(秒)。"""
+    base, per_unit = fit_cost_model(history or [])
+    return round(base + per_unit * preflight.work_units, 3)
@@ -0,0 +1,182 @@
+"""
+可取消的子进程执行：mineru / libreoffice 在独立进程组中运行，截止时间到达或作业被取消时整组杀掉，
+避免客户端放弃后 GPU 仍在为无人领取的结果工作。
+
+worker 为每个作业创建 CancelToken 并通过 use_token 绑定到当前线程，run_cancellable 自动读取。
+"""
+import os
+import time
+import signal
+import tempfile
+import threading
+import subprocess
+from contextlib import contextmanager
+from typing import List, Optional
+
+# SIGTERM 后等待进程组退出的宽限时间(秒)，超时改发 SIGKILL
+KILL_GRACE_SECONDS = 10
+
+_local = threading.local()
+
+
+class JobCancelled(Exception):
+    """作业被取消或超过截止时间。"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class CancelToken:
+    """
+    作业的取消信号与截止时间。
+
+    :param deadline: 绝对截止时间（time.time() 时间戳），None 表示不限
+    """
+
+    def __init__(self, deadline: Optional[float] = None):
+        self.deadline = deadline
+        self.reason = ""
+        self._event = threading.Event()
+
+    def cancel(self, reason: str) -> None:
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        if not self._event.is_set() and self.deadline is not None and time.time() >= self.deadline:
+            self.cancel("超过作业截止时间")
+        return self._event.is_set()
+
+    def check(self) -> None:
+        if self.cancelled:
+            raise JobCancelled(self.reason)
+
+    def wait(self, timeout: float) -> bool:
+        if self.deadline is not None:
+            timeout = max(0.0, min(timeout, self.deadline - time.time()))
+        return self._event.wait(timeout) or self.cancelled
+
+
+class BatchToken(CancelToken):
+    """
+    多个作业合并为一次 mineru 调用时的取消信号：只有全部成员都被取消（或都超过截止时间）才终止进程；
+    单个成员取消时批次继续，由 worker 在批次结束后丢弃它的结果。
+
+    :param members: 各成员作业的 CancelToken
+    """
+
+    def __init__(self, members: List[CancelToken]):
+        self.members = list(members)
+        super().__init__(None)
+
+    @property
+    def deadline(self) -> Optional[float]:
+        # 每次按成员当前截止时间计算：成员的截止时间会随心跳延后
+        deadlines = [t.deadline for t in self.members]
+        return None if not deadlines or None in deadlines else max(deadlines)
+
+    @deadline.setter
+    def deadline(self, value: Optional[float]) -> None:
+        # 批次截止时间由成员决定，忽略直接赋值
+        pass
+
+    @property
+    def cancelled(self) -> bool:
+        if not self._event.is_set() and self.members and all(t.cancelled for t in self.members):
+            self.cancel("批次内作业均已取消")
+        return super().cancelled
+
+
+@contextmanager
+def use_token(token: Optional[CancelToken]):
+    prev = getattr(_local, "token", None)
+    _local.token = token
+    try:
+        yield token
+    finally:
+        _local.token = prev
+
+
+def current_token() -> Optional[CancelToken]:
+    return getattr(_local, "token", None)
+
+
+def _group_alive(proc: subprocess.Popen, pgid: int) -> bool:
+    """进程组内是否还有存活进程；先回收组长，避免僵尸进程让组看起来仍然存活。"""
+    proc.poll()
+    try:
+        os.killpg(pgid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _kill_group(proc: subprocess.Popen) -> None:
+    """
+    先发 SIGTERM，宽限期内整组退出即结束；宽限期后组内仍有进程（不论组长是否已退出）就整组 SIGKILL，
+    避免忽略 SIGTERM 的 mineru 子进程在组长退出后继续占用 GPU。
+    """
+    try:
+        pgid = os.getpgid(proc.pid)
+    except ProcessLookupError:
+        return
+    try:
+        os.killpg(pgid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    deadline = time.time() + KILL_GRACE_SECONDS
+    while _group_alive(proc, pgid) and time.time() < deadline:
+        time.sleep(0.1)
+    if _group_alive(proc, pgid):
+        try:
+            os.killpg(pgid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    try:
+        proc.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        pass
+
+
+def run_cancellable(cmd: List[str], token: Optional[CancelToken] = None, poll: float = 0.5) -> subprocess.CompletedProcess:
+    """
+    运行命令并在取消/超时时杀掉整个进程组（mineru 会派生多个子进程）。
+
+    :param cmd: 命令行
+    :param token: 取消信号，默认取当前线程绑定的 token
+    :return: CompletedProcess（stdout/stderr 为文本）
+    :raises JobCancelled: 作业被取消或超过截止时间
+    """
+    token = token or current_token()
+    if token is not None:
+        token.check()
+    # 输出写临时文件而不是管道，避免长时间运行时管道写满阻塞
+    with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+        proc = subprocess.Popen(cmd, stdout=out, stderr=err, start_new_session=True)
+        try:
+            while True:
+                try:
+                    proc.wait(timeout=poll)
+                    break
+                except subprocess.TimeoutExpired:
+                    pass
+                if token is not None and token.cancelled:
+                    _kill_group(proc)
+                    raise JobCancelled(token.reason)
+        except BaseException:
+            if proc.poll() is None:
+                _kill_group(proc)
+            raise
+        out.seek(0)
+        err.seek(0)
+        return subprocess.CompletedProcess(
+            cmd,
+            proc.returncode,
+            out.read().decode("utf-8", errors="replace"),
+            err.read().decode("utf-8", errors="replace"),
+        )
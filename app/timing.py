@@ -0,0 +1,79 @@
+"""
+请求关联 ID 与阶段耗时：客户端在 X-Request-ID 中带上关联 ID（缺省时服务端生成），API 日志、worker 日志
+与响应头都带上它；作业各阶段（转换、mineru、图片、打包）的耗时随结果以 Server-Timing 响应头返回。
+"""
+import re
+import time
+import uuid
+import logging
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+REQUEST_ID_HEADER = "X-Request-ID"
+# Server-Timing 中各阶段的输出顺序
+STAGES = ("upload", "queue", "convert", "mineru", "images", "zip", "total")
+
+_REQUEST_ID_RE = re.compile(r"[^0-9A-Za-z._:-]+")
+_request_id = contextvars.ContextVar("request_id", default="-")
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+def clean_request_id(value: Optional[str]) -> str:
+    """只保留安全字符并截断，避免请求头内容污染日志；为空时生成新 ID。"""
+    value = _REQUEST_ID_RE.sub("", value or "")[:64]
+    return value or new_request_id()
+
+
+def current_request_id() -> str:
+    return _request_id.get()
+
+
+@contextmanager
+def use_request_id(request_id: Optional[str]) -> Iterator[None]:
+    """在当前上下文（线程 / 协程）内设置关联 ID，退出时恢复。"""
+    token = _request_id.set(request_id or "-")
+    try:
+        yield
+    finally:
+        _request_id.reset(token)
+
+
+class RequestIdFilter(logging.Filter):
+    """给日志记录补上 request_id 字段，格式串中用 %(request_id)s 引用。"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "request_id"):
+            record.request_id = _request_id.get()
+        return True
+
+
+def install_log_filter(logger: Optional[logging.Logger] = None) -> None:
+    """给 logger（默认根 logger）的全部 handler 挂上 RequestIdFilter；重复调用不会重复挂载。"""
+    logger = logger or logging.getLogger()
+    for handler in logger.handlers:
+        if not any(isinstance(f, RequestIdFilter) for f in handler.filters):
+            handler.addFilter(RequestIdFilter())
+
+
+@contextmanager
+def timed(timings: Optional[Dict[str, float]], stage: str) -> Iterator[None]:
+    """把代码块耗时（毫秒）累加到 timings[stage]；timings 为 None 时不计时。"""
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = round(timings.get(stage, 0.0) + (time.perf_counter() - start) * 1000, 1)
+
+
+def server_timing(timings: Dict[str, float]) -> str:
+    """按 STAGES 顺序格式化为 Server-Timing 头：upload;dur=12.3, mineru;dur=4567.8, ..."""
+    names = [s for s in STAGES if s in timings] + sorted(s for s in timings if s not in STAGES)
+    return ", ".join(f"{name};dur={timings[name]:.1f}" for name in names)
+
@@ -0,0 +1,402 @@
+"""
+作业 worker：从共享作业队列按空闲容量拉取作业，在本机运行 mineru/hybrid，结果 ZIP 写回共享存储。
+
+API 进程启动时会内嵌一个 worker（容量由 FASTAPI_EMBEDDED_WORKERS 控制，0 表示只入队不处理）；
+同一主机上也可以单独运行 worker 进程：
+
+    python -m app.worker --capacity 1
+
+默认的 sqlite 队列只支持单机。多个 GPU 节点需挂载同一共享存储（作业输入/输出），
+并通过 JOB_QUEUE_URL 使用已注册的网络化队列实现（见 job_queue.register_queue_backend）：
+
+    FASTAPI_SHARED_ROOT=/mnt/shared JOB_QUEUE_URL=<scheme>://<queue-host> python -m app.worker --capacity 1
+
+小文档合并执行：领取到一个可合并的 mineru 作业后，在 FASTAPI_BATCH_WINDOW 秒内继续领取同一后端的小作业
+（最多 FASTAPI_BATCH_MAX_JOBS 个，每个不超过 FASTAPI_BATCH_MAX_PAGES 页），对批次目录只运行一次 mineru，
+模型加载与批处理开销由整批分摊；输出按文档拆回各作业分别打包。整批失败时逐个重试。
+FASTAPI_BATCH_MAX_JOBS=1 关闭合并。
+"""
+import os
+import sys
+import time
+import uuid
+import socket
+import shutil
+import logging
+import pathlib
+import threading
+from typing import Dict, List, Optional
+
+from .job_queue import JobQueue, DEFAULT_LEASE_SECONDS, open_job_queue
+from .main import SHARED_ROOT, _find_doc_dir, _package_output, _prepare_input, _process_to_zip, _run_mineru
+from .procs import BatchToken, CancelToken, JobCancelled, use_token
+from .image_opt import shutdown_pool
+from .workspace import DISK, job_workspace
+from .timing import install_log_filter, use_request_id
+
+logger = logging.getLogger(__name__)
+
+# 合并批次的作业数上限（1 表示不合并）、凑批等待时间(秒)与单个作业的页数上限
+BATCH_MAX_JOBS = int(os.environ.get("FASTAPI_BATCH_MAX_JOBS", "4"))
+BATCH_WINDOW = float(os.environ.get("FASTAPI_BATCH_WINDOW", "0.5"))
+BATCH_MAX_PAGES = int(os.environ.get("FASTAPI_BATCH_MAX_PAGES", "20"))
+BATCH_POLL_SECONDS = 0.1
+
+
+def run_job(job, queue: Optional[JobQueue] = None, timings: Optional[dict] = None) -> str:
+    """
+    处理单个作业，返回结果 ZIP 路径（位于共享存储上的作业目录）。
+
+    小文档在 RAM 工作区（tmpfs）中处理，完成后只把 ZIP 移回共享存储；其余直接在共享存储的作业目录中处理。
+
+    :param timings: 传入时写入各处理阶段耗时（毫秒）
+    """
+    input_bytes = job.size_bytes or os.path.getsize(job.input_path)
+    with job_workspace(job.job_id, job.job_dir, input_bytes) as (work_dir, backend):
+        logger.info(f"作业 {job.job_id} 使用 {backend} 工作区: {work_dir}")
+        if queue is not None:
+            queue.set_workspace(job.job_id, backend)
+        if backend == DISK:
+            return _process_to_zip(
+                job.input_path, work_dir, job.processor, job.mineru_backend, job.meta.get("optimize_images"), timings
+            )
+        in_dir = os.path.join(work_dir, "input")
+        os.makedirs(in_dir, exist_ok=True)
+        in_path = os.path.join(in_dir, os.path.basename(job.input_path))
+        shutil.copyfile(job.input_path, in_path)
+        zip_path = _process_to_zip(
+            in_path, work_dir, job.processor, job.mineru_backend, job.meta.get("optimize_images"), timings
+        )
+        result_dir = os.path.join(job.job_dir, "output")
+        os.makedirs(result_dir, exist_ok=True)
+        result_path = os.path.join(result_dir, os.path.basename(zip_path))
+        shutil.move(zip_path, result_path)
+        return result_path
+
+
+def _link_or_copy(src: str, dst: str) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def run_batch(jobs: list, queue: Optional[JobQueue] = None,
+              timings: Optional[Dict[str, dict]] = None) -> Dict[str, object]:
+    """
+    对一批同一后端的 mineru 作业只运行一次 mineru，返回 {job_id: 结果 ZIP 路径或该作业的异常}。
+
+    批次工作区按全部输入大小申请（RAM 不足时落在共享存储的 batches/ 下）；各作业的输入（doc/docx 先转换）
+    放进同一输入目录，mineru 输出的 <文档名>/ 子目录拆回各作业，分别打包到各自作业目录。
+    mineru 整批失败时抛出异常，由调用方逐个重试。
+
+    :param timings: 传入时按 job_id 写入各作业的阶段耗时；mineru 为整批耗时
+    """
+    timings = timings if timings is not None else {}
+    batch_id = f"batch-{uuid.uuid4().hex[:12]}"
+    disk_dir = os.path.join(SHARED_ROOT, "batches", batch_id)
+    input_bytes = sum(job.size_bytes or os.path.getsize(job.input_path) for job in jobs)
+    results = {}
+    try:
+        with job_workspace(batch_id, disk_dir, input_bytes) as (work_dir, backend):
+            in_dir = os.path.join(work_dir, "input")
+            out_dir = os.path.join(work_dir, "output")
+            os.makedirs(in_dir, exist_ok=True)
+            os.makedirs(out_dir, exist_ok=True)
+            logger.info(f"合并批次 {batch_id}: {len(jobs)} 个作业，使用 {backend} 工作区: {work_dir}")
+            ready = []
+            for job in jobs:
+                if queue is not None:
+                    queue.set_workspace(job.job_id, backend)
+                job_timings = timings.setdefault(job.job_id, {})
+                conv_dir = os.path.join(work_dir, "convert", job.job_id)
+                try:
+                    os.makedirs(conv_dir, exist_ok=True)
+                    src = os.path.join(conv_dir, os.path.basename(job.input_path))
+                    _link_or_copy(job.input_path, src)
+                    pdf_path = _prepare_input(src, conv_dir, job_timings)
+                    _link_or_copy(pdf_path, os.path.join(in_dir, os.path.basename(pdf_path)))
+                    ready.append(job)
+                except Exception as e:
+                    results[job.job_id] = e
+            if not ready:
+                return results
+            start = time.perf_counter()
+            _run_mineru(in_dir, out_dir, ready[0].mineru_backend)
+            mineru_ms = round((time.perf_counter() - start) * 1000, 1)
+            for job in ready:
+                job_timings = timings[job.job_id]
+                job_timings["mineru"] = mineru_ms
+                base = pathlib.Path(job.input_path).stem
+                try:
+                    doc_dir = _find_doc_dir(out_dir, base)
+                    result_dir = os.path.join(job.job_dir, "output")
+                    os.makedirs(result_dir, exist_ok=True)
+                    results[job.job_id] = _package_output(
+                        doc_dir, os.path.join(result_dir, f"{base}.zip"), job.meta.get("optimize_images"), job_timings
+                    )
+                except Exception as e:
+                    results[job.job_id] = e
+        return results
+    finally:
+        shutil.rmtree(disk_dir, ignore_errors=True)
+
+
+class Worker:
+    """
+    按容量拉取作业：每个空闲槽位一个线程，只有空闲时才去领取，因此各节点的负载与自身容量成正比。
+
+    :param queue: 作业队列
+    :param capacity: 同时处理的作业数（通常等于本机可用 GPU 数）
+    :param poll_interval: 队列为空时的轮询间隔(秒)
+    :param lease_seconds: 作业租约，worker 失联超过该时间后作业会被其他 worker 重新领取
+    :param batch_max_jobs: 合并为一次 mineru 调用的作业数上限，1 表示不合并
+    :param batch_window: 领取到可合并作业后继续凑批的等待时间(秒)
+    :param batch_max_pages: 参与合并的作业页数上限
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        capacity: int = 1,
+        worker_id: Optional[str] = None,
+        poll_interval: float = 1.0,
+        lease_seconds: int = DEFAULT_LEASE_SECONDS,
+        batch_max_jobs: int = BATCH_MAX_JOBS,
+        batch_window: float = BATCH_WINDOW,
+        batch_max_pages: int = BATCH_MAX_PAGES,
+    ):
+        self.queue = queue
+        self.capacity = max(1, int(capacity))
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.batch_max_jobs = max(1, int(batch_max_jobs))
+        self.batch_window = batch_window
+        self.batch_max_pages = batch_max_pages
+        self._running = {}  # job_id -> CancelToken
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self) -> "Worker":
+        for i in range(self.capacity):
+            t = threading.Thread(target=self._slot_loop, name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        t = threading.Thread(target=self._heartbeat_loop, name="job-worker-heartbeat", daemon=True)
+        t.start()
+        self._threads.append(t)
+        logger.info(f"worker {self.worker_id} 启动，容量 {self.capacity}")
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout)
+
+    def running_jobs(self) -> list:
+        with self._lock:
+            return list(self._running)
+
+    def cancel(self, job_id: str, reason: str) -> bool:
+        """终止本 worker 上正在运行的作业（杀掉其 mineru 进程组），返回是否找到该作业。"""
+        with self._lock:
+            token = self._running.get(job_id)
+        if token is None:
+            return False
+        logger.warning(f"取消作业 {job_id}: {reason}")
+        token.cancel(reason)
+        return True
+
+    def _update_deadlines(self, deadlines: dict) -> None:
+        """相同请求挂到运行中的作业上会延后其截止时间，同步到 CancelToken，避免按领取时的旧截止时间被终止。"""
+        with self._lock:
+            for job_id, deadline in deadlines.items():
+                token = self._running.get(job_id)
+                if token is not None:
+                    token.deadline = deadline
+
+    def _heartbeat_loop(self) -> None:
+        interval = max(1.0, self.lease_seconds / 3)
+        while not self._stop.is_set():
+            try:
+                cancels, deadlines = self.queue.heartbeat(
+                    self.worker_id, self.running_jobs(), self.capacity, self.lease_seconds
+                )
+                self._update_deadlines(deadlines)
+                for job_id, reason in cancels.items():
+                    self.cancel(job_id, reason)
+                requeued = self.queue.requeue_expired()
+                if requeued:
+                    logger.warning(f"{requeued} 个作业租约过期，已重新入队")
+            except Exception as e:
+                logger.error(f"worker 心跳失败: {e}")
+            self._stop.wait(interval)
+
+    def _slot_loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                job = self.queue.claim(self.worker_id, self.lease_seconds)
+            except Exception as e:
+                logger.error(f"领取作业失败: {e}")
+                job = None
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            if not self._batchable(job):
+                self._execute(job)
+                continue
+            batch = self._collect_batch(job)
+            if len(batch) > 1:
+                self._execute_batch(batch)
+            else:
+                self._execute(job)
+
+    def _batchable(self, job) -> bool:
+        return (
+            self.batch_max_jobs > 1
+            and job.processor == "mineru"
+            and (not self.batch_max_pages or (job.pages or 0) <= self.batch_max_pages)
+        )
+
+    def _collect_batch(self, first) -> list:
+        """在凑批窗口内继续领取可与 first 合并的作业。mineru 按文档名建输出目录，同名文档不进同一批。"""
+        batch = [first]
+        deadline = time.time() + self.batch_window
+        while len(batch) < self.batch_max_jobs and not self._stop.is_set():
+            stems = {pathlib.Path(job.input_path).stem for job in batch}
+            taken = tuple(stem + ext for stem in stems for ext in (".pdf", ".docx", ".doc"))
+            try:
+                job = self.queue.claim(self.worker_id, self.lease_seconds, batch_of=first,
+                                       max_pages=self.batch_max_pages, exclude_filenames=taken)
+            except Exception as e:
+                logger.error(f"领取作业失败: {e}")
+                break
+            if job is None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._stop.wait(min(remaining, BATCH_POLL_SECONDS))
+                continue
+            batch.append(job)
+        return batch
+
+    def _execute(self, job) -> None:
+        # 作业日志带上提交请求的关联 ID，便于与 API 日志、客户端输出对照
+        with use_request_id(job.meta.get("request_id") or job.job_id):
+            self._run_tracked(job)
+
+    def _run_tracked(self, job) -> None:
+        token = CancelToken(job.deadline)
+        timings = {}
+        with self._lock:
+            self._running[job.job_id] = token
+        logger.info(f"worker {self.worker_id} 开始作业 {job.job_id}: {job.filename} ({job.processor})")
+        try:
+            with use_token(token):
+                result = run_job(job, self.queue, timings)
+        except Exception as e:
+            result = e
+        finally:
+            with self._lock:
+                self._running.pop(job.job_id, None)
+        self._settle(job, token, result, timings)
+
+    def _execute_batch(self, jobs: List) -> None:
+        tokens = {job.job_id: CancelToken(job.deadline) for job in jobs}
+        with self._lock:
+            self._running.update(tokens)
+        # 批次日志带上全部成员的关联 ID，按任一 ID 检索都能找到
+        request_ids = ",".join(job.meta.get("request_id") or job.job_id for job in jobs)
+        timings = {}
+        with use_request_id(request_ids):
+            logger.info(
+                f"worker {self.worker_id} 合并执行 {len(jobs)} 个作业: "
+                + ", ".join(f"{job.job_id} ({job.filename})" for job in jobs)
+            )
+            started = time.time()
+            try:
+                with use_token(BatchToken(list(tokens.values()))):
+                    results = run_batch(jobs, self.queue, timings)
+            except JobCancelled as e:
+                results = {job.job_id: e for job in jobs}
+            except Exception as e:
+                detail = getattr(e, "detail", None) or f"{type(e).__name__}: {e}"
+                logger.warning(f"合并批次失败，逐个重试: {detail}")
+                results = None
+            finally:
+                with self._lock:
+                    for job_id in tokens:
+                        self._running.pop(job_id, None)
+        # 批次耗时按 work_units 分摊给各成员，耗时模型（SJF 排序、ETA）看到的是单个作业的份额
+        elapsed = time.time() - started
+        total_units = sum(job.work_units or 0 for job in jobs)
+        for job in jobs:
+            token = tokens[job.job_id]
+            if results is None and not token.cancelled:
+                self._execute(job)
+                continue
+            result = results.get(job.job_id) if results is not None else JobCancelled(token.reason)
+            share = elapsed * (job.work_units or 0) / total_units if total_units else elapsed / len(jobs)
+            with use_request_id(job.meta.get("request_id") or job.job_id):
+                self._settle(job, token, result, timings.get(job.job_id, {}), run_seconds=share)
+
+    def _settle(self, job, token: CancelToken, result, timings: dict, run_seconds: Optional[float] = None) -> None:
+        """按结果（ZIP 路径或异常）与取消信号写回作业状态。"""
+        if token.cancelled or isinstance(result, JobCancelled):
+            reason = token.reason or getattr(result, "reason", "") or "已取消"
+            logger.warning(f"作业 {job.job_id} 已终止: {reason}")
+            if self.queue.mark_cancelled(job.job_id, reason, worker_id=self.worker_id):
+                # 无人领取结果，释放工作目录（含输入）
+                shutil.rmtree(job.job_dir, ignore_errors=True)
+                return
+        elif isinstance(result, Exception):
+            detail = getattr(result, "detail", None) or f"{type(result).__name__}: {result}"
+            logger.error(f"作业 {job.job_id} 失败: {detail}")
+            if self.queue.fail(job.job_id, str(detail), worker_id=self.worker_id):
+                return
+        else:
+            if self.queue.complete(job.job_id, result, timings, worker_id=self.worker_id, run_seconds=run_seconds):
+                logger.info(f"作业 {job.job_id} 完成: {result} {timings}")
+                return
+        # 租约已过期并被回收（作业已重新入队或由其他 worker 处理），不覆盖新状态，也不动工作目录
+        logger.warning(f"作业 {job.job_id} 已不归 worker {self.worker_id} 所有，丢弃本次结果")
+
+
+def _parse_args(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="从共享作业队列拉取并处理文档")
+    parser.add_argument("--capacity", type=int, default=1, help="同时处理的作业数")
+    parser.add_argument("--queue", default=None, help="作业队列 URL，默认读 JOB_QUEUE_URL 或共享目录下的 jobs.sqlite3")
+    parser.add_argument("--poll", type=float, default=1.0, help="队列为空时的轮询间隔(秒)")
+    parser.add_argument("--batch-max-jobs", type=int, default=BATCH_MAX_JOBS, help="合并为一次 mineru 调用的作业数上限，1 表示不合并")
+    parser.add_argument("--batch-window", type=float, default=BATCH_WINDOW, help="凑批等待时间(秒)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = _parse_args(argv or sys.argv[1:])
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)s] %(levelname)s [%(request_id)s] - %(message)s")
+    install_log_filter()
+    queue = open_job_queue(args.queue, root=SHARED_ROOT)
+    worker = Worker(
+        queue, capacity=args.capacity, poll_interval=args.poll,
+        batch_max_jobs=args.batch_max_jobs, batch_window=args.batch_window,
+    ).start()
+    print(f"worker {worker.worker_id} 已启动（容量 {worker.capacity}，共享目录 {SHARED_ROOT}）")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        worker.stop(timeout=5)
+        shutdown_pool()
+        queue.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
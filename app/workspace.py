@@ -0,0 +1,164 @@
+"""
+作业工作区：小文档放在 tmpfs（默认 /dev/shm）上处理，避免上传、转换后的 PDF、mineru 中间文件与 ZIP
+这些大量小文件在普通磁盘上反复 fsync；处理完成后只把结果 ZIP 移回共享存储。
+
+RAM 预算按主机全局计：各进程在 tmpfs 根目录下登记预留（文件锁保护），预算不足、文件超过阈值或
+tmpfs 不可用时退回磁盘工作区（共享存储上的作业目录）。
+
+环境变量：
+    FASTAPI_RAM_WORKSPACE_ROOT       tmpfs 工作区根目录，默认 /dev/shm/mineru_jobs；设为空禁用
+    FASTAPI_RAM_WORKSPACE_BUDGET     全部 RAM 工作区的预留上限(字节)，默认 2 GiB；0 禁用
+    FASTAPI_RAM_WORKSPACE_MAX_BYTES  输入文件不超过该字节数才使用 RAM，默认 8 MiB
+    FASTAPI_RAM_WORKSPACE_FACTOR     预留量 = 输入字节数 × 该倍数 + 固定开销（mineru 输出远大于输入），默认 30
+"""
+import os
+import json
+import fcntl
+import shutil
+import logging
+from contextlib import contextmanager
+from typing import Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+RAM = "ram"
+DISK = "disk"
+
+RAM_ROOT = os.environ.get("FASTAPI_RAM_WORKSPACE_ROOT", "/dev/shm/mineru_jobs")
+RAM_BUDGET = int(os.environ.get("FASTAPI_RAM_WORKSPACE_BUDGET", str(2 * 1024 ** 3)))
+RAM_MAX_INPUT = int(os.environ.get("FASTAPI_RAM_WORKSPACE_MAX_BYTES", str(8 * 1024 ** 2)))
+RAM_FACTOR = float(os.environ.get("FASTAPI_RAM_WORKSPACE_FACTOR", "30"))
+# 每个作业的固定预留：转换后的 PDF、mineru 的 JSON 与临时文件
+RAM_OVERHEAD = 32 * 1024 ** 2
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class RamWorkspaces:
+    """
+    tmpfs 上的作业工作区与全局预算。
+
+    预留记录在 <root>/.reservations/<job_id>.json（{"pid", "bytes"}），进程异常退出留下的记录在下次
+    分配时按 pid 清理。
+
+    :param root: tmpfs 上的根目录
+    :param budget: 预留上限(字节)
+    :param max_input: 输入文件字节数上限
+    :param factor: 预留倍数
+    """
+
+    def __init__(self, root: str = RAM_ROOT, budget: int = RAM_BUDGET, max_input: int = RAM_MAX_INPUT,
+                 factor: float = RAM_FACTOR):
+        self.root = root
+        self.budget = budget
+        self.max_input = max_input
+        self.factor = factor
+        self.enabled = bool(root) and budget > 0 and os.path.isdir(os.path.dirname(root.rstrip("/")) or "/")
+        self._res_dir = os.path.join(root, ".reservations") if root else ""
+        if self.enabled:
+            try:
+                os.makedirs(self._res_dir, exist_ok=True)
+            except OSError as e:
+                logger.warning(f"RAM 工作区不可用，全部使用磁盘: {e}")
+                self.enabled = False
+
+    def reservation_for(self, input_bytes: int) -> int:
+        return int(input_bytes * self.factor) + RAM_OVERHEAD
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        with open(os.path.join(self._res_dir, ".lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _reserved(self) -> int:
+        """已预留字节数；顺带清理已退出进程留下的预留与工作区。调用方需持有锁。"""
+        total = 0
+        for fn in os.listdir(self._res_dir):
+            if not fn.endswith(".json"):
+                continue
+            path = os.path.join(self._res_dir, fn)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    rec = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if not _pid_alive(int(rec.get("pid", 0))):
+                job_id = fn[:-5]
+                logger.warning(f"清理失效的 RAM 工作区预留 {job_id}（pid {rec.get('pid')}）")
+                shutil.rmtree(os.path.join(self.root, job_id), ignore_errors=True)
+                os.remove(path)
+                continue
+            total += int(rec.get("bytes", 0))
+        return total
+
+    def acquire(self, job_id: str, input_bytes: int) -> Optional[str]:
+        """
+        为作业预留 RAM 工作区，返回工作目录；不满足条件（超过阈值、预算或 tmpfs 剩余空间不足）时返回 None。
+        """
+        if not self.enabled or input_bytes > self.max_input:
+            return None
+        need = self.reservation_for(input_bytes)
+        with self._locked():
+            if self._reserved() + need > self.budget:
+                return None
+            if shutil.disk_usage(self.root).free < need:
+                return None
+            with open(os.path.join(self._res_dir, f"{job_id}.json"), "w", encoding="utf-8") as f:
+                json.dump({"pid": os.getpid(), "bytes": need}, f)
+        work_dir = os.path.join(self.root, job_id)
+        os.makedirs(work_dir, exist_ok=True)
+        return work_dir
+
+    def release(self, job_id: str) -> None:
+        shutil.rmtree(os.path.join(self.root, job_id), ignore_errors=True)
+        with self._locked():
+            try:
+                os.remove(os.path.join(self._res_dir, f"{job_id}.json"))
+            except FileNotFoundError:
+                pass
+
+    def usage(self) -> dict:
+        if not self.enabled:
+            return {"enabled": False}
+        with self._locked():
+            reserved = self._reserved()
+        return {"enabled": True, "root": self.root, "budget": self.budget, "reserved": reserved}
+
+
+_ram = None
+
+
+def ram_workspaces() -> RamWorkspaces:
+    global _ram
+    if _ram is None:
+        _ram = RamWorkspaces()
+    return _ram
+
+
+@contextmanager
+def job_workspace(job_id: str, disk_dir: str, input_bytes: int) -> Iterator[Tuple[str, str]]:
+    """
+    选择作业工作区，产出 (工作目录, 后端 ram|disk)。RAM 工作区在退出时删除并释放预算；
+    磁盘工作区即共享存储上的作业目录，由调用方管理。
+    """
+    ram = ram_workspaces()
+    work_dir = ram.acquire(job_id, input_bytes)
+    if work_dir is None:
+        yield disk_dir, DISK
+        return
+    try:
+        yield work_dir, RAM
+    finally:
+        ram.release(job_id)
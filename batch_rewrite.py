@@ -0,0 +1,201 @@
+"""
+按清单批量重写 MD 中的相对图片链接（独立命令行工具，例如图片服务地址变更后整体重新指向）。
+
+流水线的 rewrite 阶段逐文档调用 download_minueru.zip_to_rewritten_md，不经过这里。
+"""
+import os
+import sys
+import json
+import hashlib
+import time
+from typing import Optional, List, Dict
+from concurrent.futures import ProcessPoolExecutor
+
+from download_minueru import (
+    rewrite_md_text_images_to_http,
+    _with_img_path,
+    _atomic_write_text,
+)
+
+DEFAULT_BASE_HOST = "http://10.18.11.98:8081"
+DEFAULT_WORKSPACE_ROOT = "/home/amlogic"
+STATE_FILENAME = ".rewrite_state.json"
+
+
+def read_manifest(manifest_path: str) -> List[str]:
+    """读取 MD 路径清单（每行一个路径，兼容 succ_from_mineru_pdfs_*.txt），忽略空行与 # 注释并去重保序。"""
+    paths = []
+    seen = set()
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        for line in f:
+            p = line.strip()
+            if not p or p.startswith("#"):
+                continue
+            p = os.path.abspath(p)
+            if p in seen:
+                continue
+            seen.add(p)
+            paths.append(p)
+    return paths
+
+
+def _load_state(state_path: str) -> Dict[str, dict]:
+    if not os.path.isfile(state_path):
+        return {}
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"状态文件损坏，忽略并全量重写: {state_path} ({e})", file=sys.stderr)
+        return {}
+
+
+def _save_state(state_path: str, state: Dict[str, dict]) -> None:
+    _atomic_write_text(state_path, json.dumps(state, ensure_ascii=False, indent=1))
+
+
+def _rewrite_one(job) -> dict:
+    """
+    进程池任务：重写单个 MD。base_host/workspace_root 未变化且源文件未变时跳过。
+
+    先比较 mtime 与大小，一致时不读文件；不一致时再按内容 hash 判断（touch 过但内容没变的文件仍跳过）。
+    """
+    md_path, base_host, workspace_root, prev = job
+    start = time.time()
+    report = {"md_path": md_path, "status": "", "count": 0, "out_path": "", "sha256": "", "error": "",
+              "mtime_ns": 0, "size": 0}
+    try:
+        st = os.stat(md_path)
+        report.update(mtime_ns=st.st_mtime_ns, size=st.st_size)
+        reusable = bool(
+            prev
+            and prev.get("base_host") == base_host
+            and prev.get("workspace_root") == workspace_root
+            and prev.get("out_path")
+            and os.path.isfile(prev["out_path"])
+        )
+        if reusable and prev.get("mtime_ns") == st.st_mtime_ns and prev.get("size") == st.st_size:
+            report.update(status="skipped", count=prev.get("count", 0), out_path=prev["out_path"],
+                          sha256=prev.get("sha256", ""))
+            return report
+
+        with open(md_path, "rb") as f:
+            raw = f.read()
+        digest = hashlib.sha256(raw).hexdigest()
+        report["sha256"] = digest
+        if reusable and prev.get("sha256") == digest:
+            report.update(status="skipped", count=prev.get("count", 0), out_path=prev["out_path"])
+            return report
+
+        content = raw.decode("utf-8")
+        new_content, count = rewrite_md_text_images_to_http(
+            content, os.path.dirname(md_path), base_host, workspace_root
+        )
+        out_path = md_path
+        stale = _with_img_path(md_path)
+        if count > 0:
+            out_path = stale
+            _atomic_write_text(out_path, new_content)
+        elif os.path.isfile(stale):
+            # 这一轮已没有需要重写的链接：删掉上一轮留下的 _with_img.md，免得下游读到过期内容
+            os.remove(stale)
+        report.update(status="rewritten", count=count, out_path=out_path)
+    except Exception as e:
+        report.update(status="error", error=f"{type(e).__name__}: {e}")
+    finally:
+        report["elapsed"] = round(time.time() - start, 4)
+    return report
+
+
+def batch_rewrite_md_images(
+    md_paths: List[str],
+    base_host: str = DEFAULT_BASE_HOST,
+    workspace_root: str = DEFAULT_WORKSPACE_ROOT,
+    state_path: Optional[str] = None,
+    workers: Optional[int] = None,
+    force: bool = False,
+) -> List[dict]:
+    """
+    批量重写 MD 图片链接（进程池并行、增量、原子写出）。
+
+    :param md_paths: 待处理的 MD 绝对路径列表
+    :param state_path: 增量状态文件，记录上一轮每个文件的 mtime/大小/源 hash 与 base_host/workspace_root
+    :param workers: 进程数，默认 os.cpu_count()
+    :param force: 忽略状态文件，全部重写
+    :return: 每个文件一条报告，字段 md_path/status(rewritten|skipped|error)/count/out_path/sha256/mtime_ns/size/error/elapsed
+    """
+    state = {} if (force or not state_path) else _load_state(state_path)
+    jobs = [(p, base_host, workspace_root, state.get(p)) for p in md_paths]
+    if not jobs:
+        return []
+
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(jobs) == 1:
+        reports = [_rewrite_one(j) for j in jobs]
+    else:
+        chunksize = max(1, len(jobs) // (workers * 8))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            reports = list(pool.map(_rewrite_one, jobs, chunksize=chunksize))
+
+    if state_path:
+        for r in reports:
+            if r["status"] in ("rewritten", "skipped"):
+                state[r["md_path"]] = {
+                    "sha256": r["sha256"],
+                    "mtime_ns": r["mtime_ns"],
+                    "size": r["size"],
+                    "base_host": base_host,
+                    "workspace_root": workspace_root,
+                    "out_path": r["out_path"],
+                    "count": r["count"],
+                }
+        _save_state(state_path, state)
+    return reports
+
+
+def _parse_args(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="按清单批量重写 MD 中的相对图片链接为 HTTP 链接")
+    parser.add_argument("--manifest", required=True, help="MD 路径清单文件（每行一个路径）")
+    parser.add_argument("--base-host", default=DEFAULT_BASE_HOST, help="图片服务地址")
+    parser.add_argument("--workspace-root", default=DEFAULT_WORKSPACE_ROOT, help="图片服务对应的本地根目录")
+    parser.add_argument("--state", default=None, help=f"增量状态文件，默认与清单同目录的 {STATE_FILENAME}")
+    parser.add_argument("--workers", type=int, default=None, help="并行进程数，默认 CPU 核数")
+    parser.add_argument("--force", action="store_true", help="忽略增量状态，全部重写")
+    parser.add_argument("--report", default=None, help="可选：逐文件报告输出路径（JSONL）")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = _parse_args(argv or sys.argv[1:])
+    state_path = args.state or os.path.join(os.path.dirname(os.path.abspath(args.manifest)), STATE_FILENAME)
+    md_paths = read_manifest(args.manifest)
+    start = time.time()
+    reports = batch_rewrite_md_images(
+        md_paths,
+        base_host=args.base_host,
+        workspace_root=args.workspace_root,
+        state_path=state_path,
+        workers=args.workers,
+        force=args.force,
+    )
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            for r in reports:
+                f.write(json.dumps(r, ensure_ascii=False) + "\n")
+
+    stats = {"rewritten": 0, "skipped": 0, "error": 0}
+    for r in reports:
+        stats[r["status"]] = stats.get(r["status"], 0) + 1
+        if r["status"] == "error":
+            print(f"重写失败: {r['md_path']}: {r['error']}", file=sys.stderr)
+    print(
+        f"批量重写完成，共 {len(reports)} 个文件：重写 {stats['rewritten']}，跳过 {stats['skipped']}，"
+        f"失败 {stats['error']}，耗时 {time.time() - start:.2f} 秒"
+    )
+    return 1 if stats["error"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+假 libreoffice 命令行，用于压测 doc/docx 上传路径，只支持服务端用到的调用方式：
+
+    libreoffice --headless --convert-to pdf --outdir <dir> <src>
+
+生成 <dir>/<stem>.pdf（带文字层的合成 PDF）。通过环境变量控制耗时与输出大小：
+    FAKE_LIBREOFFICE_SECONDS    固定耗时（秒），默认 2.0（真实 soffice 冷启动约 2~5 秒）
+    FAKE_LIBREOFFICE_PAGES      输出 PDF 页数，默认 0 表示按 docx 正文大小折算
+    FAKE_LIBREOFFICE_FAIL_RATE  随机失败概率，默认 0
+"""
+import os
+import sys
+import time
+import random
+import hashlib
+import zipfile
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.stubs import make_pdf  # noqa: E402
+
+# 与 app.preflight 的 docx 页数估计一致
+DOCX_BYTES_PER_PAGE = 12000
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _estimate_pages(src: str) -> int:
+    try:
+        with zipfile.ZipFile(src) as zf:
+            return max(1, zf.getinfo("word/document.xml").file_size // DOCX_BYTES_PER_PAGE)
+    except (OSError, zipfile.BadZipFile, KeyError):
+        return max(1, os.path.getsize(src) // (DOCX_BYTES_PER_PAGE * 4))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="fake libreoffice")
+    parser.add_argument("--headless", action="store_true")
+    parser.add_argument("--convert-to", dest="convert_to", required=True)
+    parser.add_argument("--outdir", required=True)
+    parser.add_argument("src")
+    args, _ = parser.parse_known_args(argv)
+
+    if args.convert_to.split(":", 1)[0] != "pdf":
+        print(f"fake libreoffice: unsupported target {args.convert_to}", file=sys.stderr)
+        return 2
+    if not os.path.isfile(args.src):
+        print(f"fake libreoffice: source not found: {args.src}", file=sys.stderr)
+        return 2
+    seed = hashlib.sha256(args.src.encode()).digest()
+    rnd = random.Random(seed)
+    if rnd.random() < _env_float("FAKE_LIBREOFFICE_FAIL_RATE", 0.0):
+        print("fake libreoffice: synthetic failure", file=sys.stderr)
+        return 1
+
+    pages = int(_env_float("FAKE_LIBREOFFICE_PAGES", 0)) or _estimate_pages(args.src)
+    time.sleep(_env_float("FAKE_LIBREOFFICE_SECONDS", 2.0))
+    stem = os.path.splitext(os.path.basename(args.src))[0]
+    os.makedirs(args.outdir, exist_ok=True)
+    with open(os.path.join(args.outdir, f"{stem}.pdf"), "wb") as f:
+        f.write(make_pdf(stem, pages=pages, seed=int.from_bytes(seed[:4], "big")))
+    print(f"convert {args.src} -> {args.outdir}/{stem}.pdf using filter : writer_pdf_Export")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+假 mineru 命令行，用于基准测试与压测，输出目录结构与真实 mineru vlm 后端一致：
+
+    <out>/<stem>/vlm/<stem>.md
+    <out>/<stem>/vlm/images/<sha256>.jpg
+    <out>/<stem>/vlm/<stem>_middle.json / _model.json / _content_list.json / _layout.pdf / _origin.pdf
+
+通过环境变量控制耗时与输出大小：
+    FAKE_MINERU_SECONDS         固定耗时（秒），默认 1.0
+    FAKE_MINERU_SECONDS_PER_PAGE 每页额外耗时（秒），默认 0.2
+    FAKE_MINERU_IMAGES_PER_PAGE 每页图片数，默认 2
+    FAKE_MINERU_IMAGE_KB        每张图片大小（KB），默认 120
+    FAKE_MINERU_JSON_KB         middle/model JSON 各自大小（KB），默认 512
+    FAKE_MINERU_FAIL_RATE       随机失败概率，默认 0
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import shutil
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _count_pages(pdf_path: str) -> int:
+    try:
+        with open(pdf_path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return 1
+    return max(1, len(re.findall(rb"/Type\s*/Page(?!s)", data)))
+
+
+def _process_one(pdf_path: str, out_dir: str, backend: str, rnd: random.Random) -> int:
+    stem = os.path.splitext(os.path.basename(pdf_path))[0]
+    sub = "vlm" if backend.startswith("vlm") else "auto"
+    doc_dir = os.path.join(out_dir, stem, sub)
+    img_dir = os.path.join(doc_dir, "images")
+    os.makedirs(img_dir, exist_ok=True)
+
+    pages = _count_pages(pdf_path)
+    images_per_page = int(_env_float("FAKE_MINERU_IMAGES_PER_PAGE", 2))
+    image_kb = int(_env_float("FAKE_MINERU_IMAGE_KB", 120))
+    json_kb = int(_env_float("FAKE_MINERU_JSON_KB", 512))
+
+    md_lines = [f"# {stem}", ""]
+    content_list = []
+    for p in range(pages):
+        md_lines += [f"## Section {p + 1}", "", f"Debug procedure for page {p + 1}. " * 8, ""]
+        content_list.append({"type": "text", "text": f"Section {p + 1}", "text_level": 2, "page_idx": p})
+        for i in range(images_per_page):
+            blob = rnd.randbytes(image_kb * 1024) if hasattr(rnd, "randbytes") else os.urandom(image_kb * 1024)
+            name = hashlib.sha256(blob).hexdigest() + ".jpg"
+            with open(os.path.join(img_dir, name), "wb") as f:
+                f.write(blob)
+            md_lines += [f"![](images/{name})", ""]
+            content_list.append({"type": "image", "img_path": f"images/{name}", "page_idx": p})
+        md_lines += ["| register | value |", "|---|---|", "| 0x1 | debug |", ""]
+
+    with open(os.path.join(doc_dir, f"{stem}.md"), "w", encoding="utf-8") as f:
+        f.write("\n".join(md_lines))
+    with open(os.path.join(doc_dir, f"{stem}_content_list.json"), "w", encoding="utf-8") as f:
+        json.dump(content_list, f)
+    filler = "x" * 1024
+    for suffix in ("_middle.json", "_model.json"):
+        with open(os.path.join(doc_dir, f"{stem}{suffix}"), "w", encoding="utf-8") as f:
+            json.dump({"pdf_info": [filler] * json_kb}, f)
+    shutil.copyfile(pdf_path, os.path.join(doc_dir, f"{stem}_layout.pdf"))
+    shutil.copyfile(pdf_path, os.path.join(doc_dir, f"{stem}_origin.pdf"))
+    return pages
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="fake mineru")
+    parser.add_argument("-p", "--path", required=True)
+    parser.add_argument("-o", "--output", required=True)
+    parser.add_argument("-b", "--backend", default="vlm-transformers")
+    args, _ = parser.parse_known_args(argv)
+
+    rnd = random.Random(hashlib.sha256(args.path.encode()).digest())
+    if rnd.random() < _env_float("FAKE_MINERU_FAIL_RATE", 0.0):
+        print("fake mineru: synthetic failure", file=sys.stderr)
+        return 1
+
+    if os.path.isdir(args.path):
+        inputs = sorted(
+            os.path.join(args.path, n) for n in os.listdir(args.path) if n.lower().endswith(".pdf")
+        )
+    else:
+        inputs = [args.path]
+    if not inputs or not all(os.path.isfile(p) for p in inputs):
+        print(f"fake mineru: input not found: {args.path}", file=sys.stderr)
+        return 2
+
+    total_pages = sum(_count_pages(p) for p in inputs)
+    # 目录输入模拟批处理：固定开销只付一次
+    time.sleep(_env_float("FAKE_MINERU_SECONDS", 1.0) + _env_float("FAKE_MINERU_SECONDS_PER_PAGE", 0.2) * total_pages)
+    for p in inputs:
+        _process_one(p, args.output, args.backend, rnd)
+    print(f"fake mineru: {len(inputs)} file(s), {total_pages} page(s) -> {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,247 @@
+"""
+端到端流水线基准测试：本地假 Confluence + 假 mineru（经由真实 app.main 服务）+ 假 n8n webhook，
+驱动 main_client 流水线模式（download_minueru / process_client 全链路），输出吞吐、各阶段 p50/p99、
+峰值 RSS 与传输字节数，并可保存/对比基线 JSON。
+
+示例（在仓库根目录）：
+    python -m bench.pipeline_bench --docs 30 --save-baseline bench/baseline_pipeline.json
+    python -m bench.pipeline_bench --docs 30 --baseline bench/baseline_pipeline.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import tempfile
+import resource
+from datetime import datetime
+
+from bench.stubs import AppServer, FakeConfluence, FakeWebhook, REPO_ROOT
+
+# 对比基线时：吞吐下降 / 延迟与内存上升超过该比例视为回退
+DEFAULT_TOLERANCE = 0.2
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def _dir_bytes(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for fn in files:
+            try:
+                total += os.path.getsize(os.path.join(root, fn))
+            except OSError:
+                pass
+    return total
+
+
+def _stage_stats(ledger_path: str) -> dict:
+    conn = sqlite3.connect(ledger_path)
+    try:
+        rows = conn.execute("SELECT stage, status, elapsed, output_path FROM stage_runs").fetchall()
+    finally:
+        conn.close()
+    by_stage = {}
+    for stage, status, elapsed, _ in rows:
+        st = by_stage.setdefault(stage, {"done": 0, "failed": 0, "elapsed": []})
+        st["done" if status == "done" else "failed"] += 1
+        if status == "done" and elapsed is not None:
+            st["elapsed"].append(elapsed)
+    out = {}
+    for stage, st in by_stage.items():
+        out[stage] = {
+            "done": st["done"],
+            "failed": st["failed"],
+            "p50": round(percentile(st["elapsed"], 0.50), 4),
+            "p99": round(percentile(st["elapsed"], 0.99), 4),
+        }
+    return out
+
+
+def run_benchmark(args) -> dict:
+    workdir = args.workdir or tempfile.mkdtemp(prefix="pipeline_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    docs_dir = os.path.join(workdir, "docs") + os.sep
+    os.makedirs(docs_dir, exist_ok=True)
+
+    server_env = {
+        "FAKE_MINERU_SECONDS": str(args.mineru_seconds),
+        "FAKE_MINERU_SECONDS_PER_PAGE": str(args.mineru_seconds_per_page),
+        "FAKE_MINERU_IMAGE_KB": str(args.image_kb),
+        "FAKE_MINERU_JSON_KB": str(args.json_kb),
+    }
+    confluence = FakeConfluence.synthetic(
+        args.docs, max_pages=args.max_pages, export_latency=args.export_latency, seed=args.seed
+    ).start()
+    webhook = FakeWebhook(latency=args.webhook_latency, fail_rate=args.webhook_fail_rate, seed=args.seed).start()
+    server = AppServer(workdir, env=server_env, workers=args.server_workers)
+    try:
+        server.start()
+        # main_client 及其依赖在导入时读取 CONFLUENCE_BASE_URL，必须先设置
+        os.environ["CONFLUENCE_BASE_URL"] = confluence.base_url
+        sys.path.insert(0, REPO_ROOT)
+        import main_client
+
+        urls = confluence.page_urls()
+        # 混入重复输入，覆盖去重路径
+        urls += urls[: max(1, len(urls) // 10)]
+        ledger_path = os.path.join(workdir, "job_ledger.sqlite3")
+        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+        run_dir = os.path.join(workdir, ts)
+        input_path = os.path.join(workdir, "inputs.txt")
+        with open(input_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(urls) + "\n")
+        cli = [
+            "--input", input_path,
+            "--run-dir", run_dir,
+            "--trace", os.path.join(run_dir, "trace.jsonl"),
+            "--server", f"{server.base_url}/process/zip",
+            "--pdf", docs_dir,
+            "--webhook", f"{webhook.base_url}/webhook/bench",
+            "--webhook-timeout", "60",
+            "--webhook-retry-queue", os.path.join(workdir, "webhook_retry_queue.jsonl"),
+            "--ledger", ledger_path,
+            "--export-workers", str(args.export_workers),
+            "--mineru-workers", str(args.mineru_workers),
+            "--webhook-workers", str(args.webhook_workers),
+        ]
+
+        start = time.time()
+        main_client.main(cli)
+        wall = time.time() - start
+
+        stages = _stage_stats(ledger_path)
+        conn = sqlite3.connect(ledger_path)
+        try:
+            pdf_bytes, zip_bytes = 0, 0
+            for stage, path in conn.execute("SELECT stage, output_path FROM stage_runs WHERE status='done'"):
+                if path and os.path.isfile(path):
+                    if stage == "exported":
+                        pdf_bytes += os.path.getsize(path)
+                    elif stage == "processed":
+                        zip_bytes += os.path.getsize(path)
+            finished = conn.execute(
+                "SELECT COUNT(DISTINCT doc_id) FROM stage_runs WHERE stage=? AND status='done'",
+                ("sent",),
+            ).fetchone()[0]
+        finally:
+            conn.close()
+
+        result = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "params": {k: v for k, v in vars(args).items() if k not in ("baseline", "save_baseline", "workdir", "keep")},
+            "inputs": len(urls),
+            "documents_done": finished,
+            "wall_seconds": round(wall, 3),
+            "docs_per_minute": round(finished / wall * 60, 3) if wall > 0 else 0.0,
+            "stages": stages,
+            "peak_rss_kb": {
+                "client": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                "server": server.peak_rss_kb(),
+            },
+            "bytes": {
+                "confluence_export": confluence.counters.as_dict()["bytes_out"],
+                "upload_pdf": pdf_bytes,
+                "download_zip": zip_bytes,
+                "webhook_payload": webhook.counters.as_dict()["bytes_in"],
+                "client_disk": _dir_bytes(docs_dir),
+                "server_disk": _dir_bytes(server.env["FASTAPI_WORK_ROOT"]),
+            },
+        }
+    finally:
+        server.stop()
+        confluence.stop()
+        webhook.stop()
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+def compare_to_baseline(result: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE) -> list:
+    """返回回退项描述列表；为空表示未回退。"""
+    regressions = []
+    if result["docs_per_minute"] < baseline["docs_per_minute"] * (1 - tolerance):
+        regressions.append(f"吞吐 {result['docs_per_minute']} < 基线 {baseline['docs_per_minute']}")
+    for stage, st in baseline.get("stages", {}).items():
+        cur = result["stages"].get(stage)
+        if not cur:
+            continue
+        for q in ("p50", "p99"):
+            if st[q] > 0 and cur[q] > st[q] * (1 + tolerance):
+                regressions.append(f"{stage} {q} {cur[q]}s > 基线 {st[q]}s")
+    for side in ("client", "server"):
+        b = baseline.get("peak_rss_kb", {}).get(side, 0)
+        c = result["peak_rss_kb"].get(side, 0)
+        if b and c > b * (1 + tolerance):
+            regressions.append(f"{side} 峰值 RSS {c}KB > 基线 {b}KB")
+    return regressions
+
+
+def _print_result(result: dict) -> None:
+    print(f"文档 {result['documents_done']}/{result['inputs']} 输入，耗时 {result['wall_seconds']}s，"
+          f"吞吐 {result['docs_per_minute']} 文档/分钟")
+    print(f"{'stage':<12}{'done':>6}{'failed':>8}{'p50(s)':>10}{'p99(s)':>10}")
+    for stage, st in result["stages"].items():
+        print(f"{stage:<12}{st['done']:>6}{st['failed']:>8}{st['p50']:>10}{st['p99']:>10}")
+    print(f"峰值 RSS(KB): {result['peak_rss_kb']}")
+    print(f"字节数: {result['bytes']}")
+
+
+def _parse_args(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="URL → PDF → MinerU → MD → webhook 端到端基准测试（本地桩服务）")
+    parser.add_argument("--docs", type=int, default=20, help="合成页面数量")
+    parser.add_argument("--max-pages", type=int, default=8, help="每个页面最多 PDF 页数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--export-latency", type=float, default=0.3, help="假 Confluence 导出 PDF 延迟(秒)")
+    parser.add_argument("--mineru-seconds", type=float, default=1.0, help="假 mineru 固定耗时(秒)")
+    parser.add_argument("--mineru-seconds-per-page", type=float, default=0.1, help="假 mineru 每页耗时(秒)")
+    parser.add_argument("--image-kb", type=int, default=64, help="假 mineru 每张图片大小(KB)")
+    parser.add_argument("--json-kb", type=int, default=256, help="假 mineru middle/model JSON 大小(KB)")
+    parser.add_argument("--webhook-latency", type=float, default=0.5, help="假 webhook 处理延迟(秒)")
+    parser.add_argument("--webhook-fail-rate", type=float, default=0.0, help="假 webhook 随机 503 概率")
+    parser.add_argument("--server-workers", type=int, default=1, help="uvicorn worker 数")
+    parser.add_argument("--export-workers", type=int, default=2)
+    parser.add_argument("--mineru-workers", type=int, default=1)
+    parser.add_argument("--webhook-workers", type=int, default=2)
+    parser.add_argument("--workdir", default=None, help="工作目录（默认临时目录，结束后删除）")
+    parser.add_argument("--keep", action="store_true", help="保留临时工作目录")
+    parser.add_argument("--save-baseline", default=None, help="把结果保存为基线 JSON")
+    parser.add_argument("--baseline", default=None, help="与基线 JSON 对比，回退时返回非 0")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="基线对比容差比例")
+    parser.add_argument("--json", default=None, help="可选：结果 JSON 输出路径")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = _parse_args(argv or sys.argv[1:])
+    result = run_benchmark(args)
+    _print_result(result)
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False, indent=1)
+            print(f"结果已保存: {path}")
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(result, baseline, args.tolerance)
+        if regressions:
+            print("相对基线出现回退:\n  " + "\n  ".join(regressions), file=sys.stderr)
+            return 1
+        print("未发现相对基线的回退")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
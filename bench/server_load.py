@@ -0,0 +1,327 @@
+"""
+服务端压测：本地启动 app.main:app（假 mineru / 假 libreoffice 在 PATH 最前面），按目标速率发送 PDF 与 docx
+混合上传，记录吞吐、延迟分位数、错误率，以及服务进程树的内存与打开的文件描述符数，用于确定部署规模并防止请求路径回退。
+
+到达过程是开环的：请求按计划时间发出，延迟从计划时间算起，因此客户端排队（服务端变慢导致在途请求堆积）
+也计入延迟，不会因为“等上一个请求返回再发下一个”而低估尾延迟。
+
+示例（在仓库根目录）：
+    python -m bench.server_load --rate 2 --duration 60 --docx-ratio 0.3
+    python -m bench.server_load --rates 0.5,1,2,4 --duration 30 --embedded-workers 2
+    python -m bench.server_load --rate 2 --duration 60 --save-baseline bench/baseline_server.json
+    python -m bench.server_load --rate 2 --duration 60 --baseline bench/baseline_server.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from bench.pipeline_bench import percentile
+from bench.stubs import AppServer, make_docx, make_pdf
+
+try:
+    import requests
+except ImportError:
+    print("缺少依赖: 请先安装 requests —— pip install requests", file=sys.stderr)
+    raise
+
+# 对比基线时：吞吐下降 / 延迟、内存与 fd 上升超过该比例视为回退
+DEFAULT_TOLERANCE = 0.2
+SAMPLE_INTERVAL = 0.5
+
+
+class _Sampler:
+    """后台定期采样服务进程树的 RSS 与打开的 fd 数。"""
+
+    def __init__(self, server: AppServer, interval: float = SAMPLE_INTERVAL):
+        self.server = server
+        self.interval = interval
+        self.samples = []  # (t, rss_kb, fds)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def _loop(self) -> None:
+        start = time.time()
+        while not self._stop.is_set():
+            self.samples.append((round(time.time() - start, 2), self.server.rss_kb(), self.server.open_fds()))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self) -> dict:
+        rss = [s[1] for s in self.samples] or [0]
+        fds = [s[2] for s in self.samples] or [0]
+        return {
+            "rss_kb": {"start": rss[0], "max": max(rss), "end": rss[-1]},
+            "open_fds": {"start": fds[0], "max": max(fds), "end": fds[-1]},
+        }
+
+
+class _Corpus:
+    """
+    按请求序号生成上传内容：每个请求默认内容不同（避免服务端按内容去重掩盖真实负载），
+    duplicate_rate 控制重复上传已发送内容的比例。
+    """
+
+    def __init__(self, docx_ratio: float, min_pages: int, max_pages: int, duplicate_rate: float, seed: int):
+        self.docx_ratio = docx_ratio
+        self.min_pages = min_pages
+        self.max_pages = max_pages
+        self.duplicate_rate = duplicate_rate
+        self._rnd = random.Random(seed)
+        self._sent = []
+        self._lock = threading.Lock()
+
+    def next(self, i: int):
+        """返回 (kind, filename, bytes)。"""
+        with self._lock:
+            if self._sent and self._rnd.random() < self.duplicate_rate:
+                return self._rnd.choice(self._sent)
+            pages = self._rnd.randint(self.min_pages, self.max_pages)
+            is_docx = self._rnd.random() < self.docx_ratio
+        if is_docx:
+            item = ("docx", f"load_{i}.docx", make_docx(f"Load doc {i}", paragraphs=pages * 30, seed=i))
+        else:
+            item = ("pdf", f"load_{i}.pdf", make_pdf(f"Load doc {i}", pages=pages, seed=i))
+        with self._lock:
+            self._sent.append(item)
+        return item
+
+
+def _send_one(base_url: str, endpoint: str, item, timeout: float, scheduled: float, poll: float) -> dict:
+    kind, filename, data = item
+    rec = {"kind": kind, "bytes_up": len(data), "bytes_down": 0, "status": None, "error": None}
+    try:
+        files = {"file": (filename, data)}
+        form = {"processor": "mineru", "timeout": str(timeout)}
+        if endpoint == "jobs":
+            resp = requests.post(f"{base_url}/jobs", files=files, data=form, timeout=timeout)
+            resp.raise_for_status()
+            job_id = resp.json()["job_id"]
+            while True:
+                if time.time() - scheduled > timeout:
+                    raise requests.Timeout("作业轮询超时")
+                status = requests.get(f"{base_url}/jobs/{job_id}", timeout=timeout).json()["status"]
+                if status in ("done", "failed", "cancelled"):
+                    break
+                time.sleep(poll)
+            resp = requests.get(f"{base_url}/jobs/{job_id}/result", timeout=timeout)
+        else:
+            resp = requests.post(f"{base_url}/process/zip", files=files, data=form, timeout=timeout)
+        rec["status"] = resp.status_code
+        rec["bytes_down"] = len(resp.content)
+        if resp.status_code != 200:
+            rec["error"] = f"HTTP {resp.status_code}"
+    except requests.Timeout:
+        rec["error"] = "timeout"
+    except requests.RequestException as e:
+        rec["error"] = type(e).__name__
+    rec["latency"] = time.time() - scheduled
+    return rec
+
+
+def _latency_stats(latencies) -> dict:
+    return {
+        "p50": round(percentile(latencies, 0.50), 3),
+        "p90": round(percentile(latencies, 0.90), 3),
+        "p99": round(percentile(latencies, 0.99), 3),
+        "max": round(max(latencies), 3) if latencies else 0.0,
+    }
+
+
+def run_step(server: AppServer, args, rate: float, seed: int) -> dict:
+    """以目标速率（默认泊松到达）发送 duration 秒的请求，等待全部返回后汇总。"""
+    corpus = _Corpus(args.docx_ratio, args.min_pages, args.max_pages, args.duplicate_rate, seed)
+    rnd = random.Random(seed)
+    futures = []
+    start = time.time()
+    with _Sampler(server) as sampler, ThreadPoolExecutor(max_workers=args.max_inflight) as pool:
+        scheduled = start
+        i = 0
+        while scheduled - start < args.duration:
+            delay = scheduled - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            item = corpus.next(i)
+            futures.append(pool.submit(
+                _send_one, server.base_url, args.endpoint, item, args.request_timeout, scheduled, args.poll
+            ))
+            i += 1
+            scheduled += rnd.expovariate(rate) if args.poisson else 1.0 / rate
+        records = [f.result() for f in futures]
+    wall = time.time() - start
+
+    ok = [r for r in records if r["error"] is None]
+    errors = {}
+    for r in records:
+        if r["error"]:
+            errors[r["error"]] = errors.get(r["error"], 0) + 1
+    by_kind = {}
+    for kind in sorted({r["kind"] for r in records}):
+        lat = [r["latency"] for r in ok if r["kind"] == kind]
+        by_kind[kind] = dict(count=sum(1 for r in records if r["kind"] == kind), **_latency_stats(lat))
+    try:
+        queue_stats = requests.get(f"{server.base_url}/jobs", timeout=10).json()
+    except (requests.RequestException, ValueError):
+        queue_stats = None
+    return {
+        "target_rate": rate,
+        "requests": len(records),
+        "ok": len(ok),
+        "error_rate": round(1 - len(ok) / len(records), 4) if records else 0.0,
+        "errors": errors,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(ok) / wall, 4) if wall > 0 else 0.0,
+        "latency": _latency_stats([r["latency"] for r in ok]),
+        "by_kind": by_kind,
+        "bytes": {"up": sum(r["bytes_up"] for r in records), "down": sum(r["bytes_down"] for r in records)},
+        "server": sampler.summary(),
+        "queue": queue_stats,
+    }
+
+
+def run_load(args) -> dict:
+    workdir = args.workdir or tempfile.mkdtemp(prefix="server_load_")
+    os.makedirs(workdir, exist_ok=True)
+    server_env = {
+        "FAKE_MINERU_SECONDS": str(args.mineru_seconds),
+        "FAKE_MINERU_SECONDS_PER_PAGE": str(args.mineru_seconds_per_page),
+        "FAKE_MINERU_IMAGES_PER_PAGE": str(args.images_per_page),
+        "FAKE_MINERU_IMAGE_KB": str(args.image_kb),
+        "FAKE_MINERU_JSON_KB": str(args.json_kb),
+        "FAKE_MINERU_FAIL_RATE": str(args.mineru_fail_rate),
+        "FAKE_LIBREOFFICE_SECONDS": str(args.libreoffice_seconds),
+        "FASTAPI_EMBEDDED_WORKERS": str(args.embedded_workers),
+        "FASTAPI_JOB_TIMEOUT": str(args.request_timeout),
+    }
+    rates = [float(r) for r in args.rates.split(",")] if args.rates else [args.rate]
+    server = AppServer(workdir, env=server_env, workers=args.server_workers)
+    steps = []
+    try:
+        server.start()
+        for n, rate in enumerate(rates):
+            step = run_step(server, args, rate, seed=args.seed + n * 100003)
+            steps.append(step)
+            _print_step(step)
+        peak = server.peak_rss_kb()
+    finally:
+        server.stop()
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "params": {k: v for k, v in vars(args).items() if k not in ("baseline", "save_baseline", "workdir", "keep")},
+        "steps": steps,
+        "peak_rss_kb": peak,
+    }
+
+
+def compare_to_baseline(result: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE) -> list:
+    """按目标速率逐档对比，返回回退项描述列表；为空表示未回退。"""
+    regressions = []
+    base_steps = {s["target_rate"]: s for s in baseline.get("steps", [])}
+    for cur in result["steps"]:
+        base = base_steps.get(cur["target_rate"])
+        if not base:
+            continue
+        tag = f"{cur['target_rate']} req/s"
+        if cur["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{tag} 吞吐 {cur['throughput_rps']} < 基线 {base['throughput_rps']}")
+        if cur["error_rate"] > base["error_rate"] + 0.01:
+            regressions.append(f"{tag} 错误率 {cur['error_rate']} > 基线 {base['error_rate']}")
+        for q in ("p50", "p99"):
+            if base["latency"][q] > 0 and cur["latency"][q] > base["latency"][q] * (1 + tolerance):
+                regressions.append(f"{tag} 延迟 {q} {cur['latency'][q]}s > 基线 {base['latency'][q]}s")
+        for key, unit in (("rss_kb", "KB"), ("open_fds", "")):
+            b, c = base["server"][key]["max"], cur["server"][key]["max"]
+            if b and c > b * (1 + tolerance):
+                regressions.append(f"{tag} 服务端 {key} 峰值 {c}{unit} > 基线 {b}{unit}")
+    return regressions
+
+
+def _print_step(step: dict) -> None:
+    lat = step["latency"]
+    srv = step["server"]
+    print(
+        f"目标 {step['target_rate']} req/s: {step['ok']}/{step['requests']} 成功，吞吐 {step['throughput_rps']} req/s，"
+        f"错误率 {step['error_rate']} {step['errors'] or ''}"
+    )
+    print(f"  延迟(s) p50={lat['p50']} p90={lat['p90']} p99={lat['p99']} max={lat['max']}")
+    for kind, st in step["by_kind"].items():
+        print(f"  {kind:<5} n={st['count']:<5} p50={st['p50']} p99={st['p99']}")
+    print(
+        f"  服务端 RSS(KB) 起始/峰值/结束 {srv['rss_kb']['start']}/{srv['rss_kb']['max']}/{srv['rss_kb']['end']}，"
+        f"fd {srv['open_fds']['start']}/{srv['open_fds']['max']}/{srv['open_fds']['end']}"
+    )
+
+
+def _parse_args(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="app.main 服务端压测（假 mineru / libreoffice）")
+    parser.add_argument("--rate", type=float, default=1.0, help="目标请求速率(req/s)")
+    parser.add_argument("--rates", default=None, help="逐档压测的速率列表，逗号分隔，如 0.5,1,2,4（覆盖 --rate）")
+    parser.add_argument("--duration", type=float, default=30.0, help="每档发送请求的时长(秒)")
+    parser.add_argument("--poisson", action=argparse.BooleanOptionalAction, default=True, help="泊松到达（默认）或匀速")
+    parser.add_argument("--endpoint", choices=("process", "jobs"), default="process",
+                        help="process=同步 /process/zip；jobs=异步提交 /jobs 后轮询")
+    parser.add_argument("--poll", type=float, default=0.5, help="jobs 模式的轮询间隔(秒)")
+    parser.add_argument("--docx-ratio", type=float, default=0.2, help="docx 上传占比")
+    parser.add_argument("--duplicate-rate", type=float, default=0.0, help="重复上传已发送内容的比例")
+    parser.add_argument("--min-pages", type=int, default=1)
+    parser.add_argument("--max-pages", type=int, default=8)
+    parser.add_argument("--max-inflight", type=int, default=256, help="客户端最大并发连接数")
+    parser.add_argument("--request-timeout", type=float, default=600.0, help="单请求超时(秒)，同时作为作业截止时间")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mineru-seconds", type=float, default=1.0, help="假 mineru 固定耗时(秒)")
+    parser.add_argument("--mineru-seconds-per-page", type=float, default=0.1, help="假 mineru 每页耗时(秒)")
+    parser.add_argument("--images-per-page", type=int, default=2, help="假 mineru 每页图片数")
+    parser.add_argument("--image-kb", type=int, default=64, help="假 mineru 每张图片大小(KB)")
+    parser.add_argument("--json-kb", type=int, default=256, help="假 mineru middle/model JSON 大小(KB)")
+    parser.add_argument("--mineru-fail-rate", type=float, default=0.0, help="假 mineru 随机失败概率")
+    parser.add_argument("--libreoffice-seconds", type=float, default=2.0, help="假 libreoffice 转换耗时(秒)")
+    parser.add_argument("--server-workers", type=int, default=1, help="uvicorn worker 数")
+    parser.add_argument("--embedded-workers", type=int, default=1, help="每个 API 进程内嵌 worker 的容量")
+    parser.add_argument("--workdir", default=None, help="工作目录（默认临时目录，结束后删除）")
+    parser.add_argument("--keep", action="store_true", help="保留临时工作目录")
+    parser.add_argument("--save-baseline", default=None, help="把结果保存为基线 JSON")
+    parser.add_argument("--baseline", default=None, help="与基线 JSON 对比，回退时返回非 0")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="基线对比容差比例")
+    parser.add_argument("--json", default=None, help="可选：结果 JSON 输出路径")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = _parse_args(argv or sys.argv[1:])
+    result = run_load(args)
+    print(f"服务进程峰值 RSS(KB): {result['peak_rss_kb']}")
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False, indent=1)
+            print(f"结果已保存: {path}")
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(result, baseline, args.tolerance)
+        if regressions:
+            print("相对基线出现回退:\n  " + "\n  ".join(regressions), file=sys.stderr)
+            return 1
+        print("未发现相对基线的回退")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
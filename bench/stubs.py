@@ -0,0 +1,426 @@
+"""基准测试用的本地桩服务：假 Confluence（REST + flyingpdf 导出）、假 n8n webhook 接收端与合成 PDF/docx。"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import socket
+import zipfile
+import threading
+import subprocess
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import urlparse, parse_qs, unquote_plus
+from xml.sax.saxutils import escape
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+
+_LOREM = (
+    "Decoder debug note. Set the debug level through sysfs, dump the stream buffer, "
+    "then check dmesg for the decoder state machine and the ucode version. "
+)
+
+
+def make_pdf(title: str, pages: int = 3, lines_per_page: int = 40, seed: int = 0) -> bytes:
+    """生成一个带文字层的最小合法 PDF（正确的 xref），内容可复现。"""
+    rnd = random.Random(seed)
+    page_ids = []
+    font_id = 3
+    next_id = 4
+    page_objs = []
+    for p in range(pages):
+        lines = [f"{title} - page {p + 1}"]
+        for _ in range(lines_per_page):
+            lines.append(_LOREM[: rnd.randint(40, len(_LOREM))])
+        stream_lines = ["BT", "/F1 10 Tf", "12 TL", "50 790 Td"]
+        for line in lines:
+            safe = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            stream_lines.append(f"({safe}) Tj T*")
+        stream_lines.append("ET")
+        stream = "\n".join(stream_lines).encode("latin-1", "replace")
+        content_id, page_id = next_id, next_id + 1
+        next_id += 2
+        page_ids.append(page_id)
+        page_objs.append((content_id, b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream"))
+        page_objs.append((
+            page_id,
+            (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents {content_id} 0 R "
+             f"/Resources << /Font << /F1 {font_id} 0 R >> >> >>").encode(),
+        ))
+    kids = " ".join(f"{i} 0 R" for i in page_ids)
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        2: f"<< /Type /Pages /Kids [{kids}] /Count {pages} >>".encode(),
+        3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    }
+    for oid, body in page_objs:
+        objects[oid] = body
+
+    out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = {}
+    for oid in sorted(objects):
+        offsets[oid] = len(out)
+        out += f"{oid} 0 obj\n".encode() + objects[oid] + b"\nendobj\n"
+    xref_at = len(out)
+    size = max(objects) + 1
+    out += f"xref\n0 {size}\n0000000000 65535 f \n".encode()
+    for oid in range(1, size):
+        out += f"{offsets.get(oid, 0):010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{xref_at}\n%%EOF\n".encode()
+    return bytes(out)
+
+
+_DOCX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>'
+)
+_DOCX_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="word/document.xml"/></Relationships>'
+)
+
+
+def make_docx(title: str, paragraphs: int = 60, seed: int = 0) -> bytes:
+    """生成一个最小合法 docx（标题 + 若干段落），内容可复现。"""
+    rnd = random.Random(seed)
+    body = [f'<w:p><w:pPr><w:pStyle w:val="Heading1"/></w:pPr><w:r><w:t>{escape(title)}</w:t></w:r></w:p>']
+    for _ in range(paragraphs):
+        body.append(f"<w:p><w:r><w:t>{escape(_LOREM[: rnd.randint(40, len(_LOREM))])}</w:t></w:r></w:p>")
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+        + "".join(body) + "</w:body></w:document>"
+    )
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("[Content_Types].xml", _DOCX_CONTENT_TYPES)
+        zf.writestr("_rels/.rels", _DOCX_RELS)
+        zf.writestr("word/document.xml", document)
+    return buf.getvalue()
+
+
+class _Counters:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+
+    def add(self, bytes_out: int = 0, bytes_in: int = 0) -> None:
+        with self.lock:
+            self.requests += 1
+            self.bytes_out += bytes_out
+            self.bytes_in += bytes_in
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            return {"requests": self.requests, "bytes_out": self.bytes_out, "bytes_in": self.bytes_in}
+
+
+class _StubServer:
+    """在后台线程运行的 ThreadingHTTPServer，端口 0 表示自动分配。"""
+
+    handler_cls = BaseHTTPRequestHandler
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.counters = _Counters()
+        handler = type("Handler", (self.handler_cls,), {"stub": self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send(self, code: int, body: bytes, content_type: str = "application/json", headers: Optional[dict] = None) -> None:
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, code: int, obj) -> int:
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self._send(code, body)
+        return len(body)
+
+
+class FakeConfluence(_StubServer):
+    """
+    假 Confluence：提供 get_confluence_page_by_url / export_confluence_page_to_pdf_by_url /
+    url_canon 用到的接口，页面为合成数据，导出 PDF 延迟可配置。
+    """
+
+    def __init__(self, pages: Dict[str, dict], space: str = "SW", export_latency: float = 0.5,
+                 rest_latency: float = 0.02, **kw):
+        self.pages = pages  # page_id -> {"title", "pages"}
+        self.space = space
+        self.export_latency = export_latency
+        self.rest_latency = rest_latency
+        self._pdf_cache: Dict[str, bytes] = {}
+        self._cache_lock = threading.Lock()
+        super().__init__(**kw)
+
+    @classmethod
+    def synthetic(cls, count: int, min_pages: int = 1, max_pages: int = 12, seed: int = 0, **kw):
+        rnd = random.Random(seed)
+        pages = {}
+        for i in range(count):
+            pid = str(18000000 + i)
+            pages[pid] = {"title": f"Synthetic decoder page {i}", "pages": rnd.randint(min_pages, max_pages)}
+        return cls(pages, **kw)
+
+    def page_urls(self, display_every: int = 3) -> List[str]:
+        """返回页面 URL 列表，混合 viewpage.action 与 /display/ 两种写法。"""
+        urls = []
+        for n, (pid, page) in enumerate(self.pages.items()):
+            if display_every and n % display_every == 0:
+                urls.append(f"{self.base_url}/display/{self.space}/{page['title'].replace(' ', '+')}")
+            else:
+                urls.append(f"{self.base_url}/pages/viewpage.action?pageId={pid}")
+        return urls
+
+    def pdf_bytes(self, pid: str) -> bytes:
+        with self._cache_lock:
+            if pid not in self._pdf_cache:
+                page = self.pages[pid]
+                self._pdf_cache[pid] = make_pdf(page["title"], pages=page["pages"], seed=int(pid))
+            return self._pdf_cache[pid]
+
+    def _page_json(self, pid: str) -> dict:
+        page = self.pages[pid]
+        return {"id": pid, "type": "page", "title": page["title"], "body": {"storage": {"value": "<p>synthetic</p>"}}}
+
+    class handler_cls(_QuietHandler):
+        def do_GET(self):
+            stub = self.stub
+            parsed = urlparse(self.path)
+            qs = parse_qs(parsed.query)
+            path = parsed.path
+            if path.endswith("pdfpageexport.action"):
+                pid = (qs.get("pageId") or [""])[0]
+                if pid not in stub.pages:
+                    stub.counters.add(bytes_out=self._json(404, {"message": "not found"}))
+                    return
+                time.sleep(stub.export_latency)
+                body = stub.pdf_bytes(pid)
+                self._send(200, body, "application/pdf",
+                           {"Content-Disposition": f'attachment; filename="{stub.pages[pid]["title"].replace(" ", "_")}.pdf"'})
+                stub.counters.add(bytes_out=len(body))
+                return
+
+            time.sleep(stub.rest_latency)
+            if path.startswith("/rest/api/content/search"):
+                cql = (qs.get("cql") or [""])[0]
+                results = [stub._page_json(pid) for pid, p in stub.pages.items() if f'"{p["title"]}"' in cql]
+                stub.counters.add(bytes_out=self._json(200, {"results": results, "size": len(results)}))
+                return
+            if path.startswith("/rest/api/content/"):
+                pid = path.rsplit("/", 1)[-1]
+                if pid in stub.pages:
+                    stub.counters.add(bytes_out=self._json(200, stub._page_json(pid)))
+                else:
+                    stub.counters.add(bytes_out=self._json(404, {"message": "not found"}))
+                return
+            if path.rstrip("/") == "/rest/api/content":
+                title = unquote_plus((qs.get("title") or [""])[0])
+                results = [stub._page_json(pid) for pid, p in stub.pages.items() if p["title"] == title]
+                stub.counters.add(bytes_out=self._json(200, {"results": results}))
+                return
+            stub.counters.add(bytes_out=self._json(404, {"message": f"unsupported: {path}"}))
+
+
+class FakeWebhook(_StubServer):
+    """假 n8n webhook：记录收到的 payload，可配置处理延迟与失败率。"""
+
+    def __init__(self, latency: float = 0.2, fail_rate: float = 0.0, seed: int = 0, **kw):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.received: List[dict] = []
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+        super().__init__(**kw)
+
+    class handler_cls(_QuietHandler):
+        def do_POST(self):
+            stub = self.stub
+            n = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(n) if n else b""
+            time.sleep(stub.latency)
+            with stub._lock:
+                fail = stub._rnd.random() < stub.fail_rate
+                if not fail:
+                    try:
+                        stub.received.append(json.loads(raw or b"{}"))
+                    except ValueError:
+                        stub.received.append({"raw": raw.decode("utf-8", "replace")})
+            if fail:
+                out = self._json(503, {"message": "synthetic failure"})
+            else:
+                out = self._json(200, {"message": "Workflow was started"})
+            stub.counters.add(bytes_out=out, bytes_in=len(raw))
+
+
+def write_shim(bin_dir: str, name: str, script: str) -> str:
+    """在 bin_dir 下生成名为 name 的可执行包装脚本，转调 script（用当前 Python 解释器）。"""
+    os.makedirs(bin_dir, exist_ok=True)
+    path = os.path.join(bin_dir, name)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.abspath(script)}" "$@"\n')
+    os.chmod(path, 0o755)
+    return path
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class AppServer:
+    """
+    以子进程启动 app.main:app（uvicorn），把假 mineru / libreoffice 放到 PATH 最前面。
+
+    FASTAPI_LOG_FILE 与 FASTAPI_WORK_ROOT 指向 workdir，避免写到生产路径。
+    """
+
+    def __init__(self, workdir: str, env: Optional[dict] = None, workers: int = 1, port: int = 0):
+        self.workdir = os.path.abspath(workdir)
+        self.port = port or _free_port()
+        self.workers = workers
+        self.bin_dir = os.path.join(self.workdir, "bin")
+        write_shim(self.bin_dir, "mineru", os.path.join(BENCH_DIR, "fake_mineru.py"))
+        fake_lo = os.path.join(BENCH_DIR, "fake_libreoffice.py")
+        if os.path.isfile(fake_lo):
+            write_shim(self.bin_dir, "libreoffice", fake_lo)
+        self.env = dict(os.environ)
+        self.env.update(env or {})
+        self.env["PATH"] = self.bin_dir + os.pathsep + self.env.get("PATH", "")
+        self.env.setdefault("FASTAPI_LOG_FILE", os.path.join(self.workdir, "fastapi_log.log"))
+        self.env.setdefault("FASTAPI_WORK_ROOT", os.path.join(self.workdir, "server"))
+        os.makedirs(self.env["FASTAPI_WORK_ROOT"], exist_ok=True)
+        self.proc: Optional[subprocess.Popen] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self, ready_timeout: float = 30.0):
+        cmd = [
+            sys.executable, "-m", "uvicorn", "app.main:app",
+            "--host", "127.0.0.1", "--port", str(self.port),
+            "--workers", str(self.workers), "--log-level", "warning",
+        ]
+        self._log = open(os.path.join(self.workdir, "uvicorn.out"), "ab")
+        self.proc = subprocess.Popen(cmd, cwd=REPO_ROOT, env=self.env, stdout=self._log, stderr=subprocess.STDOUT)
+        deadline = time.time() + ready_timeout
+        while time.time() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"服务启动失败，见 {self._log.name}")
+            try:
+                with urllib.request.urlopen(f"{self.base_url}/health", timeout=1) as resp:
+                    if resp.status == 200:
+                        return self
+            except OSError:
+                time.sleep(0.2)
+        self.stop()
+        raise RuntimeError(f"服务 {ready_timeout} 秒内未就绪")
+
+    def peak_rss_kb(self) -> int:
+        """服务进程（含 uvicorn 多 worker 子进程）的峰值 RSS 之和，单位 KB。"""
+        if self.proc is None:
+            return 0
+        return sum(_proc_status_kb(pid, "VmHWM") for pid in [self.proc.pid] + _child_pids(self.proc.pid))
+
+    def rss_kb(self) -> int:
+        """服务进程树当前 RSS 之和（含 mineru / libreoffice 子进程），单位 KB。"""
+        if self.proc is None:
+            return 0
+        return sum(_proc_status_kb(pid, "VmRSS") for pid in [self.proc.pid] + _child_pids(self.proc.pid))
+
+    def open_fds(self) -> int:
+        if self.proc is None:
+            return 0
+        total = 0
+        for pid in [self.proc.pid] + _child_pids(self.proc.pid):
+            try:
+                total += len(os.listdir(f"/proc/{pid}/fd"))
+            except OSError:
+                pass
+        return total
+
+    def stop(self) -> None:
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+        if getattr(self, "_log", None):
+            self._log.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def _proc_status_kb(pid: int, key: str) -> int:
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith(key + ":"):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+
+def _child_pids(pid: int) -> List[int]:
+    out = []
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children", "r") as f:
+                out += [int(x) for x in f.read().split()]
+    except OSError:
+        pass
+    for c in list(out):
+        out += _child_pids(c)
+    return out
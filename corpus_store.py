@@ -0,0 +1,320 @@
+"""
+单文件语料库：把处理完成的文档（压缩后的 Markdown 正文、元数据、块偏移、图片引用）存进一个 sqlite 文件。
+
+下游加载语料只需顺序扫描这一个文件；块只保存在正文中的偏移，读取时再切出原文。
+命令行可查看统计、导出 JSONL 或读取单个文档。
+"""
+import os
+import sys
+import csv
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+from typing import Iterable, Iterator, List, Optional
+
+from md_chunker import DEFAULT_MAX_TOKENS, chunk_markdown, find_images
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc_id      TEXT PRIMARY KEY,
+    source      TEXT NOT NULL,
+    title       TEXT,
+    md_path     TEXT,
+    md_sha256   TEXT,
+    md_bytes    INTEGER,
+    md_z        BLOB NOT NULL,          -- zlib 压缩的 Markdown 正文
+    meta        TEXT,
+    updated_at  REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    doc_id        TEXT NOT NULL,
+    chunk_index   INTEGER NOT NULL,
+    section_path  TEXT,
+    start         INTEGER,               -- 在 Markdown 正文中的字符偏移，定位失败时为 NULL
+    end           INTEGER,
+    tokens        INTEGER,
+    duplicate_of  TEXT,
+    text          TEXT,                  -- 仅在偏移无法定位时保存原文
+    PRIMARY KEY (doc_id, chunk_index)
+);
+CREATE TABLE IF NOT EXISTS images (
+    doc_id      TEXT NOT NULL,
+    ref         TEXT NOT NULL,           -- Markdown 中的引用（重写后为 HTTP 地址）
+    local_path  TEXT,
+    PRIMARY KEY (doc_id, ref)
+);
+"""
+
+
+def _read_chunk_rows(path: str) -> List[dict]:
+    """读取 md_chunker 写出的块文件（.csv / .jsonl）。"""
+    rows = []
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            for row in csv.DictReader(f):
+                row["chunk_index"] = int(row["chunk_index"])
+                row["tokens"] = int(row["tokens"] or 0)
+                rows.append(row)
+        else:
+            for line in f:
+                if line.strip():
+                    rows.append(json.loads(line))
+    return rows
+
+
+def _normalize_ws(text: str) -> str:
+    return " ".join(text.split())
+
+
+def _locate(md: str, text: str, cursor: int) -> tuple:
+    """
+    在正文中从 cursor 起依次定位块的每一非空行，返回 (start, end)；找不到时为 (None, None)。
+
+    逐行顺序匹配而不是只找首末行：块内重复出现的行（代码里的同名命令、表格里的重复行）不会让末端提前截断。
+    定位出的片段与块原文（空白归一后）不一致时同样视为失败，由调用方保存原文。
+    """
+    lines = [ln for ln in text.splitlines() if ln.strip()]
+    if not lines:
+        return None, None
+    start = pos = md.find(lines[0], cursor)
+    if start < 0:
+        return None, None
+    for ln in lines:
+        pos = md.find(ln, pos)
+        if pos < 0:
+            return None, None
+        pos += len(ln)
+    if _normalize_ws(md[start:pos]) != _normalize_ws(text):
+        return None, None
+    return start, pos
+
+
+class _RowGroups:
+    """按 doc_rowid 有序的游标：take(rowid) 取出该文档的全部行，游标只前进不回退。"""
+
+    def __init__(self, cursor):
+        self._it = iter(cursor)
+        self._head = next(self._it, None)
+
+    def take(self, rowid: int) -> List[sqlite3.Row]:
+        rows = []
+        while self._head is not None and self._head["doc_rowid"] <= rowid:
+            if self._head["doc_rowid"] == rowid:
+                rows.append(self._head)
+            self._head = next(self._it, None)
+        return rows
+
+
+def _title_of(md: str) -> str:
+    for line in md.splitlines():
+        s = line.strip()
+        if s.startswith("#"):
+            return s.lstrip("#").strip()
+    return ""
+
+
+class CorpusStore:
+    """
+    把处理完成的文档（Markdown 正文、元数据、块偏移、图片引用）追加到单个 sqlite 文件。
+
+    下游加载整个语料只需顺序扫描这一个文件，不再遍历 debug_doc 下成千上万的小文件；
+    同一 doc_id 再次写入时整体替换。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        d = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(d, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def put_document(
+        self,
+        doc_id: str,
+        source: str,
+        md_path: str,
+        chunks_path: Optional[str] = None,
+        image_dir: Optional[str] = None,
+        meta: Optional[dict] = None,
+        max_tokens: int = DEFAULT_MAX_TOKENS,
+    ) -> dict:
+        """
+        写入（或替换）一个文档。
+
+        :param md_path: 最终 Markdown（通常是 _with_img.md）
+        :param chunks_path: md_chunker 的块文件；不提供时按 max_tokens 现场切块
+        :param image_dir: 图片所在目录（原始 MD 同级的 images/），用于记录引用对应的本地文件
+        :param meta: 额外元数据（pdf/zip 路径等）
+        :return: {"doc_id", "chunks", "images", "md_bytes"}
+        """
+        with open(md_path, "r", encoding="utf-8") as f:
+            md = f.read()
+        raw = md.encode("utf-8")
+        if chunks_path and os.path.isfile(chunks_path):
+            rows = _read_chunk_rows(chunks_path)
+        else:
+            rows = list(chunk_markdown(md.splitlines(keepends=True), doc_id, max_tokens=max_tokens))
+
+        chunk_rows = []
+        cursor = 0
+        for r in rows:
+            start, end = _locate(md, r["text"], cursor)
+            if start is not None:
+                cursor = start
+            chunk_rows.append((
+                doc_id, r["chunk_index"], r.get("section_path"), start, end, r.get("tokens"),
+                r.get("duplicate_of") or None, None if start is not None else r["text"],
+            ))
+
+        image_rows = []
+        for ref in dict.fromkeys(find_images(md)):
+            local = None
+            if image_dir:
+                candidate = os.path.join(image_dir, os.path.basename(ref.split("?", 1)[0]))
+                local = candidate if os.path.isfile(candidate) else None
+            image_rows.append((doc_id, ref, local))
+
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM chunks WHERE doc_id=?", (doc_id,))
+                self._conn.execute("DELETE FROM images WHERE doc_id=?", (doc_id,))
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO documents(doc_id, source, title, md_path, md_sha256, md_bytes, md_z, "
+                    "meta, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (doc_id, source, _title_of(md), os.path.abspath(md_path), hashlib.sha256(raw).hexdigest(),
+                     len(raw), zlib.compress(raw, 6), json.dumps(meta or {}, ensure_ascii=False), time.time()),
+                )
+                self._conn.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?, ?, ?, ?, ?)", chunk_rows)
+                self._conn.executemany("INSERT OR IGNORE INTO images VALUES (?, ?, ?)", image_rows)
+        return {"doc_id": doc_id, "chunks": len(chunk_rows), "images": len(image_rows), "md_bytes": len(raw)}
+
+    @staticmethod
+    def _doc_dict(row, chunks: Optional[Iterable] = None, images: Optional[Iterable] = None) -> dict:
+        md = zlib.decompress(row["md_z"]).decode("utf-8")
+        doc = {k: row[k] for k in row.keys() if k not in ("md_z", "doc_rowid")}
+        doc["meta"] = json.loads(doc["meta"] or "{}")
+        doc["markdown"] = md
+        if chunks is not None:
+            doc["chunks"] = [
+                {
+                    "chunk_index": c["chunk_index"],
+                    "section_path": c["section_path"],
+                    "text": md[c["start"]:c["end"]] if c["start"] is not None else c["text"],
+                    "tokens": c["tokens"],
+                    "duplicate_of": c["duplicate_of"],
+                }
+                for c in chunks
+            ]
+            doc["images"] = [{"ref": i["ref"], "local_path": i["local_path"]} for i in images or ()]
+        return doc
+
+    def get(self, doc_id: str, with_chunks: bool = True) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM documents WHERE doc_id=?", (doc_id,)).fetchone()
+            if row is None:
+                return None
+            if not with_chunks:
+                return self._doc_dict(row)
+            chunks = self._conn.execute("SELECT * FROM chunks WHERE doc_id=? ORDER BY chunk_index", (doc_id,))
+            images = self._conn.execute("SELECT ref, local_path FROM images WHERE doc_id=? ORDER BY ref", (doc_id,))
+            return self._doc_dict(row, chunks.fetchall(), images.fetchall())
+
+    def iter_documents(self, with_chunks: bool = False) -> Iterator[dict]:
+        """
+        按写入顺序流式扫描全部文档。
+
+        使用独立的只读连接（WAL 下不阻塞写入，也不占用 self._lock），文档逐行读取不整体载入内存；
+        with_chunks 时块与图片各按 (文档写入顺序, 序号) 顺序扫描一遍，与文档游标同步归并，
+        不再为每个文档单独查询。
+        """
+        conn = sqlite3.connect(f"file:{os.path.abspath(self.db_path)}?mode=ro", uri=True, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            docs = conn.execute("SELECT rowid AS doc_rowid, * FROM documents ORDER BY rowid")
+            if not with_chunks:
+                for row in docs:
+                    yield self._doc_dict(row)
+                return
+            chunks = _RowGroups(conn.execute(
+                "SELECT d.rowid AS doc_rowid, c.* FROM documents d JOIN chunks c ON c.doc_id = d.doc_id "
+                "ORDER BY d.rowid, c.chunk_index"
+            ))
+            images = _RowGroups(conn.execute(
+                "SELECT d.rowid AS doc_rowid, i.ref, i.local_path FROM documents d JOIN images i ON i.doc_id = d.doc_id "
+                "ORDER BY d.rowid, i.ref"
+            ))
+            for row in docs:
+                rowid = row["doc_rowid"]
+                yield self._doc_dict(row, chunks.take(rowid), images.take(rowid))
+        finally:
+            conn.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            docs, md_bytes, z_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(md_bytes), 0), COALESCE(SUM(LENGTH(md_z)), 0) FROM documents"
+            ).fetchone()
+            chunks = self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+            images = self._conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+        return {
+            "documents": docs,
+            "chunks": chunks,
+            "images": images,
+            "md_bytes": md_bytes,
+            "stored_bytes": z_bytes,
+            "file_bytes": os.path.getsize(self.db_path),
+        }
+
+
+def _parse_args(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="单文件语料库：查看统计、导出 JSONL 或读取单个文档")
+    parser.add_argument("--db", required=True, help="语料库 sqlite 文件")
+    parser.add_argument("--export", default=None, help="把全部文档（含块与图片引用）导出为 JSONL，- 表示标准输出")
+    parser.add_argument("--get", default=None, help="打印指定 doc_id 的文档 JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = _parse_args(argv or sys.argv[1:])
+    with CorpusStore(args.db) as store:
+        if args.get:
+            doc = store.get(args.get)
+            if doc is None:
+                print(f"文档不存在: {args.get}", file=sys.stderr)
+                return 1
+            print(json.dumps(doc, ensure_ascii=False, indent=1))
+            return 0
+        if args.export:
+            out = sys.stdout if args.export == "-" else open(args.export, "w", encoding="utf-8")
+            try:
+                for doc in store.iter_documents(with_chunks=True):
+                    out.write(json.dumps(doc, ensure_ascii=False) + "\n")
+            finally:
+                if out is not sys.stdout:
+                    out.close()
+        print(json.dumps(store.stats(), ensure_ascii=False, indent=1), file=sys.stderr if args.export == "-" else sys.stdout)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
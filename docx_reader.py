@@ -0,0 +1,427 @@
+"""
+DOCX → Markdown 直读：docx 本身就是带结构的 XML，直接解析标题、列表、表格与内嵌图片，
+输出与 mineru 一致的 Markdown + images/ 目录，不再经过 LibreOffice 转 PDF 与 GPU 版面识别。
+
+只依赖标准库（zipfile + ElementTree）。无法解析的文件抛出 DocxReadError，调用方可回退到 PDF 路线。
+
+输出约定（与 mineru vlm 输出兼容）：
+    - 标题按样式（Heading N / 标题 N / Title，或样式的大纲级别）输出为 # ~ ######
+    - 编号/项目符号段落输出为有序/无序列表，按级别缩进
+    - 表格输出为 HTML <table>（保留合并单元格的 colspan/rowspan），单元格内的图片放在表格之后
+    - 图片按内容 sha256 命名写入 images/，引用形如 ![](images/<sha256>.png)
+    - 目录（TOC 样式）段落跳过
+"""
+import os
+import re
+import sys
+import html
+import hashlib
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional, Tuple
+
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+R_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+A_NS = "http://schemas.openxmlformats.org/drawingml/2006/main"
+V_NS = "urn:schemas-microsoft-com:vml"
+MC_NS = "http://schemas.openxmlformats.org/markup-compatibility/2006"
+PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+
+def _w(tag: str) -> str:
+    return f"{{{W_NS}}}{tag}"
+
+
+W_VAL = _w("val")
+R_EMBED = f"{{{R_NS}}}embed"
+R_ID = f"{{{R_NS}}}id"
+
+_HEADING_RE = re.compile(r"^(?:heading|标题)\s*(\d)$", re.IGNORECASE)
+# 段落内这些子树不含正文（属性、修订删除、域代码），兼容块只取 Choice 分支避免图片重复
+_SKIP_TAGS = {_w("pPr"), _w("rPr"), _w("delText"), _w("instrText"), f"{{{MC_NS}}}Fallback"}
+
+
+class DocxReadError(Exception):
+    """文件不是可解析的 docx（损坏、加密或缺少 word/document.xml）。"""
+
+
+def _read_xml(zf: zipfile.ZipFile, name: str) -> Optional[ET.Element]:
+    try:
+        data = zf.read(name)
+    except KeyError:
+        return None
+    return ET.fromstring(data)
+
+
+class _Style:
+    def __init__(self, name: str, based_on: Optional[str], outline: Optional[int], num: Optional[Tuple[str, int]]):
+        self.name = name
+        self.based_on = based_on
+        self.outline = outline
+        self.num = num
+
+
+def _num_pr(ppr: Optional[ET.Element]) -> Optional[Tuple[str, int]]:
+    """读取 w:numPr，返回 (numId, ilvl)；numId 为 0 表示显式取消编号。"""
+    if ppr is None:
+        return None
+    num_pr = ppr.find(_w("numPr"))
+    if num_pr is None:
+        return None
+    num_id = num_pr.find(_w("numId"))
+    ilvl = num_pr.find(_w("ilvl"))
+    if num_id is None:
+        return None
+    return num_id.get(W_VAL, "0"), int(ilvl.get(W_VAL, "0")) if ilvl is not None else 0
+
+
+class _DocxConverter:
+    """单个 docx 的转换状态：样式表、编号定义、图片关系与已写出的图片。"""
+
+    def __init__(self, zf: zipfile.ZipFile, img_dir: str):
+        self.zf = zf
+        self.img_dir = img_dir
+        self.styles = self._load_styles()
+        self.num_formats = self._load_numbering()
+        self.rels = self._load_rels()
+        self.images: Dict[str, str] = {}  # rId -> images/<name>
+        self.stats = {"headings": 0, "paragraphs": 0, "list_items": 0, "tables": 0, "images": 0}
+
+    def _load_styles(self) -> Dict[str, _Style]:
+        root = _read_xml(self.zf, "word/styles.xml")
+        styles = {}
+        if root is None:
+            return styles
+        for st in root.iter(_w("style")):
+            sid = st.get(_w("styleId"))
+            if not sid:
+                continue
+            name_el = st.find(_w("name"))
+            based = st.find(_w("basedOn"))
+            ppr = st.find(_w("pPr"))
+            outline = None
+            if ppr is not None and ppr.find(_w("outlineLvl")) is not None:
+                outline = int(ppr.find(_w("outlineLvl")).get(W_VAL, "9"))
+            styles[sid] = _Style(
+                (name_el.get(W_VAL, "") if name_el is not None else sid).strip(),
+                based.get(W_VAL) if based is not None else None,
+                outline,
+                _num_pr(ppr),
+            )
+        return styles
+
+    def _load_numbering(self) -> Dict[Tuple[str, int], str]:
+        """(numId, ilvl) -> numFmt（bullet / decimal / ...）。"""
+        root = _read_xml(self.zf, "word/numbering.xml")
+        if root is None:
+            return {}
+        abstract = {}
+        for an in root.findall(_w("abstractNum")):
+            levels = {}
+            for lvl in an.findall(_w("lvl")):
+                fmt = lvl.find(_w("numFmt"))
+                levels[int(lvl.get(_w("ilvl"), "0"))] = fmt.get(W_VAL, "bullet") if fmt is not None else "bullet"
+            abstract[an.get(_w("abstractNumId"))] = levels
+        formats = {}
+        for num in root.findall(_w("num")):
+            ref = num.find(_w("abstractNumId"))
+            if ref is None:
+                continue
+            for ilvl, fmt in abstract.get(ref.get(W_VAL), {}).items():
+                formats[(num.get(_w("numId")), ilvl)] = fmt
+        return formats
+
+    def _load_rels(self) -> Dict[str, str]:
+        root = _read_xml(self.zf, "word/_rels/document.xml.rels")
+        rels = {}
+        if root is None:
+            return rels
+        for rel in root.findall(f"{{{PKG_REL_NS}}}Relationship"):
+            if rel.get("TargetMode") == "External":
+                continue
+            target = rel.get("Target", "")
+            target = target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join("word", target))
+            rels[rel.get("Id")] = target
+        return rels
+
+    def _style_chain(self, sid: Optional[str]) -> List[_Style]:
+        if sid and sid not in self.styles:
+            # 缺少 styles.xml 的精简文档：样式 ID 本身即名称（如 Heading1）
+            return [_Style(sid, None, None, None)]
+        chain = []
+        while sid and sid in self.styles and len(chain) < 10:
+            st = self.styles[sid]
+            chain.append(st)
+            sid = st.based_on
+        return chain
+
+    def _heading_level(self, chain: List[_Style], ppr: Optional[ET.Element]) -> int:
+        if ppr is not None and ppr.find(_w("outlineLvl")) is not None:
+            lvl = int(ppr.find(_w("outlineLvl")).get(W_VAL, "9"))
+            if lvl < 9:
+                return min(lvl + 1, 6)
+        for st in chain:
+            name = st.name.lower()
+            if name == "title":
+                return 1
+            m = _HEADING_RE.match(name)
+            if m:
+                return min(max(int(m.group(1)), 1), 6)
+            if st.outline is not None and st.outline < 9:
+                return min(st.outline + 1, 6)
+        return 0
+
+    def _image(self, rid: Optional[str]) -> Optional[str]:
+        """把关系 rid 指向的图片按内容哈希写入 images/，返回 Markdown 中的相对路径。"""
+        if not rid:
+            return None
+        if rid in self.images:
+            return self.images[rid]
+        target = self.rels.get(rid)
+        if not target:
+            return None
+        try:
+            data = self.zf.read(target)
+        except KeyError:
+            return None
+        ext = os.path.splitext(target)[1].lower() or ".bin"
+        name = hashlib.sha256(data).hexdigest() + ext
+        path = os.path.join(self.img_dir, name)
+        if not os.path.exists(path):
+            os.makedirs(self.img_dir, exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+            self.stats["images"] += 1
+        self.images[rid] = f"images/{name}"
+        return self.images[rid]
+
+    def _inline(self, el: ET.Element, text: List[str], images: List[str]) -> None:
+        """按文档顺序收集段落内的文字与图片。"""
+        for child in el:
+            tag = child.tag
+            if tag in _SKIP_TAGS:
+                continue
+            if tag == _w("t"):
+                text.append(child.text or "")
+            elif tag in (_w("tab"), _w("ptab")):
+                text.append("\t")
+            elif tag in (_w("br"), _w("cr")):
+                if child.get(_w("type")) != "page":
+                    text.append("\n")
+            elif tag == _w("noBreakHyphen"):
+                text.append("-")
+            elif tag == f"{{{A_NS}}}blip":
+                img = self._image(child.get(R_EMBED))
+                if img:
+                    images.append(img)
+            elif tag == f"{{{V_NS}}}imagedata":
+                img = self._image(child.get(R_ID))
+                if img:
+                    images.append(img)
+            else:
+                self._inline(child, text, images)
+
+    def paragraph(self, p: ET.Element) -> Tuple[str, str, int, List[str]]:
+        """
+        :return: (类型 heading|list|code|text|toc, 文本, 级别/缩进, 图片路径列表)
+        """
+        ppr = p.find(_w("pPr"))
+        sid = None
+        if ppr is not None and ppr.find(_w("pStyle")) is not None:
+            sid = ppr.find(_w("pStyle")).get(W_VAL)
+        chain = self._style_chain(sid)
+        style_name = chain[0].name.lower() if chain else ""
+        text_parts, images = [], []
+        self._inline(p, text_parts, images)
+        text = "".join(text_parts)
+        if style_name.startswith("toc") or style_name.startswith("目录"):
+            return "toc", text, 0, images
+        if "code" in style_name or "preformatted" in style_name or "代码" in style_name:
+            return "code", text, 0, images
+        text = re.sub(r"[ \t\u00a0]+", " ", text).strip()
+        level = self._heading_level(chain, ppr)
+        if level:
+            return "heading", text, level, images
+        num = _num_pr(ppr) or next((st.num for st in chain if st.num), None)
+        if num and num[0] != "0":
+            fmt = self.num_formats.get(num, "bullet")
+            return ("olist" if fmt not in ("bullet", "none") else "list"), text, num[1], images
+        return "text", text, 0, images
+
+    def _cell_blocks(self, tc: ET.Element, images: List[str]) -> str:
+        lines = []
+        for child in self._block_children(tc):
+            if child.tag == _w("p"):
+                _, text, _, imgs = self.paragraph(child)
+                images.extend(imgs)
+                if text.strip():
+                    lines.append(html.escape(text.strip()))
+            elif child.tag == _w("tbl"):
+                # 嵌套表格压平为文字
+                for p in child.iter(_w("p")):
+                    _, text, _, imgs = self.paragraph(p)
+                    images.extend(imgs)
+                    if text.strip():
+                        lines.append(html.escape(text.strip()))
+        return "<br>".join(lines)
+
+    def table(self, tbl: ET.Element) -> Tuple[str, List[str]]:
+        """转为 HTML 表格：gridSpan → colspan，vMerge 纵向合并 → rowspan。返回 (HTML, 单元格内图片)。"""
+        images: List[str] = []
+        rows = []  # 每行: [{"col", "span", "text", "merge", "rowspan"}]
+        for tr in tbl.findall(_w("tr")):
+            col = 0
+            cells = []
+            for tc in tr.findall(_w("tc")):
+                tcpr = tc.find(_w("tcPr"))
+                span, merge = 1, None
+                if tcpr is not None:
+                    gs = tcpr.find(_w("gridSpan"))
+                    if gs is not None:
+                        span = max(1, int(gs.get(W_VAL, "1")))
+                    vm = tcpr.find(_w("vMerge"))
+                    if vm is not None:
+                        merge = vm.get(W_VAL, "continue")
+                cells.append({"col": col, "span": span, "text": self._cell_blocks(tc, images),
+                              "merge": merge, "rowspan": 1})
+                col += span
+            rows.append(cells)
+        # 纵向合并的后续单元格并入上方起始单元格
+        open_cells = {}  # col -> 起始单元格
+        for cells in rows:
+            for cell in cells:
+                if cell["merge"] == "continue" and cell["col"] in open_cells:
+                    open_cells[cell["col"]]["rowspan"] += 1
+                    cell["skip"] = True
+                else:
+                    open_cells[cell["col"]] = cell
+        out = ["<table>"]
+        for cells in rows:
+            tds = []
+            for cell in cells:
+                if cell.get("skip"):
+                    continue
+                attrs = ""
+                if cell["span"] > 1:
+                    attrs += f' colspan="{cell["span"]}"'
+                if cell["rowspan"] > 1:
+                    attrs += f' rowspan="{cell["rowspan"]}"'
+                tds.append(f"<td{attrs}>{cell['text']}</td>")
+            out.append("<tr>" + "".join(tds) + "</tr>")
+        out.append("</table>")
+        self.stats["tables"] += 1
+        return "".join(out), images
+
+    def _block_children(self, parent: ET.Element):
+        """正文块：段落与表格；内容控件（sdt）展开。"""
+        for child in parent:
+            if child.tag in (_w("p"), _w("tbl")):
+                yield child
+            elif child.tag == _w("sdt"):
+                content = child.find(_w("sdtContent"))
+                if content is not None:
+                    yield from self._block_children(content)
+
+    def convert(self, body: ET.Element) -> str:
+        blocks: List[str] = []
+        code: List[str] = []
+        in_list = False
+
+        def flush_code():
+            if code:
+                blocks.append("```\n" + "\n".join(code) + "\n```")
+                code.clear()
+
+        for el in self._block_children(body):
+            if el.tag == _w("tbl"):
+                flush_code()
+                table_html, images = self.table(el)
+                blocks.append(table_html)
+                blocks.extend(f"![]({img})" for img in images)
+                in_list = False
+                continue
+            kind, text, level, images = self.paragraph(el)
+            if kind == "toc":
+                continue
+            if kind == "code":
+                code.append(text.rstrip())
+                continue
+            flush_code()
+            if kind == "heading" and text:
+                blocks.append("#" * level + " " + text.replace("\n", " "))
+                self.stats["headings"] += 1
+            elif kind in ("list", "olist") and text:
+                marker = "1." if kind == "olist" else "-"
+                item = "    " * level + f"{marker} " + text.replace("\n", " ")
+                if in_list and blocks:
+                    # 连续列表项合为一个块，之间不空行
+                    blocks[-1] += "\n" + item
+                else:
+                    blocks.append(item)
+                self.stats["list_items"] += 1
+            elif text:
+                blocks.append(text.replace("\n", "  \n"))
+                self.stats["paragraphs"] += 1
+            in_list = kind in ("list", "olist") and bool(text)
+            for img in images:
+                blocks.append(f"![]({img})")
+                in_list = False
+        flush_code()
+        return "\n\n".join(blocks) + "\n"
+
+
+def docx_to_markdown(docx_path: str, out_dir: str, base: Optional[str] = None) -> Tuple[str, dict]:
+    """
+    把 docx 转为 Markdown，写出 out_dir/<base>.md 与 out_dir/images/。
+
+    :param docx_path: .docx 文件路径（旧版二进制 .doc 不支持）
+    :param out_dir: 输出目录（对应 mineru 的 <stem>/vlm 目录）
+    :param base: 输出文件名（不含扩展名），默认与输入同名
+    :return: (MD 文件路径, 统计 {"headings", "paragraphs", "list_items", "tables", "images"})
+    :raises DocxReadError: 文件不是可解析的 docx
+    """
+    base = base or os.path.splitext(os.path.basename(docx_path))[0]
+    try:
+        with zipfile.ZipFile(docx_path) as zf:
+            root = _read_xml(zf, "word/document.xml")
+            if root is None:
+                raise DocxReadError(f"缺少 word/document.xml: {docx_path}")
+            body = root.find(_w("body"))
+            if body is None:
+                raise DocxReadError(f"word/document.xml 中没有正文: {docx_path}")
+            converter = _DocxConverter(zf, os.path.join(out_dir, "images"))
+            text = converter.convert(body)
+    except (zipfile.BadZipFile, ET.ParseError, RuntimeError) as e:
+        # RuntimeError: 加密的 zip 条目
+        raise DocxReadError(f"无法解析 docx {docx_path}: {e}") from e
+    os.makedirs(out_dir, exist_ok=True)
+    md_path = os.path.join(out_dir, f"{base}.md")
+    with open(md_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return md_path, converter.stats
+
+
+def _parse_args(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="docx 直接转 Markdown（mineru 兼容的 images/ 目录）")
+    parser.add_argument("docx", help="输入 .docx 文件")
+    parser.add_argument("--out", default=None, help="输出目录，默认与输入同级的 <文件名>/ 目录")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = _parse_args(argv or sys.argv[1:])
+    out_dir = args.out or os.path.splitext(os.path.abspath(args.docx))[0]
+    try:
+        md_path, stats = docx_to_markdown(args.docx, out_dir)
+    except (DocxReadError, OSError) as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 1
+    print(f"已输出: {md_path} {stats}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,10 +1,15 @@
 import os
+import io
 import sys
 import zipfile
 import re
+import shutil
+import hashlib
+import posixpath
 from typing import Optional
 import pathlib
 import subprocess
+import tempfile
 try:
     import requests
 except ImportError:
@@ -14,6 +19,11 @@ except ImportError:
 # 依赖本地模块
 from my_confluce_test import export_confluence_page_to_pdf_by_url, _safe_filename
 from process_client import process_document
+from tracing import traced, file_size
+from docx_reader import DocxReadError, docx_to_markdown
+
+# 本地 .docx 直接解析为 Markdown（不经 LibreOffice 与 MinerU）；解析失败时自动回退到转 PDF 路线
+DOCX_DIRECT = os.environ.get("MINERU_DOCX_DIRECT", "1") == "1"
 
 def _ensure_dir(path: str) -> None:
     os.makedirs(path, exist_ok=True)
@@ -48,6 +58,7 @@ def url_to_zip(
     md_out: Optional[str] = None,
     timeout: int = 6000,
     webhook_url: Optional[str] = "http://localhost:5678/webhook-test/b417dcab-96b5-437e-816e-666ea406e4a0",
+    docx_direct: bool = DOCX_DIRECT,
 ) -> str:
     """
     给定 Confluence 页面 URL：
@@ -61,14 +72,29 @@ def url_to_zip(
     :param pdf_out: 可选，PDF 输出路径（不提供则自动按标题命名）
     :param md_out: 可选，Markdown 输出路径（默认 output.md）
     :param timeout: 总体请求超时时长（秒）
+    :param docx_direct: 本地 .docx 直接解析为 Markdown，失败时回退为转 PDF 后走 mineru
     :return: mineru 解析出来的zip 文件路径
     """
+    pdf_path = export_source_to_pdf(page_url, pdf_out, keep_docx=docx_direct)
+    return pdf_to_zip(
+        pdf_path,
+        processor=processor,
+        server_url=server_url,
+        md_out=md_out,
+        timeout=timeout,
+    )
+
+def export_source_to_pdf(page_url: str, pdf_out: Optional[str] = None, keep_docx: bool = False) -> str:
+    """url_to_zip 的第 1 步：导出 Confluence 页面（或整理本地文件名并转换 doc/docx），返回本地 PDF 路径。
+
+    keep_docx 为 True 时本地 .docx 只整理文件名、不转 PDF，由 pdf_to_zip 直接解析。
+    """
     pdf_path = ''
     # 1) 从 URL 导出 PDF
     print(f"开始导出 PDF，URL: {page_url}")
     if not page_url or not page_url.strip():
         raise ValueError("Confluence 页面 URL 不能为空")
-    if not page_url.startswith("https://"):
+    if not page_url.startswith(("https://", "http://")):
         pdf_path = save_with_sanitized_name(page_url)
         print(f"导出本地文件路径: {pdf_path}")
     else:
@@ -93,26 +119,51 @@ def url_to_zip(
 
     if not pdf_path or not os.path.isfile(pdf_path):
         raise FileNotFoundError(f"未找到导出的 PDF 文件: {pdf_path}")
+    if keep_docx and pdf_path.lower().endswith(".docx"):
+        return pdf_path
     if not pdf_path.endswith(".pdf"):
         tmp_path = _convert_to_pdf(pdf_path, os.path.dirname(pdf_path))
         print(f"文件转换{pdf_path} --> {tmp_path}")
         pdf_path = tmp_path
+    return pdf_path
+
+def pdf_to_zip(
+    pdf_path: str,
+    processor: str = "mineru",
+    server_url: str = "http://10.58.11.60:7890/process/zip",
+    md_out: Optional[str] = None,
+    timeout: int = 6000,
+    skip_existing: bool = True,
+    request_id: Optional[str] = None,
+) -> str:
+    """url_to_zip 的第 2 步：上传 PDF 到处理服务，ZIP 保存到 PDF 同级的 <PDF 名>/ 目录下。
 
+    skip_existing 为 True 且输出目录已存在时抛出 SkipProcessing；
+    由作业台账驱动续跑时传 False，以台账状态而非目录是否存在为准。
+    request_id 为关联 ID，随请求发给处理服务（缺省时由 process_document 生成）。
+    输入为 .docx 时先尝试本地直读（docx_to_zip），无法解析时转 PDF 后照常上传。
+    """
     base_name = os.path.splitext(os.path.basename(pdf_path))[0]
     root_dir = os.path.dirname(pdf_path)
     save_dir = os.path.join(root_dir, base_name)
     # 若该 URL 对应的输出目录已存在，直接跳过
-    if os.path.isdir(save_dir):
+    if skip_existing and os.path.isdir(save_dir):
         msg = f"输出目录已存在，跳过: {save_dir}"
         print(msg)
         raise SkipProcessing(msg)
     os.makedirs(save_dir, exist_ok=True)
-    print(f"PDF 路径: {pdf_path}")
-    
-    # 2) 上传 PDF 到处理服务，获取 ZIP
     requested_out = (md_out if md_out and md_out.strip() else "output.zip")
     zip_filename = os.path.basename(requested_out)
     zip_output_path = os.path.join(save_dir, zip_filename)
+    if pdf_path.lower().endswith(".docx"):
+        try:
+            return docx_to_zip(pdf_path, zip_output_path)
+        except DocxReadError as e:
+            print(f"docx 直读失败，回退为转 PDF: {e}", file=sys.stderr)
+            pdf_path = _convert_to_pdf(pdf_path, root_dir)
+    print(f"PDF 路径: {pdf_path}")
+    
+    # 2) 上传 PDF 到处理服务，获取 ZIP
     print(f"开始上传到处理服务: {server_url}, 输出: {zip_output_path}")
     zip_text = process_document(
         file_path=pdf_path,
@@ -120,11 +171,49 @@ def url_to_zip(
         server_url=server_url,
         output_path=zip_output_path,
         timeout=timeout,
+        request_id=request_id,
     )
 
 
     return zip_output_path
 
+
+@traced("docx_to_zip", bytes_of=file_size)
+def docx_to_zip(docx_path: str, zip_output_path: str) -> str:
+    """
+    本地把 docx 直读为与 mineru 结果相同结构的 ZIP：<名>/docx/<名>.md 与 <名>/docx/images/，
+    后续 extract_zip_and_find_md / 图片重写无需区分来源。
+
+    :raises DocxReadError: 文件无法按 docx 解析
+    """
+    base = os.path.splitext(os.path.basename(docx_path))[0]
+    work_dir = tempfile.mkdtemp(prefix=".docx_", dir=os.path.dirname(zip_output_path) or ".")
+    tmp_zip = zip_output_path + ".tmp"
+    try:
+        _, stats = docx_to_markdown(docx_path, os.path.join(work_dir, base, "docx"), base)
+        with zipfile.ZipFile(tmp_zip, "w", zipfile.ZIP_DEFLATED) as zf:
+            for root, _, files in os.walk(work_dir):
+                for fn in files:
+                    path = os.path.join(root, fn)
+                    zf.write(path, os.path.relpath(path, work_dir))
+        os.replace(tmp_zip, zip_output_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        if os.path.exists(tmp_zip):
+            os.remove(tmp_zip)
+    print(f"docx 直读完成: {zip_output_path} {stats}")
+    return zip_output_path
+
+def _is_md_candidate(name: str) -> bool:
+    lower_fn = os.path.basename(name).lower()
+    return lower_fn.endswith('.md') and not lower_fn.endswith('_fix.md')
+
+
+def _md_depth(name: str) -> int:
+    return name.replace("\\", "/").count("/")
+
+
+@traced("extract_zip_and_find_md", bytes_of=file_size)
 def extract_zip_and_find_md(zip_path: str, extract_dir: Optional[str] = None) -> str:
     """解压 ZIP 并返回目录层级最深的 MD 文件绝对路径。"""
     if not os.path.isfile(zip_path):
@@ -138,14 +227,187 @@ def extract_zip_and_find_md(zip_path: str, extract_dir: Optional[str] = None) ->
     md_candidates = []
     for root, _, files in os.walk(extract_dir):
         for fn in files:
-            lower_fn = fn.lower()
-            if lower_fn.endswith('.md') and not lower_fn.endswith('_fix.md'):
+            if _is_md_candidate(fn):
                 md_candidates.append(os.path.join(root, fn))
     if not md_candidates:
         raise FileNotFoundError(f"未在解压目录中找到 md 文件: {extract_dir}")
     md_path = max(md_candidates, key=lambda p: p.count(os.sep))
     return os.path.abspath(md_path)
 
+
+class MineruZipReader:
+    """
+    只读方式打开 mineru 结果 ZIP，按需读取，不整体解压。
+
+    - 仅通过 ZIP 中央目录定位主 MD（与 extract_zip_and_find_md 规则一致：目录层级最深、排除 *_fix.md）
+    - 主 MD 以文本流方式读出，可直接交给图片链接重写
+    - 图片条目只在调用 extract_images 时落盘，可选硬链接到按内容寻址的图片仓库
+    - layout PDF、middle/model JSON 等中间产物不会被写出
+    """
+
+    IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp")
+
+    def __init__(self, zip_path: str):
+        if not os.path.isfile(zip_path):
+            raise FileNotFoundError(f"ZIP 文件不存在: {zip_path}")
+        self.zip_path = zip_path
+        self._zf = zipfile.ZipFile(zip_path, 'r')
+        self._md_name: Optional[str] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self) -> None:
+        self._zf.close()
+
+    @property
+    def md_name(self) -> str:
+        """主 MD 在 ZIP 内的条目名。"""
+        if self._md_name is None:
+            candidates = [n for n in self._zf.namelist() if not n.endswith("/") and _is_md_candidate(n)]
+            if not candidates:
+                raise FileNotFoundError(f"ZIP 中未找到 md 文件: {self.zip_path}")
+            self._md_name = max(candidates, key=_md_depth)
+        return self._md_name
+
+    @staticmethod
+    def _target_in(extract_dir: str, name: str) -> str:
+        """条目解压到 extract_dir 时的绝对路径；含 .. 或绝对路径、会落到 extract_dir 之外的条目（zip-slip）直接拒绝。"""
+        root = os.path.realpath(extract_dir)
+        target = os.path.realpath(os.path.join(root, *name.split("/")))
+        if name.startswith("/") or os.path.isabs(name) or os.path.commonpath([root, target]) != root:
+            raise ValueError(f"ZIP 条目越出解压目录，拒绝写出: {name}")
+        return target
+
+    def md_path_in(self, extract_dir: str) -> str:
+        """主 MD 若解压到 extract_dir 时对应的绝对路径（不实际写盘）。"""
+        return self._target_in(extract_dir, self.md_name)
+
+    def iter_md_lines(self, encoding: str = "utf-8"):
+        """逐行流式读取主 MD。"""
+        with self._zf.open(self.md_name) as raw:
+            for line in io.TextIOWrapper(raw, encoding=encoding, newline=""):
+                yield line
+
+    def read_md(self, encoding: str = "utf-8") -> str:
+        return "".join(self.iter_md_lines(encoding=encoding))
+
+    def image_names(self) -> list:
+        """与主 MD 同级 images/ 目录下的图片条目。"""
+        md_dir = posixpath.dirname(self.md_name)
+        prefix = f"{md_dir}/images/" if md_dir else "images/"
+        return [
+            n for n in self._zf.namelist()
+            if n.startswith(prefix) and n.lower().endswith(self.IMAGE_EXTS)
+        ]
+
+    def extract_images(self, extract_dir: str, image_store: Optional[str] = None) -> int:
+        """
+        将主 MD 引用目录下的图片写到 extract_dir 中对应位置，返回写出的图片数量。
+
+        提供 image_store 时，图片先按 sha256 存入仓库（已存在则不重复写），再硬链接到目标位置；
+        跨文件系统无法硬链接时回退为复制。
+        """
+        count = 0
+        for name in self.image_names():
+            target = self._target_in(extract_dir, name)
+            _ensure_dir(os.path.dirname(target))
+            if image_store:
+                stored = self._store_image(name, image_store)
+                if os.path.exists(target):
+                    os.remove(target)
+                try:
+                    os.link(stored, target)
+                except OSError:
+                    shutil.copyfile(stored, target)
+            else:
+                with self._zf.open(name) as src, open(target, "wb") as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+            count += 1
+        return count
+
+    def _store_image(self, name: str, image_store: str) -> str:
+        h = hashlib.sha256()
+        with self._zf.open(name) as src:
+            for chunk in iter(lambda: src.read(1024 * 1024), b""):
+                h.update(chunk)
+        ext = os.path.splitext(name)[1].lower()
+        digest = h.hexdigest()
+        stored = os.path.join(image_store, digest[:2], f"{digest}{ext}")
+        if not os.path.exists(stored):
+            _ensure_dir(os.path.dirname(stored))
+            tmp = f"{stored}.tmp{os.getpid()}"
+            with self._zf.open(name) as src, open(tmp, "wb") as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.replace(tmp, stored)
+        return stored
+
+
+# 流式重写时单个段落缓冲的上限(字符)，超长且没有空行的内容按此分段
+_REWRITE_FLUSH_CHARS = 1 << 20
+
+
+@traced("zip_to_rewritten_md", bytes_of=lambda r: file_size(r[1]))
+def zip_to_rewritten_md(zip_path: str,
+                        extract_dir: Optional[str] = None,
+                        base_host: str = "http://10.18.11.98:8081",
+                        workspace_root: str = "/home/amlogic",
+                        extract_images: bool = True,
+                        image_store: Optional[str] = None):
+    """
+    不整体解压 ZIP，直接读取主 MD 并重写图片链接，只写出 `_with_img.md`（及按需的图片）。
+
+    目录布局与 extract_zip_and_find_md + rewrite_md_images_to_http 的结果一致，
+    便于下游（webhook、图片服务）无感切换。
+
+    返回 (重写数量, 新 MD 绝对路径)。未发现需要重写的链接时原样写出主 MD 并返回其路径。
+    """
+    if extract_dir is None:
+        extract_dir = os.path.join(os.path.dirname(zip_path), "extracted")
+    with MineruZipReader(zip_path) as reader:
+        md_path = reader.md_path_in(extract_dir)
+        md_dir = os.path.dirname(md_path)
+        # 从 ZIP 流式读取，按段落（空行）为单位重写后写入临时文件，结束后按是否有改动决定最终文件名；
+        # 图片链接不会跨越空行，跨行的 alt 文本仍能整体匹配
+        _ensure_dir(md_dir)
+        tmp = f"{md_path}.tmp{os.getpid()}"
+        count = 0
+        try:
+            with open(tmp, "w", encoding="utf-8", newline="") as out:
+                buf, size = [], 0
+
+                def _flush():
+                    nonlocal buf, size, count
+                    if buf:
+                        text, n = rewrite_md_text_images_to_http("".join(buf), md_dir, base_host, workspace_root)
+                        count += n
+                        out.write(text)
+                    buf, size = [], 0
+
+                for line in reader.iter_md_lines():
+                    buf.append(line)
+                    size += len(line)
+                    if not line.strip() or size >= _REWRITE_FLUSH_CHARS:
+                        _flush()
+                _flush()
+            new_md = _with_img_path(md_path) if count > 0 else md_path
+            os.replace(tmp, new_md)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        if count > 0:
+            print(f"已重写 {count} 个图片链接（未整体解压 ZIP）: {new_md}")
+        else:
+            print("未发现需要重写的相对图片链接（images/…）")
+        if extract_images:
+            n = reader.extract_images(extract_dir, image_store=image_store)
+            print(f"已写出 {n} 张图片到: {os.path.dirname(md_path)}")
+    return count, new_md
+
 def save_with_sanitized_name(local_path: str) -> str:
     abs_path = os.path.abspath(local_path)
     if not os.path.isfile(abs_path):
@@ -169,6 +431,52 @@ def save_with_sanitized_name(local_path: str) -> str:
     os.rename(abs_path, target)
     return os.path.abspath(target)
 
+_MD_IMAGE_PATTERN = re.compile(r"!\[(?P<alt>[^\]]*)\]\((?P<url>(?:\./)?images/[^)]+)\)")
+
+
+def _http_base_for(md_dir: str, base_host: str, workspace_root: str) -> str:
+    # 计算相对路径用于拼接到 HTTP 前缀（按用户示例不做 URL 编码）
+    try:
+        rel_dir = os.path.relpath(md_dir, workspace_root)
+    except Exception:
+        # 回退：直接使用绝对路径去掉前导斜杠
+        rel_dir = md_dir.lstrip(os.sep)
+    return f"{base_host}/{rel_dir}".replace("\\", "/")
+
+
+def rewrite_md_text_images_to_http(content: str,
+                                   md_dir: str,
+                                   base_host: str = "http://10.18.11.98:8081",
+                                   workspace_root: str = "/home/amlogic"):
+    """对 MD 文本做图片链接重写，返回 (新文本, 修改数量)。md_dir 为 MD 所在（或将要写入的）目录。"""
+    http_base = _http_base_for(md_dir, base_host, workspace_root)
+
+    def _repl(m: re.Match) -> str:
+        alt = m.group("alt")
+        url = m.group("url")
+        # 去掉可能的前缀 "./"
+        if url.startswith("./"):
+            url = url[2:]
+        new_url = f"{http_base}/{url}"
+        return f"![{alt}]({new_url})"
+
+    return _MD_IMAGE_PATTERN.subn(_repl, content)
+
+
+def _with_img_path(md_path: str) -> str:
+    return os.path.join(os.path.dirname(md_path), f"{os.path.basename(md_path).replace('.md', '')}_with_img.md")
+
+
+def _atomic_write_text(path: str, content: str) -> None:
+    """先写临时文件再 os.replace，避免中断时留下半截文件。"""
+    _ensure_dir(os.path.dirname(path) or ".")
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp, path)
+
+
+@traced("rewrite_md_images_to_http", bytes_of=lambda r: file_size(r[1]))
 def rewrite_md_images_to_http(md_path: str,
                               base_host: str = "http://10.18.11.98:8081",
                               workspace_root: str = "/home/amlogic") -> int:
@@ -186,32 +494,13 @@ def rewrite_md_images_to_http(md_path: str,
         raise FileNotFoundError(f"MD 文件不存在: {md_path}")
 
     md_dir = os.path.dirname(md_path)
-    # 计算相对路径用于拼接到 HTTP 前缀（按用户示例不做 URL 编码）
-    try:
-        rel_dir = os.path.relpath(md_dir, workspace_root)
-    except Exception:
-        # 回退：直接使用绝对路径去掉前导斜杠
-        rel_dir = md_dir.lstrip(os.sep)
-
-    http_base = f"{base_host}/{rel_dir}".replace("\\", "/")
+    http_base = _http_base_for(md_dir, base_host, workspace_root)
 
     with open(md_path, "r", encoding="utf-8") as f:
         content = f.read()
 
-    # 匹配括号内以 images/ 或 ./images/ 开头的相对路径
-    pattern = re.compile(r"!\[(?P<alt>[^\]]*)\]\((?P<url>(?:\./)?images/[^)]+)\)")
-
-    def _repl(m: re.Match) -> str:
-        alt = m.group("alt")
-        url = m.group("url")
-        # 去掉可能的前缀 "./"
-        if url.startswith("./"):
-            url = url[2:]
-        new_url = f"{http_base}/{url}"
-        return f"![{alt}]({new_url})"
-
-    new_content, count = pattern.subn(_repl, content)
-    new_md = os.path.join(md_dir, f"{os.path.basename(md_path).replace('.md', '')}_with_img.md")
+    new_content, count = rewrite_md_text_images_to_http(content, md_dir, base_host, workspace_root)
+    new_md = _with_img_path(md_path)
     if count > 0:
         with open(new_md, "w", encoding="utf-8") as f:
             f.write(new_content)
@@ -221,4 +510,3 @@ def rewrite_md_images_to_http(md_path: str,
         new_md = md_path
 
     return count, new_md
-
@@ -0,0 +1,223 @@
+import os
+import sys
+import time
+import json
+import sqlite3
+import hashlib
+import threading
+from typing import Optional, List, Dict
+
+# 文档处理的阶段状态，按流水线先后顺序排列
+STAGES = ("exported", "processed", "extracted", "rewritten", "chunked", "stored", "sent")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc_id      TEXT PRIMARY KEY,
+    source      TEXT NOT NULL,
+    created_at  REAL NOT NULL,
+    updated_at  REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stage_runs (
+    doc_id       TEXT NOT NULL,
+    stage        TEXT NOT NULL,
+    status       TEXT NOT NULL,          -- running | done | failed | skipped
+    output_path  TEXT,
+    sha256       TEXT,
+    started_at   REAL,
+    finished_at  REAL,
+    elapsed      REAL,
+    error        TEXT,
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (doc_id, stage)
+);
+CREATE INDEX IF NOT EXISTS idx_stage_runs_status ON stage_runs(status);
+"""
+
+
+def canonical_doc_id(source: str) -> str:
+    """单条输入的文档主键（离线规范化，不解析 /display/ 标题），规则见 url_canon.canonicalize_inputs。"""
+    from url_canon import canonicalize_inputs
+
+    canon = canonicalize_inputs([source], resolver=None)
+    return canon[0].doc_id if canon else (source or "").strip()
+
+
+def file_sha256(path: str) -> Optional[str]:
+    if not path or not os.path.isfile(path):
+        return None
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class JobLedger:
+    """
+    基于 sqlite 的逐阶段作业台账，替代 succ_*.txt / error_urls_*.txt 交接文件。
+
+    每次状态变化立即提交（WAL 模式），进程崩溃后台账仍与磁盘产物一致；
+    --resume 时每个文档从第一个未完成的阶段继续，已完成阶段不会重算。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        d = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(d, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _execute(self, sql: str, params=()) -> None:
+        with self._lock:
+            self._conn.execute(sql, params)
+            self._conn.commit()
+
+    def _query(self, sql: str, params=()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def register(self, doc_id: str, source: str) -> None:
+        now = time.time()
+        self._execute(
+            "INSERT INTO documents(doc_id, source, created_at, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(doc_id) DO UPDATE SET source=excluded.source, updated_at=excluded.updated_at",
+            (doc_id, source, now, now),
+        )
+
+    def start(self, doc_id: str, stage: str) -> None:
+        now = time.time()
+        self._execute(
+            "INSERT INTO stage_runs(doc_id, stage, status, started_at, attempts) VALUES (?, ?, 'running', ?, 1) "
+            "ON CONFLICT(doc_id, stage) DO UPDATE SET status='running', started_at=excluded.started_at, "
+            "finished_at=NULL, elapsed=NULL, error=NULL, attempts=stage_runs.attempts + 1",
+            (doc_id, stage, now),
+        )
+
+    def complete(self, doc_id: str, stage: str, output_path: Optional[str] = None, sha256: Optional[str] = None) -> None:
+        now = time.time()
+        if sha256 is None and output_path:
+            sha256 = file_sha256(output_path)
+        self._execute(
+            "UPDATE stage_runs SET status='done', output_path=?, sha256=?, finished_at=?, "
+            "elapsed=? - COALESCE(started_at, ?), error=NULL WHERE doc_id=? AND stage=?",
+            (output_path, sha256, now, now, now, doc_id, stage),
+        )
+        self._touch(doc_id, now)
+
+    def fail(self, doc_id: str, stage: str, error: str) -> None:
+        now = time.time()
+        self._execute(
+            "UPDATE stage_runs SET status='failed', finished_at=?, elapsed=? - COALESCE(started_at, ?), error=? "
+            "WHERE doc_id=? AND stage=?",
+            (now, now, now, error, doc_id, stage),
+        )
+        self._touch(doc_id, now)
+
+    def skip(self, doc_id: str, stage: str, reason: str) -> None:
+        """记录被主动跳过的阶段（如不支持的输入类型）；与失败分开统计，不出现在 failures() 中。"""
+        now = time.time()
+        self._execute(
+            "UPDATE stage_runs SET status='skipped', finished_at=?, elapsed=? - COALESCE(started_at, ?), error=? "
+            "WHERE doc_id=? AND stage=?",
+            (now, now, now, reason, doc_id, stage),
+        )
+        self._touch(doc_id, now)
+
+    def mark_done(self, doc_id: str, stage: str, output_path: Optional[str] = None) -> None:
+        """记录在流水线之外完成的阶段（如重试队列中的 webhook 重发成功）；该阶段尚无记录时新建。"""
+        now = time.time()
+        self._execute(
+            "INSERT INTO stage_runs(doc_id, stage, status, output_path, started_at, finished_at, elapsed, attempts) "
+            "VALUES (?, ?, 'done', ?, ?, ?, 0, 1) "
+            "ON CONFLICT(doc_id, stage) DO UPDATE SET status='done', output_path=excluded.output_path, "
+            "finished_at=excluded.finished_at, error=NULL",
+            (doc_id, stage, output_path, now, now),
+        )
+        self._touch(doc_id, now)
+
+    def _touch(self, doc_id: str, now: float) -> None:
+        self._execute("UPDATE documents SET updated_at=? WHERE doc_id=?", (now, doc_id))
+
+    def stage_rows(self, doc_id: str) -> Dict[str, dict]:
+        rows = self._query("SELECT * FROM stage_runs WHERE doc_id=?", (doc_id,))
+        return {r["stage"]: dict(r) for r in rows}
+
+    def resume_point(self, doc_id: str, stages=STAGES) -> Dict[str, Optional[str]]:
+        """
+        返回可以沿用的已完成阶段 -> 产物路径。
+
+        遇到有记录但未完成（失败、跳过、中断，或产物已丢失）的阶段即截止，该阶段及之后都需要重跑；
+        尚无记录的阶段（如后来才启用的 chunk/store）不截止，其后已完成的阶段（如 sent）照常沿用。
+        """
+        rows = self.stage_rows(doc_id)
+        done = {}
+        for stage in stages:
+            row = rows.get(stage)
+            if not row:
+                continue
+            if row["status"] != "done":
+                break
+            out = row.get("output_path")
+            if out and not os.path.exists(out):
+                print(f"台账记录的产物已丢失，将从 {stage} 阶段重跑: {out}", file=sys.stderr)
+                break
+            done[stage] = out
+        return done
+
+    def is_complete(self, doc_id: str, stages=STAGES) -> bool:
+        return len(self.resume_point(doc_id, stages)) == len(stages)
+
+    def documents(self) -> List[dict]:
+        return [dict(r) for r in self._query("SELECT * FROM documents ORDER BY created_at")]
+
+    def failures(self) -> List[dict]:
+        rows = self._query(
+            "SELECT d.source, s.* FROM stage_runs s JOIN documents d ON d.doc_id = s.doc_id "
+            "WHERE s.status NOT IN ('done', 'skipped') ORDER BY s.finished_at"
+        )
+        return [dict(r) for r in rows]
+
+    def summary(self) -> Dict[str, Dict[str, int]]:
+        """每个阶段各状态的文档数。"""
+        out = {s: {} for s in STAGES}
+        for r in self._query("SELECT stage, status, COUNT(*) AS n FROM stage_runs GROUP BY stage, status"):
+            out.setdefault(r["stage"], {})[r["status"]] = r["n"]
+        return out
+
+
+def _parse_args(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="查看作业台账")
+    parser.add_argument("--db", required=True, help="台账 sqlite 文件")
+    parser.add_argument("--failures", action="store_true", help="列出未完成/失败的阶段")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = _parse_args(argv or sys.argv[1:])
+    with JobLedger(args.db) as ledger:
+        print(json.dumps(ledger.summary(), ensure_ascii=False, indent=1))
+        if args.failures:
+            for r in ledger.failures():
+                print(f"[{r['stage']}] {r['status']} {r['source']}: {r.get('error') or ''}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,46 +1,21 @@
 import os
 import sys
+import json
 import time
+import socket
+from typing import Iterable, Optional
 
-from download_minueru import (
-    url_to_zip,
-    extract_zip_and_find_md,
-    SkipProcessing,
-    rewrite_md_images_to_http,
-)
-from send_to_n8n_webhook import send_md_path_to_webhook
+from send_to_n8n_webhook import WebhookDispatcher
+from pipeline import STAGE_ALIASES, STAGE_NAMES, build_default_stages, run_pipeline
+from download_minueru import DOCX_DIRECT
+from job_ledger import JobLedger
+from section_dedup import SectionDedupIndex
+from corpus_store import CorpusStore
+from tracing import configure_tracing
+from url_canon import canonicalize_stream, iter_input_lines, parse_shard, print_dedup_summary, shard_of
 
-def _parse_args(argv):
-    import argparse
-
-    parser = argparse.ArgumentParser(description="通过 Confluence URL 导出 PDF 并转换为 Markdown")
-    # parser.add_argument("--url", required=True, help="Confluence 页面完整 URL")
-    parser.add_argument("--processor", default="mineru", help="处理器名称")
-    parser.add_argument("--server", default="http://10.58.11.60:7890/process/zip", help="处理服务 URL")
-    parser.add_argument("--pdf", default="/home/amlogic/RAG/debug_doc", help="可选：PDF 输出路径")
-    parser.add_argument("--out", default="output.zip", help="可选：ZIP 输出路径")
-    parser.add_argument("--timeout", type=int, default=6000, help="请求超时时间(秒)")
-    parser.add_argument(
-        "--webhook",
-        # default="http://localhost:5678/webhook-test/0ccf68cf-97d7-4361-b3b5-3cdea3a244c7", #测试webhook
-        default="http://localhost:5678/webhook/0ccf68cf-97d7-4361-b3b5-3cdea3a244c7", #生产的webhook
-        help="可选：接收 MD 绝对路径的 webhook URL（置空则不发送）",
-    )
-    return parser.parse_args(argv)
-
-
-def main(argv=None) -> int:
-    args = _parse_args(argv or sys.argv[1:])
-    from datetime import datetime
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    os.makedirs(timestamp, exist_ok=True)
-    local_file_dir = os.path.dirname(__file__)
-    import time
-    error_urls = []
-    minueru_succ_pdfs = []
-
-    
-    urls = [
+# 未指定 --input 时处理的默认清单
+DEFAULT_INPUTS = [
     "https://confluence.amlogic.com/pages/viewpage.action?pageId=364792684#AudioHaldump/debugintroduction-a.ms12versionpipeline",
     "https://confluence.amlogic.com/pages/viewpage.action?pageId=165291970",
     "https://confluence.amlogic.com/pages/viewpage.action?pageId=100811852",
@@ -69,94 +44,262 @@ def main(argv=None) -> int:
     "https://confluence.amlogic.com/pages/viewpage.action?pageId=18088232",
     "https://confluence.amlogic.com/pages/viewpage.action?pageId=180740926",
     "https://confluence.amlogic.com/display/SW/Decoder+data+dump+for+5.15",
-    "/home/amlogic/RAG/debug_doc/SDK使用指南(Android S).docx",
+    "/home/amlogic/RAG/debug_doc/SDK使用指南(Android S).docx",
     "/home/amlogic/RAG/debug_doc/Android U SDK User Guide_0.1.docx",
-    ]
-
-    # 需要自动化,不校验md文档，放开以下代码
-    # for i, url in enumerate(urls):
-    #     print(f"准备处理第 {i+1}/{len(urls)} URL: {url},随时可以断开")
-    #     time.sleep(3)
-    #     print(f"正在处理中,请勿断开")
-    #     time.sleep(1)
-    #     try:
-    #         zip_output_path = url_to_zip(
-    #             # page_url=args.url,
-    #             page_url=url,
-    #             processor=args.processor,
-    #             server_url=args.server,
-    #             pdf_out=args.pdf,
-    #             md_out=args.out,
-    #             timeout=args.timeout,
-    #             webhook_url=args.webhook,
-    #         )
-    #     except SkipProcessing as e:
-    #         print(f"{e}，跳过本轮")
-    #         continue
-    #     except Exception as e:
-    #         print(f"处理失败: {e}", file=sys.stderr)
-    #         error_urls.append(url)
-    #         continue
-
-    #     print(f"已保存 zip 至: {zip_output_path}")
-    #     try:
-    #         md_path = extract_zip_and_find_md(zip_output_path)
-    #         print(f"已提取 MD 文件: {md_path}")
-    #     except Exception as e:
-    #         print(f"解压或查找 MD 失败: {e}", file=sys.stderr)
-    #         error_urls.append(url)
-    #         continue
-    #     minueru_succ_pdfs.append(md_path)
-    
-    # #保存从mineru 解析成功的md文档
-    # succ_pdfs_path = os.path.join(local_file_dir, timestamp, f"succ_from_mineru_pdfs_{timestamp}.txt")
-    # with open(succ_pdfs_path, "w") as f:
-    #     for pdf in minueru_succ_pdfs:
-    #         f.write(pdf + "\n")
-    # 到这里结束
-
-  
-    # 需要自动化,不校验md文档，放开以下代码
-    new_md_paths = []
-    succ_pdfs_path = "/home/amlogic/RAG/debug_doc/my_url_to_csv/my_url_to_csv_workflow/20251120_151847/succ_from_mineru_pdfs_20251120_151847.txt"
-    with open(succ_pdfs_path, "r") as f:
-        for md_path in f:
-            md_path = md_path.strip()
-            new_md_path = ''
-
-            # 重写 MD 中的相对图片链接为绝对 HTTP 链接
-            try:
-                rewritten, new_md_path = rewrite_md_images_to_http(
-                    md_path,
-                    base_host="http://10.18.11.98:8081",
-                    workspace_root="/home/amlogic",
-                )
-                print(f"图片链接重写完成，共修改 {rewritten} 处")
-            except Exception as e:
-                print(f"图片链接重写失败: {e}", file=sys.stderr)
-                error_urls.append(md_path)
-                continue
-            # 保存从改写成功的md文档,可以用来给webhook单独调试
-            new_md_paths.append(new_md_path)
-            webhook_resp = send_md_path_to_webhook(new_md_path, args.webhook, timeout=args.timeout)
-            if webhook_resp is not None:
-                print(f"Webhook 返回内容: {webhook_resp}")
-
-    succ_to_webhook_path = os.path.join(local_file_dir, timestamp, f"succ_check_img_pdfs_{timestamp}.txt")
-    with open(succ_to_webhook_path, "w") as f:
-        for pdf in new_md_paths:
-            f.write(pdf + "\n")
-
-    if error_urls:
-        print("失败 URL 列表:\n" + "\n".join(error_urls))
-    error_urls_path = os.path.join(local_file_dir, timestamp, f"error_urls_{timestamp}.txt")
-    with open(error_urls_path, "w") as f:
-        for pdf in error_urls:
-            f.write(pdf + "\n")
-    # 到这里结束
-    print(f"处理完成，共处理 {len(urls)} 个 URL，{len(error_urls)} 个 URL 处理失败")
-    
-    return 0
+]
+
+
+def _parse_args(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="通过 Confluence URL 导出 PDF 并转换为 Markdown",
+        epilog=(
+            "示例：python3 main_client.py --input urls.txt --shard 0/4；"
+            "只重写并发送已有 MD：python3 main_client.py --input succ_from_mineru_pdfs.txt --stages rewrite,webhook"
+        ),
+    )
+    parser.add_argument("--input", default=None, help="输入清单（每行一个 URL 或本地路径，# 开头为注释），- 表示标准输入；不指定时使用内置清单")
+    parser.add_argument("--shard", default=None, help="只处理第 i 个分片，格式 i/N（i 从 0 开始），按规范文档主键稳定哈希，多台机器可并行且互不重叠")
+    parser.add_argument(
+        "--stages",
+        default=None,
+        help=f"只运行这些阶段（逗号分隔，可选 {','.join(STAGE_NAMES)}）；之前的阶段需已在台账中完成，或输入本身就是 .pdf/.zip/.md",
+    )
+    parser.add_argument("--run-dir", default=None, help="本次运行的输出目录（清单、追踪、run.json），默认 <仓库>/<时间戳>[_shard<i>of<N>]")
+    parser.add_argument("--processor", default="mineru", help="处理器名称：mineru | hybrid（文本层页面直接抽取，仅复杂页走 MinerU）")
+    parser.add_argument("--server", default="http://10.58.11.60:7890/process/zip", help="处理服务 URL")
+    parser.add_argument("--pdf", default="/home/amlogic/RAG/debug_doc", help="可选：PDF 输出路径")
+    parser.add_argument("--out", default="output.zip", help="可选：ZIP 输出路径")
+    parser.add_argument("--timeout", type=int, default=6000, help="请求超时时间(秒)")
+    parser.add_argument("--docx-via-pdf", action="store_true", help="本地 docx 仍转 PDF 后走 MinerU（默认直接解析 docx，失败时才回退；也可设 MINERU_DOCX_DIRECT=0）")
+    parser.add_argument(
+        "--webhook",
+        # default="http://localhost:5678/webhook-test/0ccf68cf-97d7-4361-b3b5-3cdea3a244c7", #测试webhook
+        default="http://localhost:5678/webhook/0ccf68cf-97d7-4361-b3b5-3cdea3a244c7", #生产的webhook
+        help="可选：接收 MD 绝对路径的 webhook URL（置空则不发送）",
+    )
+    parser.add_argument("--webhook-timeout", type=int, default=600, help="单次 webhook 请求超时时间(秒)")
+    parser.add_argument("--webhook-in-flight", type=int, default=4, help="webhook 同时在途请求数上限")
+    parser.add_argument("--webhook-batch", type=int, default=1, help="每次 webhook 调用携带的 MD 路径数（>1 时 payload 为 {\"paths\": [...]}）")
+    parser.add_argument("--webhook-retries", type=int, default=4, help="webhook 可重试错误的最大重试次数")
+    parser.add_argument(
+        "--webhook-retry-queue",
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "webhook_retry_queue.jsonl"),
+        help="webhook 可重试错误（连接失败、超时、429/5xx）重试耗尽后写入的磁盘重试队列，启动时在后台重发其中的条目",
+    )
+    parser.add_argument(
+        "--webhook-dead-letter",
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "webhook_dead_letter.jsonl"),
+        help="webhook 不可重试的失败（4xx、payload 被拒）写入的死信文件，不会自动重发，需人工处理",
+    )
+    parser.add_argument("--trace", default=None, help="逐阶段追踪 JSONL 输出路径，默认写入本次运行目录的 trace_<时间戳>.jsonl；用 tracing.py summary 查看")
+    parser.add_argument("--pipeline", action="store_true", help="兼容旧参数：现在总是以分阶段重叠流水线方式处理")
+    parser.add_argument("--export-workers", type=int, default=2, help="流水线：导出阶段并发数")
+    parser.add_argument("--mineru-workers", type=int, default=1, help="流水线：上传并等待 MinerU 阶段并发数")
+    parser.add_argument("--webhook-workers", type=int, default=2, help="流水线：webhook 阶段并发数")
+    parser.add_argument("--queue-size", type=int, default=4, help="流水线：阶段间队列上限")
+    parser.add_argument("--chunk", choices=["csv", "jsonl"], default=None, help="流水线：重写后按标题切块并写出 <md>_chunks.<格式>")
+    parser.add_argument("--chunk-max-tokens", type=int, default=800, help="流水线：单块 token 预算")
+    parser.add_argument("--dedup-db", default=None, help="流水线：跨文档近重复章节索引（sqlite），需配合 --chunk")
+    parser.add_argument("--dedup-threshold", type=float, default=0.8, help="流水线：近重复相似度阈值")
+    parser.add_argument("--dedup-flag-only", action="store_true", help="流水线：只标注 duplicate_of，不丢弃重复块")
+    parser.add_argument("--store", default=None, help="流水线：把完成的文档（正文、元数据、块偏移、图片引用）追加到单文件语料库（sqlite）")
+    parser.add_argument("--webhook-send-chunks", action="store_true", help="流水线：webhook 发送块文件路径而不是整篇 MD 路径")
+    parser.add_argument(
+        "--ledger",
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "job_ledger.sqlite3"),
+        help="流水线：逐阶段作业台账（sqlite）路径，置空则不记账",
+    )
+    parser.add_argument("--resume", action="store_true", help="按台账续跑：沿用已完成的阶段（含后来新增阶段之后已完成的 sent 等），只重跑未完成的")
+    args = parser.parse_args(argv)
+    try:
+        args.shard_spec = parse_shard(args.shard) if args.shard else None
+    except ValueError as e:
+        parser.error(str(e))
+    args.stage_list = [s.strip() for s in args.stages.split(",") if s.strip()] if args.stages else None
+    if args.stage_list:
+        unknown = [s for s in args.stage_list if s not in STAGE_NAMES and s not in STAGE_ALIASES]
+        if unknown:
+            parser.error(f"未知阶段: {', '.join(unknown)}（可选 {','.join(STAGE_NAMES)}）")
+    return args
+
+
+def _build_webhook_dispatcher(args, ledger: Optional[JobLedger] = None) -> Optional[WebhookDispatcher]:
+    """
+    创建 webhook 发送器，并在后台重发上次残留在磁盘重试队列中的路径（积压再多也不阻塞本次运行）。
+
+    提供 ledger 时每次发送成功都把对应文档的 sent 阶段记为完成，重试队列重发成功的文档在 --resume 时不会再发一次。
+    """
+    if not args.webhook:
+        return None
+
+    def _on_result(result) -> None:
+        if ledger is None or not result.ok:
+            return
+        for doc_id in result.doc_ids:
+            if doc_id:
+                ledger.mark_done(doc_id, "sent")
+
+    dispatcher = WebhookDispatcher(
+        args.webhook,
+        max_in_flight=args.webhook_in_flight,
+        batch_size=args.webhook_batch,
+        timeout=args.webhook_timeout,
+        max_retries=args.webhook_retries,
+        retry_queue_path=args.webhook_retry_queue,
+        on_result=_on_result,
+        dead_letter_path=args.webhook_dead_letter,
+    )
+    dispatcher.start_replay()
+    return dispatcher
+
+
+def _select_inputs(args, inputs: Iterable[str]) -> Optional[list]:
+    """
+    流式规范化去重，并只保留本分片的文档。
+
+    分片模式下若有 /display/ URL 未能解析出 pageId，它的主键取决于本机能否访问 Confluence，
+    各机器会把同一文档分到不同分片（重复处理或漏处理），此时打印这些 URL 并返回 None。
+    """
+    total = 0
+
+    def _count(lines):
+        nonlocal total
+        for line in lines:
+            total += 1
+            yield line
+
+    canon = []
+    unresolved = []
+    for c in canonicalize_stream(_count(inputs)):
+        if args.shard_spec and c.unresolved:
+            unresolved.append(c)
+            continue
+        if args.shard_spec and shard_of(c.doc_id, args.shard_spec[1]) != args.shard_spec[0]:
+            continue
+        canon.append(c)
+    if unresolved:
+        print(f"分片模式下有 {len(unresolved)} 个 display URL 未能解析出 pageId，无法稳定分片，请检查 Confluence 访问"
+              f"或改用 pageId 形式的 URL:", file=sys.stderr)
+        for c in unresolved:
+            print(f"  {c.source}", file=sys.stderr)
+        return None
+    print_dedup_summary(total, canon)
+    if args.shard_spec:
+        print(f"分片 {args.shard_spec[0]}/{args.shard_spec[1]}：本机处理 {len(canon)} 个文档")
+    return canon
+
+
+def _run_pipeline_mode(args, urls: Iterable[str], run_dir: str, timestamp: str) -> int:
+    """流水线模式：各阶段重叠执行，结果写入 run_dir 下的 succ/error 清单；有文档失败或输入无法分片时返回非 0。"""
+    start = time.time()
+    # 先规范化去重：去掉 #fragment，各种写法统一到 pageId，本地文件按内容 hash 合并；再按主键分片
+    canon = _select_inputs(args, urls)
+    if canon is None:
+        return 2
+    ledger = JobLedger(args.ledger) if args.ledger else None
+    dispatcher = _build_webhook_dispatcher(args, ledger)
+    dedup_index = None
+    if args.dedup_db and args.chunk:
+        dedup_index = SectionDedupIndex(args.dedup_db, threshold=args.dedup_threshold)
+    corpus_store = CorpusStore(args.store) if args.store else None
+    webhook_workers = args.webhook_workers
+    if dispatcher is not None:
+        webhook_workers = max(webhook_workers, args.webhook_in_flight * args.webhook_batch)
+    stages = build_default_stages(
+        processor=args.processor,
+        server_url=args.server,
+        pdf_out=args.pdf,
+        md_out=args.out,
+        timeout=args.timeout,
+        webhook_url=args.webhook,
+        export_workers=args.export_workers,
+        mineru_workers=args.mineru_workers,
+        webhook_workers=webhook_workers,
+        queue_size=args.queue_size,
+        skip_existing=not args.resume,
+        webhook_dispatcher=dispatcher,
+        chunk_format=args.chunk,
+        chunk_max_tokens=args.chunk_max_tokens,
+        webhook_send_chunks=args.webhook_send_chunks,
+        dedup_index=dedup_index,
+        dedup_suppress=not args.dedup_flag_only,
+        only_stages=getattr(args, "stage_list", None),
+        corpus_store=corpus_store,
+        docx_direct=DOCX_DIRECT and not args.docx_via_pdf,
+    )
+    print(f"流水线阶段: {', '.join(f'{s.name}x{s.workers}' if s.enabled else f'{s.name}(未选择)' for s in stages)}")
+    with open(os.path.join(run_dir, f"inputs_{timestamp}.txt"), "w") as f:
+        for c in canon:
+            f.write(c.source + "\n")
+    sources = [c.source for c in canon]
+    doc_ids = [c.doc_id for c in canon]
+    try:
+        # 台账总是记录；只有 --resume（或用 --stages 只跑部分阶段）时才沿用已完成的阶段
+        jobs = run_pipeline(sources, stages, ledger=ledger, doc_ids=doc_ids,
+                            resume=args.resume or bool(args.stage_list))
+    finally:
+        # 先关发送器：在途批次的 on_result 仍要写台账
+        if dispatcher is not None:
+            dispatcher.close()
+        if ledger is not None:
+            ledger.close()
+        if dedup_index is not None:
+            rep = dedup_index.report()
+            print(
+                f"近重复章节：累计 {rep['duplicate_sections']} 个块，{rep['duplicate_tokens']} tokens"
+                f"（占 {rep['duplicate_token_ratio']:.1%}），其中跳过 {rep['suppressed_tokens']} tokens"
+            )
+            dedup_index.close()
+        if corpus_store is not None:
+            st = corpus_store.stats()
+            print(f"语料库 {args.store}: {st['documents']} 个文档，{st['chunks']} 个块，文件 {st['file_bytes']} 字节")
+            corpus_store.close()
+
+    succ_md = [j.md_path for j in jobs if j.status == "done"]
+    new_md_paths = [j.new_md_path for j in jobs if j.status == "done"]
+    error_urls = [j.source for j in jobs if j.status == "failed"]
+    for name, lines in (
+        (f"succ_from_mineru_pdfs_{timestamp}.txt", succ_md),
+        (f"succ_check_img_pdfs_{timestamp}.txt", new_md_paths),
+        (f"error_urls_{timestamp}.txt", error_urls),
+    ):
+        with open(os.path.join(run_dir, name), "w") as f:
+            for line in lines:
+                f.write(line + "\n")
+    for j in jobs:
+        if j.status == "failed":
+            print(f"失败 [{j.failed_stage}] {j.source}: {j.error}", file=sys.stderr)
+    skipped = sum(1 for j in jobs if j.status == "skipped")
+    print(
+        f"流水线处理完成，共 {len(jobs)} 个文档，成功 {len(succ_md)}，跳过 {skipped}，"
+        f"失败 {len(error_urls)}，耗时 {time.time() - start:.1f} 秒"
+    )
+    return 1 if error_urls else 0
+
+
+def main(argv=None) -> int:
+    args = _parse_args(argv or sys.argv[1:])
+    from datetime import datetime
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    local_file_dir = os.path.dirname(os.path.abspath(__file__))
+    suffix = f"_shard{args.shard_spec[0]}of{args.shard_spec[1]}" if args.shard_spec else ""
+    run_dir = args.run_dir or os.path.join(local_file_dir, timestamp + suffix)
+    os.makedirs(run_dir, exist_ok=True)
+    with open(os.path.join(run_dir, "run.json"), "w", encoding="utf-8") as f:
+        json.dump(
+            {"timestamp": timestamp, "host": socket.gethostname(), "argv": argv or sys.argv[1:],
+             "shard": args.shard, "stages": args.stage_list or "all"},
+            f, ensure_ascii=False, indent=1,
+        )
+    trace_path = args.trace or os.path.join(run_dir, f"trace_{timestamp}.jsonl")
+    configure_tracing(trace_path)
+    print(f"运行目录: {run_dir}")
+    print(f"追踪文件: {trace_path}（python tracing.py summary {trace_path}）")
+
+    inputs = iter_input_lines(args.input) if args.input else DEFAULT_INPUTS
+    return _run_pipeline_mode(args, inputs, run_dir, timestamp)
 
 
 if __name__ == "__main__":
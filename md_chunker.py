@@ -0,0 +1,314 @@
+import os
+import re
+import sys
+import csv
+import json
+from typing import Callable, Iterable, Iterator, List, Optional
+
+DEFAULT_MAX_TOKENS = 800
+
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+_FENCE_RE = re.compile(r"^\s*(```|~~~)")
+_IMAGE_RE = re.compile(r"!\[[^\]]*\]\(([^)\s]+)[^)]*\)")
+_CJK_RE = re.compile(r"[　-〿぀-ヿ㐀-䶿一-鿿가-힯＀-￯]")
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[。！？；.!?;])")
+# 拆分超长段落时不可切开的片段：图片、链接、裸 URL
+_ATOMIC_RE = re.compile(r"!?\[[^\]]*\]\([^)]*\)|https?://[^\s)\]>]+")
+_WORD_SPLIT_RE = re.compile(r"(?<=\s)(?=\S)")
+
+CHUNK_FIELDS = ["doc_id", "chunk_index", "section_path", "text", "images", "tokens", "duplicate_of"]
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：CJK 字符按 1 个计，其余按每 4 个字符 1 个计。"""
+    cjk = len(_CJK_RE.findall(text))
+    other = len(text) - cjk
+    return cjk + (other + 3) // 4
+
+
+def find_images(text: str) -> List[str]:
+    """返回 Markdown 文本中图片引用的地址（按出现顺序，可能重复）。"""
+    return _IMAGE_RE.findall(text)
+
+
+def iter_blocks(lines: Iterable[str]) -> Iterator[tuple]:
+    """
+    把 MinerU 输出的 Markdown 按块切分，逐块产出 (kind, payload)：
+
+    - ("heading", (level, title))
+    - ("code" | "table" | "math" | "para", text)
+
+    代码块、表格（Markdown 管道表格或 MinerU 的 <table> HTML）与 $$ 公式块整体作为一块，不会被拆开。
+    """
+    buf: List[str] = []
+    kind = None
+    fence = None
+
+    def _flush():
+        nonlocal buf, kind
+        if buf:
+            text = "".join(buf).strip("\n")
+            if text.strip():
+                yield kind or "para", text
+        buf, kind = [], None
+
+    for line in lines:
+        stripped = line.strip()
+        if kind == "code":
+            buf.append(line)
+            if stripped.startswith(fence):
+                yield from _flush()
+            continue
+        if kind == "math":
+            buf.append(line)
+            if stripped.endswith("$$"):
+                yield from _flush()
+            continue
+        if kind == "html_table":
+            buf.append(line)
+            if "</table>" in line.lower():
+                kind = "table"
+                yield from _flush()
+            continue
+
+        m = _FENCE_RE.match(line)
+        if m:
+            yield from _flush()
+            kind, fence, buf = "code", m.group(1), [line]
+            continue
+        if stripped == "$$" or (stripped.startswith("$$") and not (len(stripped) > 2 and stripped.endswith("$$"))):
+            yield from _flush()
+            kind, buf = "math", [line]
+            continue
+        if stripped.lower().startswith("<table"):
+            yield from _flush()
+            buf = [line]
+            if "</table>" in line.lower():
+                kind = "table"
+                yield from _flush()
+            else:
+                kind = "html_table"
+            continue
+        if stripped.startswith("|"):
+            if kind != "table":
+                yield from _flush()
+                kind = "table"
+            buf.append(line)
+            continue
+        if kind == "table":
+            yield from _flush()
+
+        h = _HEADING_RE.match(line)
+        if h:
+            yield from _flush()
+            yield "heading", (len(h.group(1)), h.group(2).strip())
+            continue
+        if not stripped:
+            yield from _flush()
+            continue
+        kind = "para"
+        buf.append(line)
+    yield from _flush()
+
+
+def _hard_split(text: str, max_tokens: int) -> List[str]:
+    """没有空白可切的长串（如整段中文）按字符累计到预算为止。"""
+    parts, cur = [], ""
+    for ch in text:
+        if cur and estimate_tokens(cur + ch) > max_tokens:
+            parts.append(cur)
+            cur = ""
+        cur += ch
+    if cur:
+        parts.append(cur)
+    return parts
+
+
+def _split_units(text: str, max_tokens: int) -> List[str]:
+    """
+    把段落拆成可以自由组合的最小单元，单元首尾相接即为原文。
+
+    图片、链接、裸 URL 整体作为一个单元（单独超预算也不拆）；其余文字先按句子切，
+    仍超预算的句子按空白切，仍超预算的词按字符切。
+    """
+    units = []
+
+    def _plain(segment: str) -> None:
+        for sent in _SENTENCE_SPLIT_RE.split(segment):
+            if not sent:
+                continue
+            if estimate_tokens(sent) <= max_tokens:
+                units.append(sent)
+                continue
+            for word in _WORD_SPLIT_RE.split(sent):
+                if estimate_tokens(word) <= max_tokens:
+                    units.append(word)
+                else:
+                    units.extend(_hard_split(word, max_tokens))
+
+    pos = 0
+    for m in _ATOMIC_RE.finditer(text):
+        _plain(text[pos:m.start()])
+        units.append(m.group(0))
+        pos = m.end()
+    _plain(text[pos:])
+    return units
+
+
+def _split_oversized(text: str, max_tokens: int) -> List[str]:
+    """把超出预算的普通段落切成不超过预算的片段（代码、表格、公式不走这里），不切开图片与链接。"""
+    parts, cur = [], ""
+    for unit in _split_units(text, max_tokens):
+        if cur.strip() and estimate_tokens(cur + unit) > max_tokens:
+            parts.append(cur.strip())
+            cur = ""
+        cur += unit
+    if cur.strip():
+        parts.append(cur.strip())
+    return parts
+
+
+def chunk_markdown(lines: Iterable[str], doc_id: str, max_tokens: int = DEFAULT_MAX_TOKENS) -> Iterator[dict]:
+    """
+    流式按标题边界切分 Markdown，逐个产出块（dict，字段见 CHUNK_FIELDS）。
+
+    - 遇到标题即结束当前块，section_path 为 "一级 > 二级 > …" 标题路径
+    - 同一节内按 max_tokens 预算合并段落；代码块、表格、公式保持完整，单块超预算时独占一个块
+    - 图片链接保留在正文中，并单独列在 images 字段
+    """
+    path: List[tuple] = []
+    parts: List[str] = []
+    tokens = 0
+    index = 0
+
+    def _emit():
+        nonlocal parts, tokens, index
+        if not parts:
+            return None
+        text = "\n\n".join(parts)
+        row = {
+            "doc_id": doc_id,
+            "chunk_index": index,
+            "section_path": " > ".join(t for _, t in path),
+            "text": text,
+            "images": find_images(text),
+            "tokens": tokens,
+        }
+        index += 1
+        parts, tokens = [], 0
+        return row
+
+    for kind, payload in iter_blocks(lines):
+        if kind == "heading":
+            row = _emit()
+            if row:
+                yield row
+            level, title = payload
+            while path and path[-1][0] >= level:
+                path.pop()
+            path.append((level, title))
+            continue
+        pieces = [payload]
+        if kind == "para" and estimate_tokens(payload) > max_tokens:
+            pieces = _split_oversized(payload, max_tokens)
+        for piece in pieces:
+            n = estimate_tokens(piece)
+            if parts and tokens + n > max_tokens:
+                row = _emit()
+                if row:
+                    yield row
+            parts.append(piece)
+            tokens += n
+    row = _emit()
+    if row:
+        yield row
+
+
+class ChunkWriter:
+    """增量写出块行：.csv 写表头一次后逐行追加，其它扩展名按 JSONL 写出。"""
+
+    def __init__(self, path: str, append: bool = False):
+        self.path = path
+        self.fmt = "csv" if path.lower().endswith(".csv") else "jsonl"
+        d = os.path.dirname(os.path.abspath(path))
+        os.makedirs(d, exist_ok=True)
+        need_header = not (append and os.path.isfile(path) and os.path.getsize(path) > 0)
+        self._f = open(path, "a" if append else "w", encoding="utf-8", newline="")
+        self._csv = None
+        if self.fmt == "csv":
+            self._csv = csv.DictWriter(self._f, fieldnames=CHUNK_FIELDS)
+            if need_header:
+                self._csv.writeheader()
+        self.count = 0
+
+    def write(self, row: dict) -> None:
+        if self._csv is not None:
+            out = dict(row)
+            out["images"] = json.dumps(row["images"], ensure_ascii=False)
+            self._csv.writerow(out)
+        else:
+            self._f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self.count += 1
+
+    def close(self) -> None:
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def chunk_md_file(md_path: str, doc_id: Optional[str] = None, out_path: Optional[str] = None,
+                  max_tokens: int = DEFAULT_MAX_TOKENS, fmt: str = "jsonl",
+                  row_filter: Optional[Callable[[Iterable[dict]], Iterable[dict]]] = None) -> tuple:
+    """
+    切分单个 MD 文件并写到 out_path（默认与 MD 同目录的 <name>_chunks.<fmt>）。
+
+    row_filter 可对块流做过滤/标注（如 section_dedup.SectionDedupIndex.filter_chunks）。
+    先写临时文件再 os.replace，返回 (块数量, 输出路径)。
+    """
+    if not os.path.isfile(md_path):
+        raise FileNotFoundError(f"MD 文件不存在: {md_path}")
+    if out_path is None:
+        stem = os.path.splitext(md_path)[0]
+        out_path = f"{stem}_chunks.{fmt}"
+    tmp = f"{out_path}.tmp{os.getpid()}"
+    if fmt == "csv" and not tmp.endswith(".csv"):
+        tmp += ".csv"
+    with open(md_path, "r", encoding="utf-8") as f, ChunkWriter(tmp) as writer:
+        rows = chunk_markdown(f, doc_id or os.path.abspath(md_path), max_tokens=max_tokens)
+        if row_filter is not None:
+            rows = row_filter(rows)
+        for row in rows:
+            writer.write(row)
+    os.replace(tmp, out_path)
+    return writer.count, out_path
+
+
+def _parse_args(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="按标题切分 MinerU Markdown 为 QA 可用的块（CSV / JSONL）")
+    parser.add_argument("md", nargs="+", help="待切分的 MD 文件")
+    parser.add_argument("--out", required=True, help="输出文件，.csv 或 .jsonl；多个 MD 追加写入同一文件")
+    parser.add_argument("--max-tokens", type=int, default=DEFAULT_MAX_TOKENS, help="单块 token 预算")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = _parse_args(argv or sys.argv[1:])
+    total = 0
+    with ChunkWriter(args.out) as writer:
+        for md in args.md:
+            with open(md, "r", encoding="utf-8") as f:
+                for row in chunk_markdown(f, os.path.abspath(md), max_tokens=args.max_tokens):
+                    writer.write(row)
+                    total += 1
+    print(f"切分完成，共 {len(args.md)} 个文档，{total} 个块: {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -3,10 +3,12 @@ import re
 import requests
 from requests.auth import HTTPBasicAuth
 from urllib.parse import urlparse, parse_qs, unquote
+
+from tracing import traced, file_size
 CONFLUENCE_USER = "nan.li"
 CONFLUENCE_PASS = "**.deng110110"
 # 配置 Confluence 访问信息
-CONFLUENCE_BASE_URL = "https://confluence.amlogic.com"
+CONFLUENCE_BASE_URL = os.environ.get("CONFLUENCE_BASE_URL", "https://confluence.amlogic.com")  # 基准测试时指向本地桩服务
 CONFLUENCE_USERNAME = CONFLUENCE_USER  # 建议通过环境变量传递用户名
 CONFLUENCE_PASSWORD = CONFLUENCE_PASS  # 建议通过环境变量传递密码
 
@@ -248,6 +250,7 @@ def export_confluence_page_to_word_by_url(page_url: str, out_file: str | None =
     default_name = _safe_filename(title) + '.doc'
     return export_confluence_page_to_word(page_id, out_file or default_name)
 
+@traced("export_confluence_page_to_pdf_by_url", bytes_of=file_size)
 def export_confluence_page_to_pdf_by_url(page_url: str, out_file: str | None = None) -> str:
     """
     通过页面 URL 导出为 PDF。
@@ -0,0 +1,433 @@
+import os
+import sys
+import time
+import queue
+import threading
+import traceback
+from typing import Callable, List, Optional, Tuple
+
+from download_minueru import (
+    export_source_to_pdf,
+    pdf_to_zip,
+    MineruZipReader,
+    DOCX_DIRECT,
+    SkipProcessing,
+    rewrite_md_images_to_http,
+    zip_to_rewritten_md,
+)
+from send_to_n8n_webhook import send_md_path_to_webhook, WebhookDispatcher
+from job_ledger import JobLedger, canonical_doc_id
+from tracing import span, trace_document
+from md_chunker import chunk_md_file, DEFAULT_MAX_TOKENS
+from section_dedup import SectionDedupIndex
+from corpus_store import CorpusStore
+from process_client import new_request_id
+
+# 队列结束标记
+_STOP = object()
+
+
+class DocumentJob:
+    """流水线中流转的单个文档，各阶段把产出写回对应字段。"""
+
+    def __init__(self, source: str, index: int = 0, doc_id: Optional[str] = None):
+        self.source = source
+        self.index = index
+        self.doc_id = doc_id or canonical_doc_id(source)
+        # 关联 ID：随处理服务请求与 webhook 发出，服务端日志和 n8n 执行记录可按它对上同一文档
+        self.request_id = new_request_id()
+        self.pdf_path = ""
+        self.zip_path = ""
+        self.md_path = ""
+        self.new_md_path = ""
+        self.chunks_path = ""
+        self.chunk_count = 0
+        self.rewritten = 0
+        self.status = "pending"  # pending | done | skipped | failed
+        self.failed_stage = ""
+        self.error = ""
+        self.stage_times = {}  # 阶段名 -> (开始时间, 结束时间)
+        self.done_states = set()  # 台账中已完成的阶段状态，流经这些阶段时直接放行
+
+    def __repr__(self):
+        return f"DocumentJob({self.source!r}, status={self.status!r})"
+
+
+class Stage:
+    """
+    流水线阶段。
+
+    :param name: 阶段名
+    :param func: 处理函数 func(job)，就地修改 job；抛出 SkipProcessing 表示跳过，其它异常表示失败
+    :param workers: 该阶段并发线程数
+    :param queue_size: 该阶段输入队列上限（背压：下游处理不过来时上游会阻塞）
+    :param state: 该阶段完成后在台账中记录的状态名，默认同 name
+    :param output_attr: 该阶段产物保存在 DocumentJob 上的字段名，用于写入台账及 --resume 时恢复
+    :param bypass: bypass(job) 返回 True 表示输入本身已是该阶段之后的产物（如直接给出 .md），不执行也不记账
+    :param enabled: False 表示本次运行未选择该阶段：只放行台账中已完成或可 bypass 的文档，其余标记跳过
+    :param extra_states: 该阶段完成时在台账中一并记为完成的其他状态（多个旧阶段合并为一个时保留原有状态名）
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[DocumentJob], None],
+        workers: int = 1,
+        queue_size: int = 4,
+        state: Optional[str] = None,
+        output_attr: Optional[str] = None,
+        bypass: Optional[Callable[[DocumentJob], bool]] = None,
+        enabled: bool = True,
+        extra_states: Tuple[str, ...] = (),
+    ):
+        if workers < 1:
+            raise ValueError(f"阶段 {name} 的 workers 必须 >= 1")
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.queue_size = max(1, queue_size)
+        self.state = state or name
+        self.output_attr = output_attr
+        self.bypass = bypass
+        self.enabled = enabled
+        self.extra_states = tuple(extra_states)
+
+
+class Pipeline:
+    """
+    分阶段、可重叠执行的流水线：每个阶段有自己的线程数，阶段之间是有界队列。
+
+    文档 N+1 导出时，文档 N 可以在 GPU 上处理，文档 N-1 在发送 webhook，
+    总耗时趋近于最慢阶段的耗时而不是各阶段之和。
+    """
+
+    def __init__(
+        self,
+        stages: List[Stage],
+        on_finish: Optional[Callable[[DocumentJob], None]] = None,
+        ledger: Optional[JobLedger] = None,
+        resume: bool = True,
+    ):
+        if not stages:
+            raise ValueError("流水线至少需要一个阶段")
+        self.stages = stages
+        self.on_finish = on_finish
+        self.ledger = ledger
+        self.resume = resume
+        self._results: List[DocumentJob] = []
+        self._lock = threading.Lock()
+
+    def _finish(self, job: DocumentJob) -> None:
+        with self._lock:
+            self._results.append(job)
+        if self.on_finish is not None:
+            try:
+                self.on_finish(job)
+            except Exception as e:
+                print(f"on_finish 回调异常: {e}", file=sys.stderr)
+
+    def _run_stage(self, idx: int, in_q: queue.Queue, out_q: Optional[queue.Queue], remaining: list) -> None:
+        stage = self.stages[idx]
+        try:
+            while True:
+                job = in_q.get()
+                if job is _STOP:
+                    break
+                try:
+                    self._process(stage, job)
+                except Exception as e:
+                    # 台账写入（如 sqlite database is locked）、bypass 等出错：该文档记为失败并照常交出，不让线程退出
+                    job.status = "failed"
+                    job.failed_stage = stage.name
+                    job.error = f"{type(e).__name__}: {e}"
+                    print(f"[{stage.name}] 处理失败 {job.source} [{job.request_id}]: {job.error}", file=sys.stderr)
+                    traceback.print_exc()
+                    if self.ledger is not None:
+                        try:
+                            self.ledger.fail(job.doc_id, stage.state, job.error)
+                        except Exception as le:
+                            print(f"[{stage.name}] 台账记录失败 {job.doc_id}: {le}", file=sys.stderr)
+                self._forward(job, out_q)
+        finally:
+            # 本阶段最后一个退出的线程负责通知下游结束；放在 finally 中，线程意外退出也不会让 run() 卡住
+            with self._lock:
+                remaining[idx] -= 1
+                last = remaining[idx] == 0
+            if last and out_q is not None:
+                for _ in range(self.stages[idx + 1].workers):
+                    out_q.put(_STOP)
+
+    def _process(self, stage: Stage, job: DocumentJob) -> None:
+        """在单个文档上执行一个阶段（含台账记录）；阶段函数本身的异常记入 job，其余异常抛给调用方。"""
+        if stage.state in job.done_states:
+            # 台账显示该阶段已完成，产物已在入队前恢复，直接交给下游
+            return
+        if stage.bypass is not None and stage.bypass(job):
+            return
+        if not stage.enabled:
+            job.status = "skipped"
+            job.error = f"未选择阶段 {stage.name}，且台账中没有它的产物"
+            return
+        start = time.time()
+        if self.ledger is not None:
+            self.ledger.start(job.doc_id, stage.state)
+        try:
+            with trace_document(job.doc_id), span(f"stage.{stage.name}", request_id=job.request_id):
+                stage.func(job)
+        except SkipProcessing as e:
+            job.status = "skipped"
+            job.error = str(e)
+        except Exception as e:
+            job.status = "failed"
+            job.failed_stage = stage.name
+            job.error = f"{type(e).__name__}: {e}"
+            print(f"[{stage.name}] 处理失败 {job.source} [{job.request_id}]: {job.error}", file=sys.stderr)
+            traceback.print_exc()
+        job.stage_times[stage.name] = (start, time.time())
+        if self.ledger is not None:
+            if job.status == "failed":
+                self.ledger.fail(job.doc_id, stage.state, job.error)
+            elif job.status == "skipped":
+                self.ledger.skip(job.doc_id, stage.state, job.error)
+            else:
+                out = getattr(job, stage.output_attr) if stage.output_attr else None
+                self.ledger.complete(job.doc_id, stage.state, output_path=out or None)
+                for state in stage.extra_states:
+                    self.ledger.mark_done(job.doc_id, state)
+
+    def _forward(self, job: DocumentJob, out_q: Optional[queue.Queue]) -> None:
+        if job.status in ("skipped", "failed") or out_q is None:
+            if job.status == "pending":
+                job.status = "done"
+            self._finish(job)
+        else:
+            out_q.put(job)
+
+    def _restore_from_ledger(self, job: DocumentJob) -> None:
+        """登记文档；resume 时恢复台账中可沿用的已完成阶段及其产物路径（规则见 JobLedger.resume_point）。"""
+        self.ledger.register(job.doc_id, job.source)
+        if not self.resume:
+            return
+        done = self.ledger.resume_point(job.doc_id, [s.state for s in self.stages])
+        for stage in self.stages:
+            if stage.state not in done:
+                continue
+            job.done_states.add(stage.state)
+            if stage.output_attr and done[stage.state]:
+                setattr(job, stage.output_attr, done[stage.state])
+
+    def run(self, jobs: List[DocumentJob]) -> List[DocumentJob]:
+        """运行流水线直到所有文档完成，返回按输入顺序排列的结果。"""
+        self._results = []
+        if self.ledger is not None:
+            for job in jobs:
+                self._restore_from_ledger(job)
+        queues = [queue.Queue(maxsize=s.queue_size) for s in self.stages]
+        remaining = [s.workers for s in self.stages]
+        threads = []
+        for idx, stage in enumerate(self.stages):
+            out_q = queues[idx + 1] if idx + 1 < len(self.stages) else None
+            for n in range(stage.workers):
+                t = threading.Thread(
+                    target=self._run_stage,
+                    args=(idx, queues[idx], out_q, remaining),
+                    name=f"pipeline-{stage.name}-{n}",
+                    daemon=True,
+                )
+                t.start()
+                threads.append(t)
+
+        for job in jobs:
+            queues[0].put(job)
+        for _ in range(self.stages[0].workers):
+            queues[0].put(_STOP)
+        for t in threads:
+            t.join()
+        return sorted(self._results, key=lambda j: j.index)
+
+
+# 默认阶段名（--stages 可选值），按执行顺序
+STAGE_NAMES = ("export", "mineru", "rewrite", "chunk", "store", "webhook")
+# 已合并阶段的旧名称，--stages 中仍可使用
+STAGE_ALIASES = {"extract": "rewrite"}
+
+
+def select_stages(stages: List[Stage], names: Optional[List[str]]) -> List[Stage]:
+    """
+    只运行 names 中的阶段：最后一个选中阶段之后的阶段直接去掉，之前未选中的阶段置为 enabled=False
+    （文档需已在台账中完成这些阶段，或输入本身就是后续阶段的产物）。
+
+    :raises ValueError: 阶段名未知或当前配置中不存在（如未开启 --chunk 却选择 chunk）
+    """
+    if not names:
+        return stages
+    names = [STAGE_ALIASES.get(n, n) for n in names]
+    available = [s.name for s in stages]
+    unknown = [n for n in names if n not in available]
+    if unknown:
+        raise ValueError(f"阶段 {', '.join(unknown)} 不存在，当前可用: {', '.join(available)}")
+    last = max(available.index(n) for n in names)
+    selected = stages[: last + 1]
+    for s in selected:
+        s.enabled = s.name in names
+    return selected
+
+
+def _local_input(job: DocumentJob, exts) -> bool:
+    return job.source.lower().endswith(exts) and os.path.isfile(job.source)
+
+
+def build_default_stages(
+    processor: str = "mineru",
+    server_url: str = "http://10.58.11.60:7890/process/zip",
+    pdf_out: Optional[str] = None,
+    md_out: Optional[str] = None,
+    timeout: int = 6000,
+    webhook_url: Optional[str] = None,
+    webhook_timeout: Optional[int] = None,
+    base_host: str = "http://10.18.11.98:8081",
+    workspace_root: str = "/home/amlogic",
+    export_workers: int = 2,
+    mineru_workers: int = 1,
+    extract_workers: int = 2,
+    rewrite_workers: int = 2,
+    webhook_workers: int = 2,
+    queue_size: int = 4,
+    skip_existing: bool = True,
+    webhook_dispatcher: Optional[WebhookDispatcher] = None,
+    chunk_format: Optional[str] = None,
+    chunk_max_tokens: int = DEFAULT_MAX_TOKENS,
+    chunk_workers: int = 2,
+    webhook_send_chunks: bool = False,
+    dedup_index: Optional[SectionDedupIndex] = None,
+    dedup_suppress: bool = True,
+    only_stages: Optional[List[str]] = None,
+    corpus_store: Optional[CorpusStore] = None,
+    docx_direct: bool = DOCX_DIRECT,
+) -> List[Stage]:
+    """按 url_to_zip → zip_to_rewritten_md → send_md_path_to_webhook 组装默认阶段。
+
+    rewrite 阶段直接从结果 ZIP 流式读取主 MD 并重写图片链接，只写出 MD 与图片，不整体解压；
+    台账中仍记录 extracted 与 rewritten 两个状态。输入为本地 .md 时直接重写该文件。
+
+    提供 webhook_dispatcher 时 webhook 阶段交给它发送（在途窗口、批量、退避重试、磁盘重试队列），
+    此时 webhook_workers 应不小于 在途窗口 × 批大小，才能攒满批次。
+
+    chunk_format 为 "csv" / "jsonl" 时在重写之后增加按标题切块阶段（md_chunker），
+    webhook_send_chunks 为 True 时 webhook 发送块文件路径而不是整篇 MD 路径。
+    提供 dedup_index 时切块结果先经过跨文档近重复检测，重复块被丢弃（dedup_suppress）或标注 duplicate_of。
+    提供 corpus_store 时在 webhook 之前把正文、元数据、块偏移与图片引用写入单文件语料库。
+    only_stages 为要运行的阶段名（见 STAGE_NAMES 与 select_stages）；输入可以直接是本地 .pdf/.zip/.md，
+    此时之前的阶段自动放行。
+    docx_direct 为 True 时本地 .docx 不转 PDF，mineru 阶段直接解析为 Markdown（失败时回退为转 PDF 上传）。
+    """
+    skip_export = bool(only_stages) and "export" not in only_stages
+
+    def _bypass_export(job: DocumentJob) -> bool:
+        # 未选择导出阶段时，本地 PDF 直接作为导出结果
+        if skip_export and _local_input(job, (".pdf", ".docx") if docx_direct else (".pdf",)):
+            job.pdf_path = job.source
+            return True
+        return _local_input(job, (".zip", ".md"))
+
+    def _bypass_mineru(job: DocumentJob) -> bool:
+        if _local_input(job, (".zip",)):
+            job.zip_path = job.source
+            return True
+        return _local_input(job, (".md",))
+
+
+    def _export(job: DocumentJob) -> None:
+        job.pdf_path = export_source_to_pdf(job.source, pdf_out, keep_docx=docx_direct)
+
+    def _mineru(job: DocumentJob) -> None:
+        job.zip_path = pdf_to_zip(
+            job.pdf_path,
+            processor=processor,
+            server_url=server_url,
+            md_out=md_out,
+            timeout=timeout,
+            skip_existing=skip_existing,
+            request_id=job.request_id,
+        )
+
+    def _rewrite(job: DocumentJob) -> None:
+        if not job.zip_path and _local_input(job, (".md",)):
+            job.md_path = job.source
+            job.rewritten, job.new_md_path = rewrite_md_images_to_http(
+                job.md_path, base_host=base_host, workspace_root=workspace_root
+            )
+            return
+        extract_dir = os.path.join(os.path.dirname(job.zip_path), "extracted")
+        with MineruZipReader(job.zip_path) as reader:
+            job.md_path = reader.md_path_in(extract_dir)
+        job.rewritten, job.new_md_path = zip_to_rewritten_md(
+            job.zip_path, extract_dir, base_host=base_host, workspace_root=workspace_root
+        )
+
+    def _filter_duplicates(rows):
+        return dedup_index.filter_chunks(rows, suppress=dedup_suppress)
+
+    def _chunk(job: DocumentJob) -> None:
+        if dedup_index is not None:
+            dedup_index.remove_doc(job.doc_id)
+        row_filter = _filter_duplicates if dedup_index is not None else None
+        job.chunk_count, job.chunks_path = chunk_md_file(
+            job.new_md_path, doc_id=job.doc_id, max_tokens=chunk_max_tokens, fmt=chunk_format, row_filter=row_filter
+        )
+
+    def _store(job: DocumentJob) -> None:
+        corpus_store.put_document(
+            job.doc_id,
+            job.source,
+            job.new_md_path,
+            chunks_path=job.chunks_path or None,
+            image_dir=os.path.join(os.path.dirname(job.new_md_path), "images"),
+            meta={"pdf_path": job.pdf_path, "zip_path": job.zip_path, "md_path": job.md_path,
+                  "rewritten_images": job.rewritten},
+            max_tokens=chunk_max_tokens,
+        )
+
+    def _webhook(job: DocumentJob) -> None:
+        path = job.chunks_path if (webhook_send_chunks and job.chunks_path) else job.new_md_path
+        if webhook_dispatcher is not None:
+            result = webhook_dispatcher.submit(path, request_id=job.request_id, doc_id=job.doc_id).result()
+            if not result.ok:
+                suffix = "（已写入重试队列）" if result.queued else "（已写入死信文件）" if result.dead_lettered else ""
+                raise RuntimeError(f"webhook 发送失败{suffix}: {result.error}")
+            return
+        if not send_md_path_to_webhook(path, webhook_url, timeout=webhook_timeout or timeout, request_id=job.request_id):
+            raise RuntimeError("webhook 发送失败")
+
+    stages = [
+        Stage("export", _export, export_workers, queue_size, state="exported", output_attr="pdf_path",
+              bypass=_bypass_export),
+        Stage("mineru", _mineru, mineru_workers, queue_size, state="processed", output_attr="zip_path",
+              bypass=_bypass_mineru),
+        Stage("rewrite", _rewrite, max(extract_workers, rewrite_workers), queue_size, state="rewritten",
+              output_attr="new_md_path", extra_states=("extracted",)),
+    ]
+    if chunk_format:
+        stages.append(Stage("chunk", _chunk, chunk_workers, queue_size, state="chunked", output_attr="chunks_path"))
+    if corpus_store is not None:
+        stages.append(Stage("store", _store, 1, queue_size, state="stored"))
+    if webhook_url or webhook_dispatcher is not None:
+        stages.append(Stage("webhook", _webhook, webhook_workers, queue_size, state="sent"))
+    return select_stages(stages, only_stages)
+
+
+def run_pipeline(
+    sources: List[str],
+    stages: List[Stage],
+    on_finish=None,
+    ledger: Optional[JobLedger] = None,
+    doc_ids: Optional[List[str]] = None,
+    resume: bool = True,
+) -> List[DocumentJob]:
+    """对一组 URL / 本地路径运行流水线；提供 ledger 时逐阶段记账，resume=True 时沿用台账中已完成的阶段。
+
+    doc_ids 为 url_canon.canonicalize_inputs 得到的规范主键，不提供时逐条离线规范化。
+    """
+    doc_ids = doc_ids or [None] * len(sources)
+    jobs = [DocumentJob(src, i, doc_id) for i, (src, doc_id) in enumerate(zip(sources, doc_ids))]
+    return Pipeline(stages, on_finish=on_finish, ledger=ledger, resume=resume).run(jobs)
@@ -1,8 +1,13 @@
 import os
 import sys
+import uuid
+import hashlib
 from typing import Optional
+from urllib.parse import urlsplit, urlunsplit
 import time
 
+from tracing import traced, file_size
+
 try:
     import requests
 except ImportError as e:
@@ -10,22 +15,131 @@ except ImportError as e:
     raise
 
 
+# 本进程内已确认服务端存在的内容哈希，避免每个请求都先 HEAD 一次
+_KNOWN_BLOBS = set()
+# 服务端按 API key（或 X-Client-Id）区分客户端做公平调度；未设置时按来源 IP 归组
+API_KEY = os.environ.get("MINERU_API_KEY", "")
+CLIENT_ID = os.environ.get("MINERU_CLIENT_ID", "")
+# 关联 ID 请求头：服务端每行日志都带上它，并原样回传；pipeline 再把它转给 n8n
+REQUEST_ID_HEADER = "X-Request-ID"
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+def _parse_server_timing(header: str) -> dict:
+    """解析 Server-Timing 响应头中的 name;dur=毫秒 项。"""
+    out = {}
+    for item in (header or "").split(","):
+        parts = [p.strip() for p in item.split(";")]
+        for p in parts[1:]:
+            if parts[0] and p.startswith("dur="):
+                try:
+                    out[parts[0]] = float(p[4:])
+                except ValueError:
+                    pass
+    return out
+
+
+def _format_server_timing(timings: dict) -> str:
+    return " ".join(f"{name}={dur / 1000:.2f}s" for name, dur in timings.items())
+
+
+def _client_headers(request_id: Optional[str] = None) -> dict:
+    headers = {}
+    if request_id:
+        headers[REQUEST_ID_HEADER] = request_id
+    if API_KEY:
+        headers["X-API-Key"] = API_KEY
+    if CLIENT_ID:
+        headers["X-Client-Id"] = CLIENT_ID
+    return headers
+
+
+def _file_sha256(file_path: str) -> str:
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _blob_url(server_url: str, sha256: str) -> str:
+    parts = urlsplit(server_url)
+    return urlunsplit((parts.scheme, parts.netloc, f"/blobs/{sha256}", "", ""))
+
+
+def _ensure_blob(file_path: str, server_url: str, timeout: int, request_id: Optional[str] = None) -> Optional[str]:
+    """
+    哈希优先上传：先 HEAD /blobs/{sha256} 询问服务端是否已有该内容，没有时上传一次。
+
+    :return: 服务端已持有的 sha256；服务端不支持 /blobs（旧版本）时返回 None，调用方回退为直接上传
+    """
+    sha256 = _file_sha256(file_path)
+    if sha256 in _KNOWN_BLOBS:
+        return sha256
+    url = _blob_url(server_url, sha256)
+    head = requests.head(url, headers=_client_headers(request_id), timeout=timeout)
+    if head.status_code == 200:
+        _KNOWN_BLOBS.add(sha256)
+        return sha256
+    if head.status_code != 404:
+        return None
+    with open(file_path, "rb") as f:
+        resp = requests.post(
+            url, files={"file": (os.path.basename(file_path), f)}, headers=_client_headers(request_id),
+            timeout=timeout,
+        )
+    if resp.status_code in (404, 405):
+        return None
+    resp.raise_for_status()
+    _KNOWN_BLOBS.add(sha256)
+    return sha256
+
+
+@traced("process_document", bytes_of=file_size)
 def process_document(
     file_path: str,
     processor: str = "mineru",
     server_url: str = "http://10.58.11.60:7890/process/zip",
     output_path: Optional[str] = "output.zip",
     timeout: int = 120,
+    hash_first: bool = True,
+    request_id: Optional[str] = None,
 ) -> str:
+    """
+    提交文件到处理服务并保存返回的 ZIP。
+
+    :param hash_first: 先按内容哈希询问服务端，已有相同内容时不再上传文件本体
+    :param request_id: 关联 ID，以 X-Request-ID 发送，服务端日志中可按它检索；缺省时生成
+    """
     start_time = time.time()
+    request_id = request_id or new_request_id()
     if not os.path.isfile(file_path):
         raise FileNotFoundError(f"文件不存在: {file_path}")
 
-    with open(file_path, "rb") as f:
-        files = {"file": (os.path.basename(file_path), f)}
-        data = {"processor": processor}
-        resp = requests.post(server_url, files=files, data=data, timeout=timeout)
-        resp.raise_for_status()
+    # timeout 同时作为服务端作业截止时间，客户端放弃后服务端不再继续占用 GPU
+    data = {"processor": processor, "timeout": str(timeout)}
+    sha256 = _ensure_blob(file_path, server_url, timeout, request_id) if hash_first else None
+    resp = None
+    if sha256:
+        resp = requests.post(
+            server_url, data={**data, "sha256": sha256, "filename": os.path.basename(file_path)},
+            headers=_client_headers(request_id), timeout=timeout,
+        )
+        if resp.status_code == 404:
+            # 服务端已清理该内容（或缓存的哈希来自已重建的服务端）：忘掉缓存，直接上传文件
+            _KNOWN_BLOBS.discard(sha256)
+            print(f"服务端已没有内容 {sha256}，改为直接上传 [{request_id}]", file=sys.stderr)
+            resp = None
+    if resp is None:
+        with open(file_path, "rb") as f:
+            files = {"file": (os.path.basename(file_path), f)}
+            resp = requests.post(server_url, files=files, data=data, headers=_client_headers(request_id), timeout=timeout)
+    if not resp.ok:
+        print(f"处理服务返回 {resp.status_code} [{request_id}]", file=sys.stderr)
+    resp.raise_for_status()
 
     # 解析返回文件名（如有）
     cd = resp.headers.get("Content-Disposition", "")
@@ -46,7 +160,10 @@ def process_document(
         out.write(resp.content)
     
     end_time = time.time()
-    print(f"minueru 处理完成，耗时: {end_time - start_time} 秒")
+    print(f"minueru 处理完成 [{request_id}]，耗时: {end_time - start_time} 秒")
+    timings = _parse_server_timing(resp.headers.get("Server-Timing", ""))
+    if timings:
+        print(f"服务端耗时 [{request_id}]: {_format_server_timing(timings)}")
     return target_path
 
 
@@ -55,7 +172,7 @@ def _parse_args(argv):
 
     parser = argparse.ArgumentParser(description="上传文件到处理服务并保存 ZIP 输出")
     parser.add_argument("--file", default="/home/amlogic/RAG/debug_doc/SDK使用指南_Android_S_.docx", required=False, help="待处理文件路径")
-    parser.add_argument("--processor", default="mineru", help="处理器名称")
+    parser.add_argument("--processor", default="mineru", help="处理器名称：mineru | hybrid（文本层页面直接抽取，仅复杂页走 MinerU）")
     parser.add_argument(
         "--server",
         default="http://10.58.11.60:7890/process/zip",
@@ -63,11 +180,18 @@ def _parse_args(argv):
     )
     parser.add_argument("--out", default="output.zip", help="输出 ZIP 文件路径")
     parser.add_argument("--timeout", type=int, default=6000, help="请求超时时间(秒)")
+    parser.add_argument("--api-key", default=None, help="服务端分配的 API key（默认读 MINERU_API_KEY）")
+    parser.add_argument("--client-id", default=None, help="未分配 key 时用于公平调度的客户端名（默认读 MINERU_CLIENT_ID）")
+    parser.add_argument("--request-id", default=None, help="关联 ID（X-Request-ID），默认自动生成")
+    parser.add_argument("--no-hash-first", action="store_true", help="不做哈希协商，总是直接上传文件")
     return parser.parse_args(argv)
 
 
 def main(argv=None) -> int:
+    global API_KEY, CLIENT_ID
     args = _parse_args(argv or sys.argv[1:])
+    API_KEY = args.api_key or API_KEY
+    CLIENT_ID = args.client_id or CLIENT_ID
     try:
         process_document(
             file_path=args.file,
@@ -75,6 +199,8 @@ def main(argv=None) -> int:
             server_url=args.server,
             output_path=args.out,
             timeout=args.timeout,
+            hash_first=not args.no_hash_first,
+            request_id=args.request_id,
         )
     except requests.HTTPError as e:
         print(f"请求失败: {e}", file=sys.stderr)
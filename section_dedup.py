@@ -0,0 +1,313 @@
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import struct
+import hashlib
+import threading
+from typing import Iterable, Iterator, List, Optional
+
+from md_chunker import estimate_tokens
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_WS_RE = re.compile(r"\s+")
+# 图片链接中的 hash 文件名每篇文档都不同，比较前去掉
+_IMAGE_RE = re.compile(r"!\[[^\]]*\]\([^)]*\)")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sections (
+    section_id    INTEGER PRIMARY KEY AUTOINCREMENT,
+    doc_id        TEXT NOT NULL,
+    section_path  TEXT,
+    chunk_index   INTEGER,
+    text_sha256   TEXT NOT NULL,
+    signature     BLOB NOT NULL,
+    tokens        INTEGER NOT NULL,
+    created_at    REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sections_doc ON sections(doc_id);
+CREATE INDEX IF NOT EXISTS idx_sections_sha ON sections(text_sha256);
+CREATE TABLE IF NOT EXISTS lsh_buckets (
+    band        INTEGER NOT NULL,
+    bucket      TEXT NOT NULL,
+    section_id  INTEGER NOT NULL,
+    PRIMARY KEY (band, bucket, section_id)
+);
+CREATE TABLE IF NOT EXISTS dup_events (
+    doc_id         TEXT NOT NULL,
+    section_path   TEXT,
+    chunk_index    INTEGER,
+    duplicate_of   INTEGER NOT NULL,
+    similarity     REAL NOT NULL,
+    tokens         INTEGER NOT NULL,
+    suppressed     INTEGER NOT NULL,
+    created_at     REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_dup_events_doc ON dup_events(doc_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key    TEXT PRIMARY KEY,
+    value  TEXT NOT NULL
+);
+"""
+
+
+def _normalize(text: str) -> str:
+    text = _IMAGE_RE.sub(" ", text)
+    return _WS_RE.sub(" ", text).strip().lower()
+
+
+def _shingles(text: str, k: int) -> set:
+    """字符级 k-gram，对中英文混排都适用。"""
+    if len(text) <= k:
+        return {text} if text else set()
+    return {text[i:i + k] for i in range(len(text) - k + 1)}
+
+
+def _hash32(s: str) -> int:
+    return struct.unpack("<I", hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest())[0]
+
+
+class MinHasher:
+    """固定种子的 MinHash，签名可跨进程、跨运行比较。"""
+
+    def __init__(self, num_perm: int = 64, shingle_size: int = 5, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rnd = hashlib.sha256(f"minhash-{seed}".encode()).digest()
+        params = []
+        counter = 0
+        while len(params) < num_perm:
+            h = hashlib.sha256(rnd + counter.to_bytes(4, "little")).digest()
+            counter += 1
+            a = int.from_bytes(h[:8], "little") % (_MERSENNE_PRIME - 1) + 1
+            b = int.from_bytes(h[8:16], "little") % _MERSENNE_PRIME
+            params.append((a, b))
+        self._params = params
+
+    def signature(self, normalized_text: str) -> List[int]:
+        hashes = [_hash32(s) for s in _shingles(normalized_text, self.shingle_size)]
+        if not hashes:
+            return [_MAX_HASH] * self.num_perm
+        sig = []
+        for a, b in self._params:
+            sig.append(min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes))
+        return sig
+
+
+def _pack(sig: List[int]) -> bytes:
+    return struct.pack(f"<{len(sig)}I", *sig)
+
+
+def _unpack(blob: bytes) -> List[int]:
+    return list(struct.unpack(f"<{len(blob) // 4}I", blob))
+
+
+def _similarity(a: List[int], b: List[int]) -> float:
+    return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+
+class DupMatch:
+    def __init__(self, section_id: int, doc_id: str, section_path: str, similarity: float):
+        self.section_id = section_id
+        self.doc_id = doc_id
+        self.section_path = section_path
+        self.similarity = similarity
+
+    def __repr__(self):
+        return f"DupMatch({self.doc_id!r}, {self.section_path!r}, similarity={self.similarity:.2f})"
+
+
+class SectionDedupIndex:
+    """
+    基于 MinHash + LSH 的跨文档近重复章节索引，持久化在 sqlite 中，多次运行之间共享。
+
+    文档完成切块后逐块调用 check_and_add：与已入库章节相似度 >= threshold 的块返回匹配项
+    （并记入 dup_events 以便统计节省的 LLM 输入），否则入库作为后续比较对象。
+    """
+
+    def __init__(self, db_path: str, threshold: float = 0.8, num_perm: int = 64, bands: int = 16,
+                 min_tokens: int = 30, shingle_size: int = 5):
+        if num_perm % bands:
+            raise ValueError("num_perm 必须能被 bands 整除")
+        self.db_path = db_path
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.min_tokens = min_tokens
+        self.hasher = MinHasher(num_perm=num_perm, shingle_size=shingle_size)
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._check_params(num_perm, bands, shingle_size)
+        self._conn.commit()
+
+    def _check_params(self, num_perm: int, bands: int, shingle_size: int) -> None:
+        """签名参数写入 meta，参数与已有索引不一致时拒绝打开，避免签名不可比。"""
+        wanted = json.dumps({"num_perm": num_perm, "bands": bands, "shingle_size": shingle_size})
+        row = self._conn.execute("SELECT value FROM meta WHERE key='params'").fetchone()
+        if row is None:
+            self._conn.execute("INSERT INTO meta(key, value) VALUES ('params', ?)", (wanted,))
+        elif row[0] != wanted:
+            raise ValueError(f"去重索引参数不一致: 已有 {row[0]}，本次 {wanted}")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _band_keys(self, sig: List[int]) -> List[str]:
+        keys = []
+        for b in range(self.bands):
+            part = sig[b * self.rows:(b + 1) * self.rows]
+            keys.append(hashlib.blake2b(_pack(part), digest_size=8).hexdigest())
+        return keys
+
+    def remove_doc(self, doc_id: str) -> None:
+        """
+        文档重新处理前调用，避免与自己上一轮入库的章节互相判重。
+
+        其他文档指向这些章节的重复事件一并删除，统计中不会留下指向已不存在章节的记录。
+        """
+        with self._lock:
+            ids = [r[0] for r in self._conn.execute("SELECT section_id FROM sections WHERE doc_id=?", (doc_id,))]
+            for i in range(0, len(ids), 500):
+                batch = ids[i:i + 500]
+                marks = ",".join("?" * len(batch))
+                self._conn.execute(f"DELETE FROM lsh_buckets WHERE section_id IN ({marks})", batch)
+                self._conn.execute(f"DELETE FROM dup_events WHERE duplicate_of IN ({marks})", batch)
+            self._conn.execute("DELETE FROM sections WHERE doc_id=?", (doc_id,))
+            self._conn.execute("DELETE FROM dup_events WHERE doc_id=?", (doc_id,))
+            self._conn.commit()
+
+    def check_and_add(self, doc_id: str, section_path: str, text: str, chunk_index: Optional[int] = None,
+                      tokens: Optional[int] = None, suppress: bool = True) -> Optional[DupMatch]:
+        """检查一个章节块；重复时返回 DupMatch 并记录事件，否则入库并返回 None。"""
+        tokens = tokens if tokens is not None else estimate_tokens(text)
+        norm = _normalize(text)
+        if tokens < self.min_tokens or not norm:
+            return None
+        sha = hashlib.sha256(norm.encode("utf-8")).hexdigest()
+        sig = self.hasher.signature(norm)
+        keys = self._band_keys(sig)
+        now = time.time()
+        with self._lock:
+            match = self._find_match(sha, sig, keys)
+            if match is not None:
+                self._conn.execute(
+                    "INSERT INTO dup_events(doc_id, section_path, chunk_index, duplicate_of, similarity, tokens, suppressed, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (doc_id, section_path, chunk_index, match.section_id, match.similarity, tokens, int(suppress), now),
+                )
+                self._conn.commit()
+                return match
+            cur = self._conn.execute(
+                "INSERT INTO sections(doc_id, section_path, chunk_index, text_sha256, signature, tokens, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (doc_id, section_path, chunk_index, sha, _pack(sig), tokens, now),
+            )
+            sid = cur.lastrowid
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO lsh_buckets(band, bucket, section_id) VALUES (?, ?, ?)",
+                [(b, k, sid) for b, k in enumerate(keys)],
+            )
+            self._conn.commit()
+        return None
+
+    def _find_match(self, sha: str, sig: List[int], keys: List[str]) -> Optional[DupMatch]:
+        row = self._conn.execute(
+            "SELECT section_id, doc_id, section_path FROM sections WHERE text_sha256=? LIMIT 1", (sha,)
+        ).fetchone()
+        if row:
+            return DupMatch(row[0], row[1], row[2], 1.0)
+        candidates = set()
+        for b, k in enumerate(keys):
+            for (sid,) in self._conn.execute("SELECT section_id FROM lsh_buckets WHERE band=? AND bucket=?", (b, k)):
+                candidates.add(sid)
+        best = None
+        for sid in candidates:
+            r = self._conn.execute("SELECT doc_id, section_path, signature FROM sections WHERE section_id=?", (sid,)).fetchone()
+            if not r:
+                continue
+            sim = _similarity(sig, _unpack(r[2]))
+            if sim >= self.threshold and (best is None or sim > best.similarity):
+                best = DupMatch(sid, r[0], r[1], sim)
+        return best
+
+    def filter_chunks(self, rows: Iterable[dict], suppress: bool = True) -> Iterator[dict]:
+        """
+        过滤 md_chunker.chunk_markdown 产出的块：suppress 为 True 时丢弃重复块，
+        否则保留并在 duplicate_of 字段标注来源（"<doc_id>#<section_path>"）。
+        """
+        for row in rows:
+            match = self.check_and_add(
+                row["doc_id"], row.get("section_path", ""), row["text"],
+                chunk_index=row.get("chunk_index"), tokens=row.get("tokens"), suppress=suppress,
+            )
+            if match is None:
+                yield row
+            elif not suppress:
+                out = dict(row)
+                out["duplicate_of"] = f"{match.doc_id}#{match.section_path}"
+                yield out
+
+    def report(self, top: int = 10) -> dict:
+        """汇总：已入库章节、重复块数量与 token 占比，以及重复最多的来源章节。"""
+        with self._lock:
+            uniq_n, uniq_tokens = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(tokens), 0) FROM sections").fetchone()
+            dup_n, dup_tokens, supp_tokens = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(tokens), 0), COALESCE(SUM(CASE WHEN suppressed THEN tokens ELSE 0 END), 0) FROM dup_events"
+            ).fetchone()
+            hot = self._conn.execute(
+                "SELECT s.doc_id, s.section_path, COUNT(*) AS n, SUM(e.tokens) AS t FROM dup_events e "
+                "JOIN sections s ON s.section_id = e.duplicate_of GROUP BY e.duplicate_of ORDER BY n DESC LIMIT ?",
+                (top,),
+            ).fetchall()
+        total_tokens = uniq_tokens + dup_tokens
+        return {
+            "unique_sections": uniq_n,
+            "duplicate_sections": dup_n,
+            "duplicate_tokens": dup_tokens,
+            "suppressed_tokens": supp_tokens,
+            "duplicate_token_ratio": round(dup_tokens / total_tokens, 4) if total_tokens else 0.0,
+            "top_sources": [
+                {"doc_id": d, "section_path": p, "copies": n, "tokens": t} for d, p, n, t in hot
+            ],
+        }
+
+
+def _parse_args(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="跨文档近重复章节检测（MinHash/LSH）")
+    parser.add_argument("--db", required=True, help="去重索引 sqlite 文件")
+    parser.add_argument("--report", action="store_true", help="打印去重统计")
+    parser.add_argument("--chunks", nargs="*", default=[], help="按顺序入库并检查的块文件（md_chunker 输出的 JSONL）")
+    parser.add_argument("--threshold", type=float, default=0.8, help="相似度阈值")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = _parse_args(argv or sys.argv[1:])
+    with SectionDedupIndex(args.db, threshold=args.threshold) as index:
+        for path in args.chunks:
+            with open(path, "r", encoding="utf-8") as f:
+                rows = [json.loads(line) for line in f if line.strip()]
+            dups = sum(1 for r in index.filter_chunks(rows, suppress=False) if r.get("duplicate_of"))
+            print(f"{path}: {len(rows)} 个块，其中近重复 {dups} 个")
+        if args.report or not args.chunks:
+            print(json.dumps(index.report(), ensure_ascii=False, indent=1))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,14 +1,27 @@
-from typing import Optional
+from typing import Optional, List, Callable
 import requests
 import sys
 import os
+import glob
+import json
+import time
+import uuid
+import queue
+import random
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 
+from tracing import traced, span
 
+# 与处理服务相同的关联 ID 请求头，n8n 中可从 $json.headers["x-request-id"] 或 body.request_id 取到
+REQUEST_ID_HEADER = "X-Request-ID"
 
-def _post_md_path(md_abs_path: str, webhook_url: str, timeout: int = 10):
-    """将 MD 文件的绝对路径发送到指定 webhook，并返回响应对象。"""
-    payload = {"path": md_abs_path}
+
+def _post_payload(payload: dict, webhook_url: str, timeout: int = 10, request_id: Optional[str] = None):
+    """POST JSON 到 webhook，非 2xx 时打印响应体预览并抛出 HTTPError。"""
     headers = {"Content-Type": "application/json"}
+    if request_id:
+        headers[REQUEST_ID_HEADER] = request_id
     print(f"发送 webhook 请求，等待响应… URL: {webhook_url}")
     resp = requests.post(webhook_url, json=payload, headers=headers, timeout=timeout)
     print(f"Webhook 响应状态: {resp.status_code}")
@@ -22,22 +35,397 @@ def _post_md_path(md_abs_path: str, webhook_url: str, timeout: int = 10):
     return resp
 
 
-def send_md_path_to_webhook(md_path: str, webhook_url: Optional[str], timeout: int = 10) -> bool:
+def _post_md_path(md_abs_path: str, webhook_url: str, timeout: int = 10, request_id: Optional[str] = None):
+    """将 MD 文件的绝对路径发送到指定 webhook，并返回响应对象。有关联 ID 时同时放进请求头与 payload。"""
+    payload = {"path": md_abs_path}
+    if request_id:
+        payload["request_id"] = request_id
+    return _post_payload(payload, webhook_url, timeout=timeout, request_id=request_id)
+
+
+@traced("send_md_path_to_webhook", ok_if=bool)
+def send_md_path_to_webhook(
+    md_path: str, webhook_url: Optional[str], timeout: int = 10, request_id: Optional[str] = None
+) -> bool:
     """发送 MD 文件绝对路径到 webhook。
 
+    request_id 为该文档处理请求的关联 ID，随 X-Request-ID 头与 payload 的 request_id 字段转给 n8n。
     返回 True 表示发送成功；未提供 webhook 或发送失败返回 False。
     """
     if not webhook_url:
         return False
     md_abs_path = os.path.abspath(md_path)
     try:
-        resp = _post_md_path(md_abs_path, webhook_url, timeout=timeout)
+        resp = _post_md_path(md_abs_path, webhook_url, timeout=timeout, request_id=request_id)
         print(f"已发送 MD 绝对路径到 webhook: {webhook_url}\n路径: {md_abs_path}\n状态码: {resp.status_code}")
         return True
     except Exception as e:
-        print(f"发送 webhook 失败: {e}", file=sys.stderr)
+        print(f"发送 webhook 失败 [{request_id or '-'}]: {e}", file=sys.stderr)
         return False
 
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _is_transient(exc: Exception) -> bool:
+    """连接错误、超时、429 与 5xx 视为可重试。"""
+    if isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(exc, requests.exceptions.HTTPError):
+        code = getattr(getattr(exc, "response", None), "status_code", None)
+        return code is None or code in (408, 429) or code >= 500
+    return False
+
+
+class WebhookResult:
+    """
+    一次（批量）发送的结果。queued 为 True 表示可重试的失败在重试耗尽后已写入磁盘重试队列；
+    dead_lettered 为 True 表示不可重试的失败（4xx、payload 被拒）已写入死信文件。
+
+    doc_ids 为提交时附带的文档主键（与 paths 对齐），on_result 回调可据此更新作业台账。
+    """
+
+    def __init__(self, paths: List[str], request_ids: Optional[List[Optional[str]]] = None,
+                 doc_ids: Optional[List[Optional[str]]] = None):
+        self.paths = paths
+        self.request_ids = request_ids or [None] * len(paths)
+        self.doc_ids = doc_ids or [None] * len(paths)
+        self.ok = False
+        self.status_code = None
+        self.body = ""
+        self.error = ""
+        self.attempts = 0
+        self.elapsed = 0.0
+        self.transient = False
+        self.queued = False
+        self.dead_lettered = False
+
+    def __repr__(self):
+        return f"WebhookResult(ok={self.ok}, paths={len(self.paths)}, attempts={self.attempts}, error={self.error!r})"
+
+
+class WebhookDispatcher:
+    """
+    并发、可批量的 webhook 发送器。
+
+    - 同时在途的请求数不超过 max_in_flight，submit 在窗口满时才阻塞
+    - batch_size > 1 时把多个 MD 路径合并为一次调用，payload 为 {"paths": [...]}；
+      batch_size == 1 时保持原有 {"path": ...} 格式
+    - 提交时带了关联 ID 的路径，payload 中附带 request_id（批量时为与 paths 对齐的 request_ids），
+      单条发送时还会放进 X-Request-ID 请求头
+    - 连接错误、超时、429/5xx 按指数退避重试；重试耗尽后写入 retry_queue_path（JSONL），
+      之后可用 replay_retry_queue（或后台的 start_replay）重新发送，不会丢文档
+    - 不可重试的失败（4xx、payload 被拒）写入 dead_letter_path（JSONL），需人工处理，不会被反复重发；
+      批量请求被拒时先拆开逐个重发，只有被拒的路径进入死信
+    - 每个批次结束后调用 on_result(WebhookResult)，可按其中的 doc_ids 把发送成功的文档记入台账
+    """
+
+    def __init__(
+        self,
+        webhook_url: str,
+        max_in_flight: int = 4,
+        batch_size: int = 1,
+        batch_wait: float = 2.0,
+        timeout: int = 600,
+        max_retries: int = 4,
+        backoff_base: float = 2.0,
+        backoff_max: float = 120.0,
+        retry_queue_path: Optional[str] = None,
+        on_result: Optional[Callable[[WebhookResult], None]] = None,
+        dead_letter_path: Optional[str] = None,
+    ):
+        if not webhook_url:
+            raise ValueError("webhook_url 不能为空")
+        self.webhook_url = webhook_url
+        self.max_in_flight = max(1, max_in_flight)
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = batch_wait
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_queue_path = retry_queue_path
+        self.dead_letter_path = dead_letter_path
+        self.on_result = on_result
+        self.results: List[WebhookResult] = []
+
+        self._pending: "queue.Queue" = queue.Queue(maxsize=self.max_in_flight * self.batch_size)
+        self._window = threading.BoundedSemaphore(self.max_in_flight)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="webhook")
+        self._lock = threading.Lock()
+        self._closed = False
+        self._replayer: Optional[threading.Thread] = None
+        self._collector = threading.Thread(target=self._collect, name="webhook-collector", daemon=True)
+        self._collector.start()
+
+    def submit(self, md_path: str, request_id: Optional[str] = None, doc_id: Optional[str] = None) -> Future:
+        """
+        提交一个 MD 路径，返回 Future，结果为该路径所在批次的 WebhookResult。
+
+        :param request_id: 关联 ID，随请求发给 n8n
+        :param doc_id: 作业台账中的文档主键，随重试队列保存，重发成功时经 on_result 回传
+        """
+        if self._closed:
+            raise RuntimeError("WebhookDispatcher 已关闭")
+        fut = Future()
+        self._pending.put((os.path.abspath(md_path), request_id, doc_id, fut))
+        return fut
+
+    def _collect(self) -> None:
+        """把待发送路径攒成批次，拿到在途窗口后交给线程池发送。"""
+        while True:
+            item = self._pending.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.time() + self.batch_wait
+            stop = False
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    nxt = self._pending.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    stop = True
+                    break
+                batch.append(nxt)
+            self._window.acquire()
+            self._pool.submit(self._send_batch, batch)
+            if stop:
+                break
+
+    def _send_batch(self, batch) -> None:
+        outcomes = []
+        failure = None
+        try:
+            try:
+                outcomes = self._deliver_items(batch)
+            finally:
+                self._window.release()
+            for _, result in outcomes:
+                with self._lock:
+                    self.results.append(result)
+                if self.on_result is not None:
+                    try:
+                        self.on_result(result)
+                    except Exception as e:
+                        print(f"on_result 回调异常: {e}", file=sys.stderr)
+        except BaseException as e:
+            failure = e
+            raise
+        finally:
+            # 无论发生什么都要解决 Future，否则 webhook 阶段与 replay_retry_queue 会永远阻塞在 result()
+            result_of = {id(item): result for items, result in outcomes for item in items}
+            for item in batch:
+                fut = item[3]
+                if fut.done():
+                    continue
+                if id(item) in result_of:
+                    fut.set_result(result_of[id(item)])
+                else:
+                    fut.set_exception(failure or RuntimeError("webhook 批次未发送"))
+
+    def _deliver_items(self, items) -> List[tuple]:
+        """
+        发送一组条目，返回 [(条目列表, WebhookResult)]。
+
+        批量请求被不可重试地拒绝（4xx 等）时往往只是其中一个路径有问题：拆开逐个重发，
+        只有真正被拒绝的路径进入死信文件，其余正常发出。
+        """
+        paths = [p for p, _, _, _ in items]
+        request_ids = [r for _, r, _, _ in items]
+        result = WebhookResult(paths, request_ids, [d for _, _, d, _ in items])
+        if self.batch_size == 1:
+            payload = {"path": paths[0]}
+            if request_ids[0]:
+                payload["request_id"] = request_ids[0]
+        else:
+            payload = {"paths": paths}
+            if any(request_ids):
+                payload["request_ids"] = request_ids
+        header_id = request_ids[0] if len(items) == 1 else None
+        self._deliver(payload, header_id, result)
+        if not result.ok and not result.transient and len(items) > 1:
+            print(f"批量 webhook 被拒绝（{result.error}），逐个重发 {len(items)} 个路径", file=sys.stderr)
+            outcomes = []
+            for item in items:
+                outcomes.extend(self._deliver_items([item]))
+            return outcomes
+        if not result.ok:
+            self._park(result)
+        return [(items, result)]
+
+    def _deliver(self, payload: dict, header_id: Optional[str], result: WebhookResult) -> None:
+        """发送一个批次（含退避重试），结果记在 result 上；失败时 result.transient 表示最后一次错误是否可重试。"""
+        start = time.time()
+        while True:
+            result.attempts += 1
+            try:
+                resp = _post_payload(payload, self.webhook_url, timeout=self.timeout, request_id=header_id)
+                result.ok = True
+                result.status_code = resp.status_code
+                result.body = resp.text[:2000] if hasattr(resp, "text") else ""
+                result.error = ""
+                break
+            except Exception as e:
+                result.error = f"{type(e).__name__}: {e}"
+                result.status_code = getattr(getattr(e, "response", None), "status_code", None)
+                result.transient = _is_transient(e)
+                if not result.transient or result.attempts > self.max_retries:
+                    break
+                delay = min(self.backoff_max, self.backoff_base ** result.attempts)
+                delay *= random.uniform(0.5, 1.0)
+                print(f"webhook 发送失败（第 {result.attempts} 次），{delay:.1f} 秒后重试: {result.error}", file=sys.stderr)
+                time.sleep(delay)
+        result.elapsed = time.time() - start
+        # 分发线程不属于某个文档上下文，路径记在 attrs 中
+        with span("webhook_dispatch", paths=result.paths, attempts=result.attempts) as sp:
+            sp.start = start
+            sp.add_bytes(len(json.dumps(payload, ensure_ascii=False).encode("utf-8")))
+            if not result.ok:
+                sp.outcome = "failed"
+                sp.error = result.error
+
+    def _park(self, result: WebhookResult) -> None:
+        """最终失败的结果：可重试的写入重试队列（下次启动重发），不可重试的写入死信文件（不再自动重发）。"""
+        if result.transient:
+            target, kind = self.retry_queue_path, "重试队列"
+        else:
+            target, kind = self.dead_letter_path, "死信文件"
+        if not target:
+            print(f"webhook 发送最终失败且未配置{kind}: {result.paths}", file=sys.stderr)
+            return
+        try:
+            self._append_records(target, result)
+        except Exception as e:
+            # 磁盘只读/写满等：文档既没发出去也没写入磁盘，记在结果上交给调用方
+            result.error = f"{result.error}; 写入{kind}失败: {type(e).__name__}: {e}"
+            print(f"webhook 发送失败且无法写入{kind} {target}: {result.paths}: {e}", file=sys.stderr)
+            return
+        if result.transient:
+            result.queued = True
+        else:
+            result.dead_lettered = True
+        print(f"webhook 发送失败，已写入{kind} {target}: {len(result.paths)} 个路径", file=sys.stderr)
+
+    def _append_records(self, path: str, result: WebhookResult) -> None:
+        d = os.path.dirname(os.path.abspath(path))
+        os.makedirs(d, exist_ok=True)
+        now = time.time()
+        with self._lock:
+            with open(path, "a", encoding="utf-8") as f:
+                for p, rid, doc_id in zip(result.paths, result.request_ids, result.doc_ids):
+                    rec = {"path": p, "request_id": rid, "doc_id": doc_id, "error": result.error,
+                           "status_code": result.status_code, "attempts": result.attempts, "ts": now}
+                    f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _claim_replay_files(self) -> List[str]:
+        """
+        把待重发的队列文件改名为本进程所有（<queue>.replaying.<pid>.<随机后缀>）：当前队列文件，
+        以及之前重发到一半时进程崩溃遗留的 .replaying.<pid> 文件（该 pid 已不存在）。改名是原子的，
+        多个进程同时启动时同一个文件只会被一个进程领走。
+        """
+        prefix = f"{self.retry_queue_path}.replaying."
+        pid = os.getpid()
+        claimed = []
+        with self._lock:
+            for path in [self.retry_queue_path] + sorted(glob.glob(glob.escape(prefix) + "*")):
+                if path != self.retry_queue_path:
+                    owner = path[len(prefix):].split(".", 1)[0]
+                    if not owner.isdigit() or int(owner) == pid or _pid_alive(int(owner)):
+                        continue
+                target = f"{prefix}{pid}.{uuid.uuid4().hex[:8]}"
+                try:
+                    os.replace(path, target)
+                except FileNotFoundError:
+                    continue
+                claimed.append(target)
+        return claimed
+
+    def replay_retry_queue(self) -> int:
+        """
+        把磁盘重试队列中的路径重新提交，返回提交数量。
+
+        队列文件先改名再发送，仍失败的会重新写回队列；全部发出或重新入队后才删除改名后的文件，
+        中途崩溃时它会在下次启动时被重新领取。
+        """
+        if not self.retry_queue_path:
+            return 0
+        claimed = self._claim_replay_files()
+        records = {}
+        for path in claimed:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        rec = json.loads(line)
+                        records[rec["path"]] = (rec.get("request_id"), rec.get("doc_id"))
+                    except (ValueError, KeyError):
+                        continue
+        futures = [self.submit(p, request_id=rid, doc_id=doc_id) for p, (rid, doc_id) in records.items()]
+        settled = True
+        for fut in futures:
+            try:
+                result = fut.result()
+            except Exception as e:
+                print(f"重发 webhook 重试队列异常: {e}", file=sys.stderr)
+                settled = False
+                continue
+            settled = settled and (result.ok or result.queued or result.dead_lettered)
+        if settled:
+            for path in claimed:
+                os.remove(path)
+        else:
+            print(f"部分路径既未发出也未能写回重试队列，保留 {claimed} 供下次启动重发", file=sys.stderr)
+        return len(futures)
+
+    def start_replay(self) -> None:
+        """在后台线程重发磁盘重试队列，不阻塞调用方；close() 会先等它提交并发完。"""
+        if not self.retry_queue_path or self._replayer is not None:
+            return
+
+        def _run():
+            try:
+                replayed = self.replay_retry_queue()
+                if replayed:
+                    print(f"已重发 webhook 重试队列中的 {replayed} 个路径")
+            except Exception as e:
+                print(f"重发 webhook 重试队列失败: {e}", file=sys.stderr)
+
+        self._replayer = threading.Thread(target=_run, name="webhook-replay", daemon=True)
+        self._replayer.start()
+
+    def close(self) -> List[WebhookResult]:
+        """等待所有在途请求结束并关闭，返回全部结果。"""
+        if self._replayer is not None:
+            self._replayer.join()
+        if not self._closed:
+            self._closed = True
+            self._pending.put(None)
+            self._collector.join()
+            self._pool.shutdown(wait=True)
+        return self.results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
 if __name__ == "__main__":
 
     # 需要自动化,不校验md文档，放开以下代码
@@ -0,0 +1,25 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from md_chunker import chunk_markdown, estimate_tokens  # noqa: E402
+
+
+def test_oversized_paragraph_keeps_image_link_and_budget():
+    words = " ".join(["word"] * 700)
+    link = "![](http://h/images/abc.png)"
+    md = f"# T\n\n{words} see {link} {words}\n"
+    rows = list(chunk_markdown(md.splitlines(keepends=True), "doc", max_tokens=800))
+    assert len(rows) > 1
+    assert all(estimate_tokens(r["text"]) <= 800 for r in rows)
+    assert sum(link in r["text"] for r in rows) == 1
+    assert [img for r in rows for img in r["images"]] == ["http://h/images/abc.png"]
+    # 片段首尾相接（忽略切点处的空白）还原原段落
+    assert " ".join(r["text"] for r in rows).split() == f"{words} see {link} {words}".split()
+
+
+def test_sentence_without_breaks_is_split_by_length():
+    text = "字" * 2000
+    rows = list(chunk_markdown([text + "\n"], "doc", max_tokens=800))
+    assert [len(r["text"]) for r in rows] == [800, 800, 400]
@@ -0,0 +1,286 @@
+import os
+import sys
+import json
+import time
+import uuid
+import functools
+import threading
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+# 追踪文件路径；为 None 时 span 只计时不落盘。也可用环境变量 CLIENT_TRACE_FILE 指定
+_trace_path: Optional[str] = os.environ.get("CLIENT_TRACE_FILE") or None
+_write_lock = threading.Lock()
+_local = threading.local()
+
+
+def configure_tracing(path: Optional[str]) -> None:
+    """设置 JSONL 追踪文件（追加写入）；传 None 关闭。"""
+    global _trace_path
+    if path:
+        d = os.path.dirname(os.path.abspath(path))
+        os.makedirs(d, exist_ok=True)
+    _trace_path = path or None
+
+
+def current_doc_id() -> Optional[str]:
+    return getattr(_local, "doc_id", None)
+
+
+@contextmanager
+def trace_document(doc_id: Optional[str]):
+    """在当前线程内设置文档 id，期间创建的 span 默认归属该文档。"""
+    prev = getattr(_local, "doc_id", None)
+    _local.doc_id = doc_id
+    try:
+        yield
+    finally:
+        _local.doc_id = prev
+
+
+class Span:
+    """
+    一次阶段调用的记录，退出时写一行 JSON：stage/doc_id/start/end/duration/bytes/outcome/error/attrs。
+
+    同一线程内嵌套的 span 记录外层 span 的 parent_id（如 stage.mineru 内的 process_document），
+    汇总时只累加顶层 span，避免同一段时间被计两次。
+    """
+
+    def __init__(self, stage: str, doc_id: Optional[str] = None, **attrs):
+        self.stage = stage
+        self.doc_id = doc_id if doc_id is not None else current_doc_id()
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id: Optional[str] = None
+        self.attrs = attrs
+        self.bytes = 0
+        self.outcome = "ok"
+        self.error = ""
+        self.start = 0.0
+        self.end = 0.0
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def add_bytes(self, n: int) -> None:
+        self.bytes += int(n or 0)
+
+    def __enter__(self):
+        stack = _local.__dict__.setdefault("spans", [])
+        self.parent_id = stack[-1].span_id if stack else None
+        stack.append(self)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.time()
+        stack = _local.__dict__.get("spans") or []
+        if self in stack:
+            stack.remove(self)
+        if exc is not None:
+            # SkipProcessing 属于正常分支，单独标记
+            self.outcome = "skipped" if exc_type.__name__ == "SkipProcessing" else "error"
+            self.error = f"{exc_type.__name__}: {exc}"
+        _write(self)
+        return False
+
+    def to_dict(self) -> dict:
+        return {
+            "stage": self.stage,
+            "doc_id": self.doc_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": round(self.start, 6),
+            "end": round(self.end, 6),
+            "duration": round(self.end - self.start, 6),
+            "bytes": self.bytes,
+            "outcome": self.outcome,
+            "error": self.error,
+            "thread": threading.current_thread().name,
+            "pid": os.getpid(),
+            "attrs": self.attrs,
+        }
+
+
+def span(stage: str, doc_id: Optional[str] = None, **attrs) -> Span:
+    return Span(stage, doc_id, **attrs)
+
+
+def _write(sp: Span) -> None:
+    path = _trace_path
+    if not path:
+        return
+    line = json.dumps(sp.to_dict(), ensure_ascii=False, default=str) + "\n"
+    try:
+        with _write_lock:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line)
+    except OSError as e:
+        print(f"写入追踪文件失败: {path}: {e}", file=sys.stderr)
+
+
+def file_size(path) -> int:
+    try:
+        return os.path.getsize(path) if path and os.path.isfile(path) else 0
+    except OSError:
+        return 0
+
+
+def traced(stage: str, bytes_of: Optional[Callable] = None, ok_if: Optional[Callable] = None):
+    """
+    装饰器：把函数调用包成 span。
+
+    :param bytes_of: bytes_of(返回值) -> 本次处理的字节数
+    :param ok_if: ok_if(返回值) 为 False 时 outcome 记为 failed（用于返回 bool 而不抛异常的函数）
+    """
+
+    def deco(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage) as sp:
+                result = func(*args, **kwargs)
+                if bytes_of is not None:
+                    try:
+                        sp.add_bytes(bytes_of(result))
+                    except Exception:
+                        pass
+                if ok_if is not None and not ok_if(result):
+                    sp.outcome = "failed"
+                return result
+
+        return wrapper
+
+    return deco
+
+
+def _percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def load_spans(path: str) -> list:
+    spans = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                spans.append(json.loads(line))
+            except ValueError:
+                continue
+    return spans
+
+
+def _root_spans(spans: list) -> list:
+    """
+    参与文档总耗时与占比计算的顶层 span。
+
+    流水线追踪中 stage.* 覆盖了文档的全部处理时间，其余 span（包括其他线程中的 webhook_dispatch）都在
+    某个阶段之内；其他追踪取没有 parent_id 的 span。
+    """
+    stage_spans = [s for s in spans if s["stage"].startswith("stage.")]
+    if stage_spans:
+        return stage_spans
+    return [s for s in spans if not s.get("parent_id")]
+
+
+def summarize(spans: list, top: int = 10) -> dict:
+    """
+    按阶段汇总耗时分布，并找出总耗时最长的文档及其阶段拆分。
+
+    文档总耗时与 share 只按顶层 span（见 _root_spans）计算；嵌套在其中的 span 单独列出（nested=True），
+    不再重复计入。
+    """
+    roots = _root_spans(spans)
+    root_ids = {id(s) for s in roots}
+    stages = {}
+    docs = {}
+    for s in spans:
+        st = stages.setdefault(s["stage"], {"count": 0, "total": 0.0, "durations": [], "bytes": 0, "outcomes": {},
+                                            "nested": True})
+        st["count"] += 1
+        st["total"] += s["duration"]
+        st["durations"].append(s["duration"])
+        st["bytes"] += s.get("bytes") or 0
+        st["outcomes"][s["outcome"]] = st["outcomes"].get(s["outcome"], 0) + 1
+        if id(s) not in root_ids:
+            continue
+        st["nested"] = False
+        if s.get("doc_id"):
+            d = docs.setdefault(s["doc_id"], {"total": 0.0, "stages": {}})
+            d["total"] += s["duration"]
+            d["stages"][s["stage"]] = d["stages"].get(s["stage"], 0.0) + s["duration"]
+
+    grand = sum(s["duration"] for s in roots) or 1.0
+    stage_rows = []
+    for name, st in sorted(stages.items(), key=lambda kv: (kv[1]["nested"], -kv[1]["total"])):
+        stage_rows.append({
+            "stage": name,
+            "count": st["count"],
+            "total": round(st["total"], 3),
+            "share": None if st["nested"] else round(st["total"] / grand, 4),
+            "nested": st["nested"],
+            "p50": round(_percentile(st["durations"], 0.5), 3),
+            "p99": round(_percentile(st["durations"], 0.99), 3),
+            "max": round(max(st["durations"]), 3),
+            "bytes": st["bytes"],
+            "outcomes": st["outcomes"],
+        })
+    slowest = sorted(docs.items(), key=lambda kv: -kv[1]["total"])[:top]
+    return {
+        "stages": stage_rows,
+        "slowest_documents": [
+            {"doc_id": d, "total": round(v["total"], 3), "stages": {k: round(x, 3) for k, x in v["stages"].items()}}
+            for d, v in slowest
+        ],
+    }
+
+
+def _print_summary(summary: dict) -> None:
+    print(f"{'stage':<28}{'count':>7}{'total(s)':>11}{'share':>8}{'p50(s)':>9}{'p99(s)':>9}{'max(s)':>9}{'MB':>9}  outcomes")
+    for r in summary["stages"]:
+        # 嵌套 span 已包含在外层阶段的耗时中，不计占比
+        name = f"  {r['stage']}" if r["nested"] else r["stage"]
+        share = "-" if r["share"] is None else f"{r['share']:.1%}"
+        print(
+            f"{name:<28}{r['count']:>7}{r['total']:>11}{share:>8}{r['p50']:>9}{r['p99']:>9}"
+            f"{r['max']:>9}{r['bytes'] / 1048576:>9.1f}  {r['outcomes']}"
+        )
+    print("\n最慢的文档:")
+    for d in summary["slowest_documents"]:
+        parts = ", ".join(f"{k}={v}s" for k, v in sorted(d["stages"].items(), key=lambda kv: -kv[1]))
+        print(f"  {d['total']:>9}s  {d['doc_id']}\n             {parts}")
+
+
+def _parse_args(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="客户端流水线追踪（JSONL）汇总")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("summary", help="打印各阶段耗时分布与最慢文档")
+    p.add_argument("trace", nargs="+", help="追踪 JSONL 文件")
+    p.add_argument("--top", type=int, default=10, help="列出最慢的文档数量")
+    p.add_argument("--json", action="store_true", help="以 JSON 输出")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = _parse_args(argv or sys.argv[1:])
+    spans = []
+    for path in args.trace:
+        spans += load_spans(path)
+    summary = summarize(spans, top=args.top)
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False, indent=1))
+    else:
+        _print_summary(summary)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,258 @@
+import os
+import re
+import sys
+import json
+import hashlib
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse, parse_qs, unquote, urldefrag
+
+from job_ledger import file_sha256
+
+# 每次 CQL 查询合并的标题数量，避免 URL 过长
+_CQL_BATCH = 25
+
+
+class CanonicalInput:
+    """
+    去重后的一个文档：doc_id 为规范主键，source 为实际交给流水线处理的输入，inputs 为合并进来的原始输入。
+
+    unresolved 为 True 表示 /display/ URL 未能解析出 pageId，doc_id 取决于本机能否访问 Confluence，
+    不能用于跨机器分片。
+    """
+
+    def __init__(self, doc_id: str, source: str, unresolved: bool = False):
+        self.doc_id = doc_id
+        self.source = source
+        self.unresolved = unresolved
+        self.inputs: List[str] = []
+
+    def __repr__(self):
+        return f"CanonicalInput({self.doc_id!r}, source={self.source!r}, inputs={len(self.inputs)})"
+
+
+def _is_url(s: str) -> bool:
+    return s.startswith("http://") or s.startswith("https://")
+
+
+def extract_page_id(url: str) -> Optional[str]:
+    """从 viewpage.action?pageId= 或 /pages/<id>/ 形式的 URL 中取 pageId。"""
+    parsed = urlparse(url)
+    qs = parse_qs(parsed.query)
+    if qs.get("pageId"):
+        return qs["pageId"][0]
+    m = re.search(r"/pages/(\d+)(?:/|$)", parsed.path)
+    return m.group(1) if m else None
+
+
+def parse_display_url(url: str) -> Optional[Tuple[str, str]]:
+    """解析 /display/{SPACE}/{Title} 或 /wiki/display/{SPACE}/{Title}，返回 (space, title)。"""
+    path = urlparse(url).path or ""
+    idx = path.find("/display/")
+    if idx == -1:
+        return None
+    parts = path[idx + len("/display/"):].split("/")
+    if len(parts) < 2 or not parts[0] or not parts[1]:
+        return None
+    # 与 my_confluce_test.get_confluence_page_by_url 一致：'+' 视为空格
+    title = unquote("/".join(parts[1:]).replace("+", " "))
+    return parts[0], title
+
+
+def _viewpage_url(url: str, page_id: str) -> str:
+    parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}/pages/viewpage.action?pageId={page_id}"
+
+
+def _cql_quote(s: str) -> str:
+    return '"' + s.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def confluence_title_resolver(pairs: List[Tuple[str, str]]) -> Dict[Tuple[str, str], str]:
+    """
+    批量把 (space, title) 解析为 pageId：按空间分组，每批用一次 CQL `title in (...)` 查询。
+
+    未能解析的条目不出现在返回结果中。
+    """
+    import requests
+    from requests.auth import HTTPBasicAuth
+    from my_confluce_test import CONFLUENCE_BASE_URL, CONFLUENCE_USERNAME, CONFLUENCE_PASSWORD
+
+    auth = HTTPBasicAuth(CONFLUENCE_USERNAME, CONFLUENCE_PASSWORD)
+    headers = {"Accept": "application/json"}
+    by_space: Dict[str, List[str]] = {}
+    for space, title in pairs:
+        by_space.setdefault(space, []).append(title)
+
+    resolved = {}
+    for space, titles in by_space.items():
+        titles = list(dict.fromkeys(titles))
+        for i in range(0, len(titles), _CQL_BATCH):
+            batch = titles[i:i + _CQL_BATCH]
+            cql = f"space = {_cql_quote(space)} and type = page and title in ({', '.join(_cql_quote(t) for t in batch)})"
+            try:
+                resp = requests.get(
+                    f"{CONFLUENCE_BASE_URL}/rest/api/content/search",
+                    params={"cql": cql, "limit": len(batch) * 2},
+                    auth=auth,
+                    headers=headers,
+                    timeout=60,
+                )
+                resp.raise_for_status()
+                results = resp.json().get("results", [])
+            except Exception as e:
+                print(f"批量解析页面标题失败（空间 {space}，{len(batch)} 个）: {e}", file=sys.stderr)
+                continue
+            by_title = {r.get("title"): str(r.get("id")) for r in results if r.get("id")}
+            by_folded = {(t or "").casefold(): pid for t, pid in by_title.items()}
+            for t in batch:
+                pid = by_title.get(t) or by_folded.get(t.casefold())
+                if pid:
+                    resolved[(space, t)] = pid
+    return resolved
+
+
+def canonicalize_inputs(
+    inputs: Iterable[str],
+    resolver: Optional[Callable[[List[Tuple[str, str]]], Dict[Tuple[str, str], str]]] = confluence_title_resolver,
+) -> List[CanonicalInput]:
+    """
+    规范化并去重输入（Confluence URL 与本地文件路径），保持首次出现的顺序。
+
+    - URL 去掉 #fragment；pageId 形式直接取 id；/display/SPACE/Title 形式批量解析为 pageId
+    - 同一 pageId 的所有写法合并为 `confluence:<pageId>`，交给流水线的 source 统一为 viewpage.action?pageId= 形式
+    - 本地文件按内容 sha256 合并为 `file:<sha256>`；文件不存在时以绝对路径为主键，留给后续阶段报错
+    - 无法解析的 display URL 以 `confluence:<SPACE>/<Title>` 为主键
+    """
+    items = []  # (原始输入, 去 fragment 后的值)
+    for raw in inputs:
+        s = (raw or "").strip()
+        if not s or s.startswith("#"):
+            continue
+        items.append((raw, urldefrag(s)[0] if _is_url(s) else s))
+
+    pending = [parse_display_url(s) for _, s in items if _is_url(s) and not extract_page_id(s)]
+    pending = [p for p in pending if p]
+    resolved = resolver(pending) if (resolver and pending) else {}
+
+    groups: Dict[str, CanonicalInput] = {}
+    order: List[str] = []
+    for raw, s in items:
+        if _is_url(s):
+            page_id = extract_page_id(s)
+            display = None if page_id else parse_display_url(s)
+            if not page_id and display:
+                page_id = resolved.get(display)
+            unresolved = False
+            if page_id:
+                doc_id, source = f"confluence:{page_id}", _viewpage_url(s, page_id)
+            elif display:
+                doc_id, source, unresolved = f"confluence:{display[0]}/{display[1]}", s, True
+            else:
+                doc_id, source = s, s
+        else:
+            abs_path = os.path.abspath(s)
+            digest = file_sha256(abs_path)
+            doc_id = f"file:{digest}" if digest else f"path:{abs_path}"
+            source = abs_path
+            unresolved = False
+        if doc_id not in groups:
+            groups[doc_id] = CanonicalInput(doc_id, source, unresolved)
+            order.append(doc_id)
+        groups[doc_id].inputs.append(raw)
+    return [groups[d] for d in order]
+
+
+def iter_input_lines(path: str) -> Iterator[str]:
+    """逐行读取输入清单（URL 或本地路径），path 为 "-" 时读标准输入。"""
+    if path == "-":
+        for line in sys.stdin:
+            yield line.rstrip("\n")
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            yield line.rstrip("\n")
+
+
+def canonicalize_stream(
+    inputs: Iterable[str],
+    resolver: Optional[Callable[[List[Tuple[str, str]]], Dict[Tuple[str, str], str]]] = confluence_title_resolver,
+    batch_size: int = 500,
+) -> Iterator[CanonicalInput]:
+    """
+    分批规范化流式输入，跨批次去重：每个文档只产出一次，之后出现的重复写法追加到它的 inputs。
+    """
+    seen: Dict[str, CanonicalInput] = {}
+    batch: List[str] = []
+
+    def _flush():
+        for c in canonicalize_inputs(batch, resolver=resolver):
+            if c.doc_id in seen:
+                seen[c.doc_id].inputs.extend(c.inputs)
+                continue
+            seen[c.doc_id] = c
+            yield c
+        batch.clear()
+
+    for raw in inputs:
+        batch.append(raw)
+        if len(batch) >= batch_size:
+            yield from _flush()
+    if batch:
+        yield from _flush()
+
+
+def parse_shard(spec: str) -> Tuple[int, int]:
+    """解析 "i/N"（i 从 0 开始）。"""
+    try:
+        i, n = (int(x) for x in spec.split("/", 1))
+    except ValueError:
+        raise ValueError(f"分片格式应为 i/N，例如 0/4: {spec}")
+    if n < 1 or not 0 <= i < n:
+        raise ValueError(f"分片编号需满足 0 <= i < N: {spec}")
+    return i, n
+
+
+def shard_of(doc_id: str, n: int) -> int:
+    """
+    按规范主键稳定分片：同一文档（无论哪种写法）在每台机器上都落到同一分片。
+
+    前提是主键不依赖本机环境：未解析出 pageId 的 display URL（CanonicalInput.unresolved）不能参与分片。
+    """
+    return int.from_bytes(hashlib.sha1(doc_id.encode("utf-8")).digest()[:8], "big") % n
+
+
+def merged_report(canon: List[CanonicalInput]) -> List[dict]:
+    """返回被合并（同一文档出现多次）的输入分组。"""
+    return [
+        {"doc_id": c.doc_id, "source": c.source, "inputs": c.inputs}
+        for c in canon if len(c.inputs) > 1
+    ]
+
+
+def print_dedup_summary(total: int, canon: List[CanonicalInput]) -> None:
+    for g in merged_report(canon):
+        print(f"合并重复输入 -> {g['doc_id']}:\n  " + "\n  ".join(g["inputs"]))
+    print(f"输入 {total} 条，去重后 {len(canon)} 个文档")
+
+
+def _parse_args(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="规范化并去重 Confluence URL / 本地文件输入")
+    parser.add_argument("inputs", nargs="*", help="URL 或本地路径；不提供时从标准输入逐行读取")
+    parser.add_argument("--offline", action="store_true", help="不访问 Confluence 解析 /display/ 标题")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = _parse_args(argv or sys.argv[1:])
+    inputs = args.inputs or [line.rstrip("\n") for line in sys.stdin]
+    canon = canonicalize_inputs(inputs, resolver=None if args.offline else confluence_title_resolver)
+    for c in canon:
+        print(json.dumps({"doc_id": c.doc_id, "source": c.source, "inputs": c.inputs}, ensure_ascii=False))
+    print_dedup_summary(len([i for i in inputs if i.strip()]), canon)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())